@@ -1,6 +1,7 @@
 from fastapi import FastAPI, HTTPException, Depends, Header, UploadFile, File, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
 from typing import Optional, List, Any
 from datetime import datetime, timezone, timedelta
@@ -13,6 +14,10 @@ import mimetypes
 import logging
 import threading
 import time
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import smtplib
 import ssl
 from email.mime.text import MIMEText
@@ -20,19 +25,43 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email import encoders
 from pathlib import Path
-from pymongo import MongoClient
+from collections import OrderedDict
+from zoneinfo import ZoneInfo
+import functools
+import heapq
+from functools import lru_cache
+from io import BytesIO
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import secrets
+import socket
 import hashlib
+import random
 import re
 
 # SendGrid import
 try:
     from sendgrid import SendGridAPIClient
-    from sendgrid.helpers.mail import Mail
+    from sendgrid.helpers.mail import Attachment, Disposition, FileContent, FileName, FileType, Mail
     SENDGRID_AVAILABLE = True
 except ImportError:
     SENDGRID_AVAILABLE = False
 
+# tiktoken import (prompt token budgeting)
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+# boto3 import (S3-compatible upload storage)
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+    BOTO3_AVAILABLE = True
+except ImportError:
+    BOTO3_AVAILABLE = False
+
 load_dotenv(os.path.join(os.path.dirname(__file__), ".env"))
 
 # MongoDB setup
@@ -48,7 +77,7 @@ app = FastAPI(title="KommunalCRM API", version="1.0.0")
 
 UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
-app.mount("/api/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+CACHE_DIR = os.environ.get("CACHE_DIR") or os.path.join(os.path.dirname(__file__), "cache")
 
 # CORS
 app.add_middleware(
@@ -313,7 +342,6 @@ def ensure_app_owner_user(email: str):
 
 
 logger = logging.getLogger("kommunalcrm")
-reminder_scheduler_started = False
 
 def get_openai_key():
     api_key = os.environ.get("EMERGENT_LLM_KEY")
@@ -379,6 +407,7 @@ async def register(user: UserCreate):
         "created_date": datetime.now(timezone.utc).isoformat()
     }
     result = db.users.insert_one(user_doc)
+    bump_audience_version(org_slug)
     token = create_token(str(result.inserted_id))
     user_doc["id"] = str(result.inserted_id)
     if "_id" in user_doc:
@@ -454,8 +483,10 @@ Bitte klicken Sie auf diesen Link, um Ihr Passwort zurückzusetzen:
 Wenn Sie diese Anfrage nicht gestellt haben, können Sie diese E-Mail ignorieren."""
 
 
+    # Urgent: never held for the notification digest
     try:
-        send_email_via_sendgrid(
+        await asyncio.to_thread(
+            send_email_via_sendgrid,
             to_list=[normalized_email],
             subject="Passwort zurücksetzen",
             body=body,
@@ -572,6 +603,7 @@ async def update_me(
         raise HTTPException(status_code=404, detail="User not found")
     
     user = db.users.find_one({"_id": ObjectId(user_id)})
+    bump_audience_version(user.get("organization"))
     user_doc = serialize_doc(user)
     if "password" in user_doc:
         del user_doc["password"]
@@ -614,9 +646,17 @@ def create_crud_routes(collection_name: str, entity_name: str):
     
     @app.post(f"/api/{collection_name}")
     async def create_item(data: dict):
+        if collection_name in REMINDER_COLLECTIONS:
+            validate_reminder_fields(data)
         data["created_date"] = datetime.now(timezone.utc).isoformat()
         data["updated_date"] = datetime.now(timezone.utc).isoformat()
         result = db[collection_name].insert_one(data)
+        if collection_name in AUDIENCE_COLLECTIONS:
+            bump_audience_version(data.get("organization"))
+        if collection_name in REMINDER_COLLECTIONS:
+            reminder_scheduler.schedule(collection_name, {**data, "_id": result.inserted_id})
+        if collection_name == "support_tickets":
+            notify_support_ticket(data)
         data["id"] = str(result.inserted_id)
         if "_id" in data:
             del data["_id"]
@@ -624,11 +664,15 @@ def create_crud_routes(collection_name: str, entity_name: str):
     
     @app.put(f"/api/{collection_name}/{{item_id}}")
     async def update_item(item_id: str, data: dict):
+        if collection_name in REMINDER_COLLECTIONS:
+            validate_reminder_fields(data)
         data["updated_date"] = datetime.now(timezone.utc).isoformat()
         if "_id" in data:
             del data["_id"]
         if "id" in data:
             del data["id"]
+        # Status notifications compare against the ticket as it was before this write
+        previous = db[collection_name].find_one({"_id": ObjectId(item_id)}, {"status": 1}) if collection_name == "support_tickets" else None
         result = db[collection_name].update_one(
             {"_id": ObjectId(item_id)},
             {"$set": data}
@@ -636,13 +680,27 @@ def create_crud_routes(collection_name: str, entity_name: str):
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail=f"{entity_name} not found")
         doc = db[collection_name].find_one({"_id": ObjectId(item_id)})
+        if previous is not None:
+            notify_support_ticket(doc, previous)
+        if collection_name in AUDIENCE_COLLECTIONS:
+            bump_audience_version(doc.get("organization"))
+        if collection_name in REMINDER_COLLECTIONS:
+            reminder_scheduler.schedule(collection_name, doc)
         return serialize_doc(doc)
     
     @app.delete(f"/api/{collection_name}/{{item_id}}")
     async def delete_item(item_id: str):
+        if collection_name in AUDIENCE_COLLECTIONS:
+            doc = db[collection_name].find_one_and_delete({"_id": ObjectId(item_id)}, {"organization": 1})
+            if doc is None:
+                raise HTTPException(status_code=404, detail=f"{entity_name} not found")
+            bump_audience_version(doc.get("organization"))
+            return {"success": True}
         result = db[collection_name].delete_one({"_id": ObjectId(item_id)})
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail=f"{entity_name} not found")
+        if collection_name in REMINDER_COLLECTIONS:
+            reminder_scheduler.unschedule(collection_name, item_id)
         return {"success": True}
     
     return list_items, get_item, create_item, update_item, delete_item
@@ -727,6 +785,7 @@ async def update_user(user_id: str, data: dict):
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     doc = db.users.find_one({"_id": ObjectId(user_id)})
+    bump_audience_version(doc.get("organization"))
     result = serialize_doc(doc)
     if "password" in result:
         del result["password"]
@@ -760,6 +819,7 @@ async def update_user_role(user_id: str, request: RoleUpdateRequest):
         raise HTTPException(status_code=404, detail="User not found")
     
     doc = db.users.find_one({"_id": ObjectId(user_id)})
+    bump_audience_version(doc.get("organization"))
     serialized = serialize_doc(doc)
     if "password" in serialized:
         del serialized["password"]
@@ -768,7 +828,12 @@ async def update_user_role(user_id: str, request: RoleUpdateRequest):
 # Health check
 @app.get("/api/health")
 async def health():
-    return {"status": "healthy", "timestamp": datetime.now(timezone.utc).isoformat()}
+    return {
+        "status": "healthy",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "circuit_breakers": {name: breaker.stats() for name, breaker in list(circuit_breakers.items())},
+        "smtp_pool": smtp_pool.stats(),
+    }
 
 @app.get("/health")
 async def root_health():
@@ -827,17 +892,282 @@ async def global_search(q: str, organization: str):
 
     return {"results": results}
 
+# ============ STORAGE ============
+
+class TTLCache:
+    """In-memory LRU cache whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskLRUCache:
+    """Size-bounded file cache on local disk; least recently used entries are evicted first."""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        existing = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith(".tmp") or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            existing.append((stat.st_atime, name, stat.st_size))
+        for _, name, size in sorted(existing):
+            self._entries[name] = size
+            self._total_bytes += size
+        with self._lock:
+            self._evict()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def get_path(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        with self._lock:
+            if key not in self._entries:
+                return None
+            if not os.path.exists(path):
+                self._total_bytes -= self._entries.pop(key)
+                return None
+            self._entries.move_to_end(key)
+        try:
+            # Record recency in atime only so content-hash memos keyed on mtime stay valid
+            os.utime(path, (time.time(), os.stat(path).st_mtime))
+        except OSError:
+            pass
+        return path
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self.get_path(key)
+        if not path:
+            return None
+        try:
+            with open(path, "rb") as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def put(self, key: str, data: bytes) -> str:
+        path = self._path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+            self._evict()
+        return path
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._total_bytes, "max_bytes": self.max_bytes}
+
+
+class LocalStorage:
+    """Uploads stored on the local filesystem below UPLOAD_DIR."""
+
+    name = "local"
+    supports_presigned = False
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def save(self, key: str, data: bytes, content_type: Optional[str] = None):
+        with open(self._path(key), "wb") as buffer:
+            buffer.write(data)
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self._path(key))
+
+    def open(self, key: str):
+        return open(self._path(key), "rb")
+
+    def read(self, key: str) -> bytes:
+        with self.open(key) as file:
+            return file.read()
+
+    def local_path(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        return path if os.path.isfile(path) else None
+
+    def presign_upload(self, key: str, content_type: Optional[str] = None):
+        return None
+
+    def presign_download(self, key: str):
+        return None
+
+
+class S3Storage:
+    """Uploads stored in an S3-compatible bucket (AWS S3, MinIO, ...).
+
+    Objects are mirrored into a size-bounded local cache on first access so that
+    PyMuPDF/Pillow can keep working on file paths.
+    """
+
+    name = "s3"
+    supports_presigned = True
+
+    def __init__(self, bucket: str, prefix: str = "uploads/", endpoint_url: Optional[str] = None, region: Optional[str] = None,
+                 access_key: Optional[str] = None, secret_key: Optional[str] = None, presign_expiry: int = 900,
+                 mirror_max_bytes: int = 512 * 1024 * 1024):
+        if not BOTO3_AVAILABLE:
+            raise RuntimeError("boto3 not installed for S3 storage")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.presign_expiry = presign_expiry
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+        )
+        self.mirror = DiskLRUCache(os.path.join(CACHE_DIR, "storage"), mirror_max_bytes)
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    def save(self, key: str, data: bytes, content_type: Optional[str] = None):
+        extra = {"ContentType": content_type} if content_type else {}
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data, **extra)
+        self.mirror.put(key, data)
+
+    def exists(self, key: str) -> bool:
+        if self.mirror.get_path(key):
+            return True
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+            return True
+        except ClientError:
+            return False
+
+    def open(self, key: str):
+        path = self.mirror.get_path(key)
+        if path:
+            return open(path, "rb")
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(key))["Body"]
+
+    def read(self, key: str) -> bytes:
+        file = self.open(key)
+        try:
+            return file.read()
+        finally:
+            file.close()
+
+    def local_path(self, key: str) -> Optional[str]:
+        path = self.mirror.get_path(key)
+        if path:
+            return path
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError:
+            return None
+        return self.mirror.put(key, response["Body"].read())
+
+    def presign_upload(self, key: str, content_type: Optional[str] = None):
+        params = {"Bucket": self.bucket, "Key": self._key(key)}
+        if content_type:
+            params["ContentType"] = content_type
+        url = self.client.generate_presigned_url("put_object", Params=params, ExpiresIn=self.presign_expiry)
+        return {"url": url, "method": "PUT", "headers": {"Content-Type": content_type} if content_type else {}}
+
+    def presign_download(self, key: str):
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self._key(key)},
+            ExpiresIn=self.presign_expiry,
+        )
+
+
+def create_storage():
+    backend = (os.environ.get("STORAGE_BACKEND") or "local").lower()
+    if backend == "s3":
+        bucket = os.environ.get("S3_BUCKET")
+        if not bucket:
+            raise RuntimeError("S3_BUCKET must be set for STORAGE_BACKEND=s3")
+        return S3Storage(
+            bucket=bucket,
+            prefix=os.environ.get("S3_PREFIX", "uploads/"),
+            endpoint_url=os.environ.get("S3_ENDPOINT_URL") or None,
+            region=os.environ.get("S3_REGION") or None,
+            access_key=os.environ.get("S3_ACCESS_KEY_ID") or None,
+            secret_key=os.environ.get("S3_SECRET_ACCESS_KEY") or None,
+            presign_expiry=int(os.environ.get("S3_PRESIGN_EXPIRY", 900)),
+            mirror_max_bytes=int(os.environ.get("STORAGE_MIRROR_MAX_BYTES", 512 * 1024 * 1024)),
+        )
+    return LocalStorage(UPLOAD_DIR)
+
+
+storage = create_storage()
+
+if storage.supports_presigned:
+    @app.get("/api/uploads/{filename}")
+    async def redirect_upload(filename: str):
+        if not await asyncio.to_thread(storage.exists, filename):
+            raise HTTPException(status_code=404, detail="File not found")
+        return RedirectResponse(storage.presign_download(filename))
+else:
+    app.mount("/api/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+
+
 # ============ FILE UPLOADS ============
 
+def build_upload_key(file_name: str) -> str:
+    return f"{uuid.uuid4().hex}_{os.path.basename(file_name)}"
+
+
 @app.post("/api/files/upload")
 async def upload_file(file: UploadFile = File(...)):
     if not file.filename:
         raise HTTPException(status_code=400, detail="No file provided")
-    filename = f"{uuid.uuid4().hex}_{file.filename}"
-    file_path = os.path.join(UPLOAD_DIR, filename)
+    filename = build_upload_key(file.filename)
     content = await file.read()
-    with open(file_path, "wb") as buffer:
-        buffer.write(content)
+    # boto3 blocks; keep S3 round trips off the event loop
+    await asyncio.to_thread(storage.save, filename, content, file.content_type)
     return {
         "file_url": f"/api/uploads/{filename}",
         "file_name": file.filename,
@@ -846,267 +1176,2083 @@ async def upload_file(file: UploadFile = File(...)):
     }
 
 
+class PresignUploadRequest(BaseModel):
+    file_name: str
+    content_type: Optional[str] = None
+
+
+@app.post("/api/files/presign-upload")
+async def presign_upload(request: PresignUploadRequest):
+    """Return a direct upload target so large files bypass the API process"""
+    if not request.file_name:
+        raise HTTPException(status_code=400, detail="No file provided")
+    filename = build_upload_key(request.file_name)
+    target = storage.presign_upload(filename, request.content_type)
+    if not target:
+        return {"direct": False, "upload_url": "/api/files/upload", "method": "POST"}
+    return {
+        "direct": True,
+        "upload_url": target["url"],
+        "method": target["method"],
+        "headers": target["headers"],
+        "file_url": f"/api/uploads/{filename}",
+        "file_name": request.file_name,
+    }
+
+
+@app.get("/api/files/presign-download")
+async def presign_download(file_url: str):
+    key = resolve_upload_key(file_url)
+    if not await asyncio.to_thread(storage.exists, key):
+        raise HTTPException(status_code=404, detail="File not found")
+    return {"url": storage.presign_download(key) or f"/api/uploads/{key}"}
+
+
 # ============ FILE HELPERS ============
 
-def resolve_upload_path(file_url: str) -> str:
+def resolve_upload_key(file_url: str) -> str:
     if not file_url:
         raise HTTPException(status_code=400, detail="file_url is required")
     if "/api/uploads/" in file_url:
         filename = file_url.split("/api/uploads/")[1]
     else:
         raise HTTPException(status_code=400, detail="Invalid file_url")
-    file_path = os.path.join(UPLOAD_DIR, filename)
-    if not os.path.exists(file_path):
+    if not filename or os.path.basename(filename) != filename:
+        raise HTTPException(status_code=400, detail="Invalid file_url")
+    return filename
+
+
+def read_upload_head(key: str, size: int) -> bytes:
+    with storage.open(key) as stream:
+        return stream.read(size)
+
+
+def resolve_upload_path(file_url: str) -> str:
+    file_path = storage.local_path(resolve_upload_key(file_url))
+    if not file_path:
         raise HTTPException(status_code=404, detail="File not found")
     return file_path
 
 
-def load_file_images(file_url: str, max_pages: int = 2):
-    file_path = resolve_upload_path(file_url)
-    mime_type, _ = mimetypes.guess_type(file_path)
+# Keyed by path, mtime and size, so a replaced file is hashed again
+file_hash_memo = TTLCache(
+    max_entries=int(os.environ.get("FILE_HASH_MEMO_MAX_ENTRIES", 4096)),
+    ttl=float(os.environ.get("FILE_HASH_MEMO_TTL_SECONDS", 24 * 3600)),
+)
+file_hash_memo_lock = threading.Lock()
 
-    if mime_type == "application/pdf":
+
+def file_content_hash(file_path: str) -> str:
+    stat = os.stat(file_path)
+    memo_key = (file_path, stat.st_mtime_ns, stat.st_size)
+    with file_hash_memo_lock:
+        cached = file_hash_memo.get(memo_key)
+    if cached:
+        return cached
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    content_hash = digest.hexdigest()
+    with file_hash_memo_lock:
+        file_hash_memo.set(memo_key, content_hash)
+    return content_hash
+
+
+# ============ CPU WORKERS ============
+
+class CpuTaskError(Exception):
+    """Error raised inside a worker process; converted to an HTTPException by the caller."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class CpuTaskPool:
+    """Bounded process pool for CPU-heavy conversions with queue-depth backpressure."""
+
+    def __init__(self, max_workers: int, queue_limit: int, retry_after: int):
+        self.max_workers = max_workers
+        self.queue_limit = queue_limit
+        self.retry_after = retry_after
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            # spawn avoids forking the Mongo client and scheduler threads into the workers
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.queue_limit:
+                raise HTTPException(
+                    status_code=429,
+                    detail="Server ist ausgelastet. Bitte in Kürze erneut versuchen.",
+                    headers={"Retry-After": str(self.retry_after)},
+                )
+            self._pending += 1
+            executor = self._get_executor()
         try:
-            import fitz  # PyMuPDF
-        except ImportError as exc:
-            raise HTTPException(status_code=500, detail="PyMuPDF not installed for PDF processing") from exc
-        images = []
-        doc = fitz.open(file_path)
-        for page_index in range(min(len(doc), max_pages)):
-            page = doc.load_page(page_index)
-            pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-            img_bytes = pix.tobytes("png")
-            images.append(("image/png", base64.b64encode(img_bytes).decode()))
+            return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+        except CpuTaskError as exc:
+            raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+        except BrokenProcessPool:
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False)
+            raise HTTPException(status_code=503, detail="Konvertierung fehlgeschlagen. Bitte erneut versuchen.")
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def stats(self):
+        with self._lock:
+            return {"workers": self.max_workers, "pending": self._pending, "queue_limit": self.queue_limit}
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+RENDER_POOL_WORKERS = int(os.environ.get("RENDER_POOL_WORKERS") or (os.cpu_count() or 2))
+cpu_pool = CpuTaskPool(
+    max_workers=RENDER_POOL_WORKERS,
+    queue_limit=int(os.environ.get("RENDER_QUEUE_LIMIT") or RENDER_POOL_WORKERS * 4),
+    retry_after=int(os.environ.get("RENDER_RETRY_AFTER_SECONDS", 5)),
+)
+
+
+def rasterize_pdf_pages(file_path: str, page_indexes: List[int], scale: float):
+    """Worker: render PDF pages to base64 PNG. Returns (page_count, {page_index: base64})."""
+    try:
+        import fitz  # PyMuPDF
+    except ImportError as exc:
+        raise CpuTaskError(500, "PyMuPDF not installed for PDF processing") from exc
+    doc = fitz.open(file_path)
+    try:
+        pages = {}
+        for page_index in page_indexes:
+            if page_index >= len(doc):
+                break
+            pix = doc.load_page(page_index).get_pixmap(matrix=fitz.Matrix(scale, scale))
+            pages[page_index] = base64.b64encode(pix.tobytes("png")).decode()
+        return len(doc), pages
+    finally:
         doc.close()
-        if not images:
-            raise HTTPException(status_code=400, detail="PDF contains no renderable pages")
-        return images
 
-    with open(file_path, "rb") as file:
-        data = file.read()
 
-    if mime_type not in {"image/png", "image/jpeg", "image/webp"}:
-        try:
-            from PIL import Image
-        except ImportError as exc:
-            raise HTTPException(status_code=500, detail="Pillow not installed for image conversion") from exc
+def convert_image_to_png_base64(file_path: str) -> str:
+    """Worker: re-encode an image Pillow can read as base64 PNG."""
+    try:
+        from PIL import Image
+    except ImportError as exc:
+        raise CpuTaskError(500, "Pillow not installed for image conversion") from exc
+    try:
         image = Image.open(file_path)
-        from io import BytesIO
         buffer = BytesIO()
         image.save(buffer, format="PNG")
-        data = buffer.getvalue()
-        mime_type = "image/png"
+    except Exception as exc:
+        raise CpuTaskError(400, "File is not a supported image") from exc
+    return base64.b64encode(buffer.getvalue()).decode()
 
-    return [(mime_type, base64.b64encode(data).decode())]
 
+def encode_file_base64(file_path: str) -> str:
+    """Worker: base64-encode a file as-is."""
+    with open(file_path, "rb") as file:
+        return base64.b64encode(file.read()).decode()
 
-def parse_json_response(response_text: str):
-    import json
-    if not response_text:
-        return None
-    clean = response_text.strip()
-    if clean.startswith("```json"):
-        clean = clean[7:]
-    if clean.startswith("```"):
-        clean = clean[3:]
-    if clean.endswith("```"):
-        clean = clean[:-3]
-    clean = clean.strip()
-    try:
-        return json.loads(clean)
-    except json.JSONDecodeError:
-        return {"raw": response_text}
 
+SCAN_IMAGE_FORMATS = {"jpeg": ("JPEG", "image/jpeg"), "webp": ("WEBP", "image/webp")}
 
-async def run_vision_chat(prompt: str, system_message: str, images):
-    from emergentintegrations.llm.chat import LlmChat, UserMessage, ImageContent
 
-    api_key = get_openai_key()
-    chat = LlmChat(
-        api_key=api_key,
-        session_id=f"vision-{datetime.now().timestamp()}",
-        system_message=system_message,
-    ).with_model("openai", "gpt-4o")
+def estimate_skew_angle(gray_image, max_angle: float = 5.0, step: float = 0.5) -> float:
+    """Find the rotation that best aligns text lines with pixel rows (projection profile variance)."""
+    try:
+        import numpy as np
+        from PIL import Image, ImageOps
+    except ImportError:
+        return 0.0
+    sample = gray_image.copy()
+    sample.thumbnail((800, 800))
+    inverted = ImageOps.invert(sample)
+    best_angle, best_score = 0.0, None
+    steps = int(round(max_angle / step))
+    for index in range(-steps, steps + 1):
+        angle = index * step
+        rotated = inverted.rotate(angle, resample=Image.BILINEAR, fillcolor=0)
+        score = float(np.var(np.asarray(rotated, dtype=np.float32).sum(axis=1)))
+        if best_score is None or score > best_score:
+            best_angle, best_score = angle, score
+    return best_angle
+
+
+def autocrop_image(image, tolerance: int = 24, margin: int = 12):
+    """Trim a uniform border (desk, scanner bed) around the document."""
+    from PIL import Image, ImageChops
+
+    gray = image.convert("L")
+    width, height = gray.size
+    corners = sorted(gray.getpixel(point) for point in [(0, 0), (width - 1, 0), (0, height - 1), (width - 1, height - 1)])
+    background = (corners[1] + corners[2]) // 2
+    mask = ImageChops.difference(gray, Image.new("L", gray.size, background)).point(lambda p: 255 if p > tolerance else 0)
+    bbox = mask.getbbox()
+    if not bbox:
+        return image
+    left, top, right, bottom = bbox
+    box = (max(0, left - margin), max(0, top - margin), min(width, right + margin), min(height, bottom + margin))
+    if (box[2] - box[0]) * (box[3] - box[1]) > 0.97 * width * height:
+        return image
+    return image.crop(box)
+
+
+def preprocess_scan_image(b64_data: str, options: dict):
+    """Worker: shrink a scan before it is sent to the vision model.
+
+    Returns (mime_type, base64, stats). Steps are controlled by ``options``:
+    autocrop, deskew, grayscale, max_edge, format, quality, max_bytes.
+    """
+    try:
+        from PIL import Image, ImageOps
+    except ImportError as exc:
+        raise CpuTaskError(500, "Pillow not installed for image conversion") from exc
 
-    file_contents = [ImageContent(image_base64=b64) for _, b64 in images]
+    started = time.perf_counter()
     try:
-        response = await chat.send_message(UserMessage(text=prompt, file_contents=file_contents))
+        image = Image.open(BytesIO(base64.b64decode(b64_data)))
+        image = ImageOps.exif_transpose(image)
     except Exception as exc:
-        raise_llm_error(exc)
-    return response
+        raise CpuTaskError(400, "File is not a supported image") from exc
+
+    image = image.convert("L") if options.get("grayscale") else image.convert("RGB")
+    if options.get("autocrop"):
+        image = autocrop_image(image)
+    angle = 0.0
+    if options.get("deskew"):
+        angle = estimate_skew_angle(image if image.mode == "L" else image.convert("L"))
+        if abs(angle) >= 0.5:
+            fill = 255 if image.mode == "L" else (255, 255, 255)
+            image = image.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=fill)
+    max_edge = options.get("max_edge") or 0
+    if max_edge and max(image.size) > max_edge:
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    pil_format, mime_type = SCAN_IMAGE_FORMATS.get(options.get("format"), SCAN_IMAGE_FORMATS["jpeg"])
+    quality = options.get("quality") or 85
+    min_quality = 40
+    max_bytes = options.get("max_bytes") or 0
+    while True:
+        buffer = BytesIO()
+        if pil_format == "JPEG":
+            image.save(buffer, format=pil_format, quality=quality, optimize=True)
+        else:
+            image.save(buffer, format=pil_format, quality=quality, method=4)
+        if not max_bytes or buffer.tell() <= max_bytes or max(image.size) <= 640:
+            break
+        if quality > min_quality:
+            quality = max(min_quality, quality - 10)
+        else:
+            image = image.resize((max(1, int(image.width * 0.8)), max(1, int(image.height * 0.8))), Image.LANCZOS)
+
+    data = buffer.getvalue()
+    stats = {
+        "width": image.width,
+        "height": image.height,
+        "quality": quality,
+        "skew_angle": angle,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+    return mime_type, base64.b64encode(data).decode(), stats
 
 
-# ============ AI ENDPOINTS ============
+# ============ SCAN IMAGES ============
 
-class AIGenerateRequest(BaseModel):
-    prompt: str
-    context: Optional[str] = None
+PDF_RENDER_SCALE = 2
 
-class AIEmailGenerateRequest(BaseModel):
-    topic: str
-    template_type: Optional[str] = None
-    organization_name: Optional[str] = None
+render_cache = DiskLRUCache(
+    os.path.join(CACHE_DIR, "renders"),
+    int(os.environ.get("RENDER_CACHE_MAX_BYTES", 256 * 1024 * 1024)),
+)
 
-@app.post("/api/ai/generate-email")
-async def generate_email(request: AIEmailGenerateRequest):
-    """Generate bulk email content using AI"""
-    from dotenv import load_dotenv
-    load_dotenv()
-    
-    try:
-        from emergentintegrations.llm.chat import LlmChat, UserMessage
-        
-        api_key = get_openai_key()
-        
-        org_name = request.organization_name or "Ortsverband"
-        
-        system_message = f"""Du bist ein Assistent für eine deutsche politische Organisation ({org_name}).
-Du erstellst professionelle E-Mails auf Deutsch.
-Die E-Mails sollen:
-- Einen passenden, prägnanten Betreff haben
-- Einen freundlichen, professionellen Ton haben
-- Ca. 150-250 Wörter im Body haben
-- Mit "Mit freundlichen Grüßen,\nDer Vorstand" enden
 
-WICHTIG: Gib die Antwort IMMER als valides JSON zurück mit exakt diesen Feldern:
-{{"subject": "Betreff hier", "body": "E-Mail Text hier"}}"""
+async def load_file_images(file_url: str, max_pages: int = 2, scale: int = PDF_RENDER_SCALE):
+    file_path = await asyncio.to_thread(resolve_upload_path, file_url)
+    mime_type, _ = mimetypes.guess_type(file_path)
+    content_hash = await asyncio.to_thread(file_content_hash, file_path)
 
-        chat = LlmChat(
-            api_key=api_key,
-            session_id=f"email-{datetime.now().timestamp()}",
-            system_message=system_message
-        ).with_model("openai", "gpt-4o")
-        
-        user_message = UserMessage(text=f"Erstelle eine E-Mail zum Thema: {request.topic}")
-        response = await chat.send_message(user_message)
-        
-        # Try to parse JSON from response
-        import json
-        try:
-            # Clean response - remove markdown code blocks if present
-            clean_response = response.strip()
-            if clean_response.startswith("```json"):
-                clean_response = clean_response[7:]
-            if clean_response.startswith("```"):
-                clean_response = clean_response[3:]
-            if clean_response.endswith("```"):
-                clean_response = clean_response[:-3]
-            clean_response = clean_response.strip()
-            
-            result = json.loads(clean_response)
-            return {"subject": result.get("subject", ""), "body": result.get("body", ""), "success": True}
-        except json.JSONDecodeError:
-            # If JSON parsing fails, try to extract subject and body from text
-            lines = response.strip().split("\n")
-            subject = ""
-            body = response
-            for i, line in enumerate(lines):
-                if line.lower().startswith("betreff:"):
-                    subject = line.replace("Betreff:", "").replace("betreff:", "").strip()
-                    body = "\n".join(lines[i+1:]).strip()
-                    break
-            return {"subject": subject, "body": body, "success": True}
-            
-    except ImportError:
-        raise HTTPException(status_code=500, detail="emergentintegrations not installed")
-    except Exception as e:
-        raise_llm_error(e)
+    if mime_type == "application/pdf":
+        page_count_key = f"{content_hash}.pages"
+        cached_count = render_cache.get(page_count_key)
+        page_count = int(cached_count) if cached_count else max_pages
+        page_keys = {index: f"{content_hash}-p{index}-s{scale}.b64" for index in range(min(page_count, max_pages))}
+        pages = {}
+        for index, key in page_keys.items():
+            cached = render_cache.get(key)
+            if cached:
+                pages[index] = cached.decode()
+
+        missing = [index for index in page_keys if index not in pages]
+        if missing or not cached_count:
+            page_count, rendered = await cpu_pool.run(rasterize_pdf_pages, file_path, missing, scale)
+            render_cache.put(page_count_key, str(page_count).encode())
+            for index, b64 in rendered.items():
+                render_cache.put(page_keys[index], b64.encode())
+                pages[index] = b64
+
+        images = [("image/png", pages[index]) for index in sorted(pages) if index < page_count]
+        if not images:
+            raise HTTPException(status_code=400, detail="PDF contains no renderable pages")
+        return images
 
-class AITextGenerateRequest(BaseModel):
-    prompt: str
-    system_message: Optional[str] = None
-    task_type: Optional[str] = "general"  # motion, meeting, document, etc.
+    if mime_type not in {"image/png", "image/jpeg", "image/webp"}:
+        converted_key = f"{content_hash}-converted.b64"
+        cached = render_cache.get(converted_key)
+        if cached:
+            return [("image/png", cached.decode())]
+        b64 = await cpu_pool.run(convert_image_to_png_base64, file_path)
+        render_cache.put(converted_key, b64.encode())
+        return [("image/png", b64)]
 
-@app.post("/api/ai/generate-text")
-async def generate_text(request: AITextGenerateRequest):
-    """Generic AI text generation endpoint"""
-    from dotenv import load_dotenv
-    load_dotenv()
-    
-    try:
-        from emergentintegrations.llm.chat import LlmChat, UserMessage
-        
-        api_key = get_openai_key()
-        
-        # Default system messages for different tasks
-        default_systems = {
-            "motion": "Du bist ein neutraler, juristisch vorsichtiger Fachautor für kommunale Anträge in Deutschland. Schreibe sachlich, professionell und ohne politische Wertung. Beziehe dich ausschließlich auf das angegebene Thema und erfinde keine Fakten oder Rechtsgrundlagen. Wenn etwas unsicher ist, kennzeichne es allgemein (z. B. Kommunalrecht des Landes / Gemeindeordnung) statt konkrete Paragraphen zu erfinden.",
-            "meeting": "Du bist ein erfahrener Fraktionsgeschäftsführer. Du erstellst professionelle Tagesordnungen und Protokolle für Fraktionssitzungen.",
-            "document": "Du bist ein professioneller Dokumentenanalyst. Du analysierst und fasst Dokumente zusammen.",
-            "general": "Du bist ein hilfreicher Assistent für eine deutsche politische Organisation."
-        }
-        
-        system_msg = request.system_message or default_systems.get(request.task_type, default_systems["general"])
-        
-        chat = LlmChat(
-            api_key=api_key,
-            session_id=f"text-{datetime.now().timestamp()}",
-            system_message=system_msg
-        ).with_model("openai", "gpt-4o")
-        
-        user_message = UserMessage(text=request.prompt)
-        response = await chat.send_message(user_message)
-        
-        return {"content": response, "success": True}
-    except ImportError:
-        raise HTTPException(status_code=500, detail="emergentintegrations not installed")
-    except Exception as e:
-        raise_llm_error(e)
+    return [(mime_type, await cpu_pool.run(encode_file_base64, file_path))]
 
-class AIReceiptScanRequest(BaseModel):
-    file_url: str
-    organization: Optional[str] = None
 
+def env_flag(name: str, default: bool = True) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in {"1", "true", "yes", "on"}
 
-@app.post("/api/ai/scan-receipt")
-async def scan_receipt(request: AIReceiptScanRequest):
-    images = load_file_images(request.file_url)
 
-    system_message = (
-        "Du bist ein Buchhaltungsassistent. Extrahiere die wichtigsten Daten aus einem Beleg. "
-        "Gib NUR valides JSON zurück, ohne zusätzliche Texte."
-    )
+def get_scan_preprocess_options():
+    return {
+        "autocrop": env_flag("SCAN_AUTOCROP"),
+        "deskew": env_flag("SCAN_DESKEW"),
+        "grayscale": env_flag("SCAN_GRAYSCALE"),
+        "max_edge": int(os.environ.get("SCAN_MAX_EDGE", 2000)),
+        "format": (os.environ.get("SCAN_IMAGE_FORMAT") or "jpeg").lower(),
+        "quality": int(os.environ.get("SCAN_IMAGE_QUALITY", 85)),
+        "max_bytes": int(os.environ.get("SCAN_MAX_BYTES", 600 * 1024)),
+    }
 
-    prompt = (
-        "Analysiere den Beleg und extrahiere folgende Felder als JSON:\n"
-        "- description: kurze Beschreibung des Belegs\n"
-        "- vendor: Name des Ausstellers/Lieferanten\n"
-        "- amount: Betrag als Zahl (nur die Zahl, kein EUR-Zeichen)\n"
-        "- date: Datum im Format YYYY-MM-DD\n"
-        "- transaction_type: entweder \"einnahme\" oder \"ausgabe\"\n"
-        "- category: passende Kategorie (einnahme: mitgliedsbeitrag, spende, veranstaltung, zuschuss, sonstiges; ausgabe: personal, raummiete, material, marketing, verwaltung, sonstiges)\n"
-        "- notes: weitere relevante Informationen\n\n"
-        "Antworte NUR mit JSON."
-    )
 
-    response = await run_vision_chat(prompt, system_message, images)
-    data = parse_json_response(response)
-    return {"success": True, "data": data}
+async def prepare_scan_images(file_url: str, max_pages: int = 2):
+    """Load scan images and shrink them for the vision model. Returns (images, metrics)."""
+    started = time.perf_counter()
+    images = await load_file_images(file_url, max_pages=max_pages)
+    metrics = {
+        "pages": len(images),
+        "original_bytes": sum(len(b64) * 3 // 4 for _, b64 in images),
+        "preprocess_ms": 0.0,
+    }
+    if not env_flag("SCAN_PREPROCESS"):
+        metrics["processed_bytes"] = metrics["original_bytes"]
+        metrics["load_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return images, metrics
 
+    import json
+    options = get_scan_preprocess_options()
+    options_hash = hashlib.sha256(json.dumps(options, sort_keys=True).encode()).hexdigest()[:16]
+    content_hash = await asyncio.to_thread(lambda: file_content_hash(resolve_upload_path(file_url)))
+
+    processed = []
+    for index, (mime_type, b64) in enumerate(images):
+        cache_key = f"{content_hash}-p{index}-{options_hash}.pre"
+        cached = render_cache.get(cache_key)
+        if cached:
+            cached_mime, cached_b64 = cached.decode().split("\n", 1)
+            processed.append((cached_mime, cached_b64))
+            continue
+        try:
+            new_mime, new_b64, stats = await cpu_pool.run(preprocess_scan_image, b64, options)
+        except HTTPException as exc:
+            if exc.status_code == 429:
+                raise
+            logger.warning("Scan preprocessing failed, sending original image: %s", exc.detail)
+            processed.append((mime_type, b64))
+            continue
+        metrics["preprocess_ms"] += stats["duration_ms"]
+        if len(new_b64) >= len(b64):
+            new_mime, new_b64 = mime_type, b64
+        render_cache.put(cache_key, f"{new_mime}\n{new_b64}".encode())
+        processed.append((new_mime, new_b64))
+
+    metrics["processed_bytes"] = sum(len(b64) * 3 // 4 for _, b64 in processed)
+    metrics["load_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return processed, metrics
+
+
+def record_scan_metrics(kind: str, file_url: str, organization: Optional[str], metrics: dict):
+    try:
+        db.scan_metrics.insert_one({
+            "kind": kind,
+            "file_url": file_url,
+            "organization": organization,
+            **metrics,
+            "created_date": datetime.now(timezone.utc).isoformat(),
+        })
+    except Exception as exc:
+        logger.warning("Scan metrics not recorded: %s", exc)
 
-class AIBankStatementScanRequest(BaseModel):
-    file_url: str
-    organization: str
 
+# ============ PDF TEXT LAYER ============
 
-@app.post("/api/ai/scan-bank-statement")
-async def scan_bank_statement(request: AIBankStatementScanRequest):
-    images = load_file_images(request.file_url, max_pages=3)
+PDF_TEXT_MIN_CHARS_PER_PAGE = int(os.environ.get("PDF_TEXT_MIN_CHARS_PER_PAGE", 100))
+PDF_TEXT_MAX_CHARS = int(os.environ.get("PDF_TEXT_MAX_CHARS", 40000))
+TEXT_SCAN_MODEL = os.environ.get("TEXT_SCAN_MODEL", "gpt-4o-mini")
 
-    contacts = list(db.contacts.find({"organization": request.organization}))
-    mandate_levies = list(db.mandate_levies.find({"organization": request.organization}))
 
-    contact_names = [f"{c.get('first_name','')} {c.get('last_name','')}".strip() for c in contacts]
-    contact_names = [name for name in contact_names if name]
-    mandate_names = list({m.get("contact_name") for m in mandate_levies if m.get("contact_name")})
+def extract_pdf_text(file_path: str, max_pages: int):
+    """Worker: read the text layer and detected tables of the first pages of a PDF."""
+    try:
+        import fitz  # PyMuPDF
+    except ImportError as exc:
+        raise CpuTaskError(500, "PyMuPDF not installed for PDF processing") from exc
+    doc = fitz.open(file_path)
+    try:
+        pages, tables = [], []
+        for page_index in range(min(len(doc), max_pages)):
+            page = doc.load_page(page_index)
+            pages.append(page.get_text("text"))
+            try:
+                for table in page.find_tables().tables:
+                    rows = [[(cell or "").strip() for cell in row] for row in table.extract()]
+                    if len(rows) > 1:
+                        tables.append(rows)
+            except Exception:
+                # Table detection is best effort; the plain text is still usable
+                pass
+        return {"page_count": len(doc), "pages": pages, "tables": tables}
+    finally:
+        doc.close()
 
-    contact_hint = ", ".join(contact_names[:50])
-    mandate_hint = ", ".join(mandate_names[:50])
 
-    system_message = (
-        "Du bist ein erfahrener Buchhalter. Du erkennst Transaktionen in deutschen Kontoauszügen. "
-        "Gib NUR valides JSON zurück, ohne zusätzliche Texte."
-    )
+def text_layer_usable(pages: List[str]) -> bool:
+    if not pages:
+        return False
+    visible = "".join(ch for ch in "".join(pages) if not ch.isspace())
+    if len(visible) < PDF_TEXT_MIN_CHARS_PER_PAGE * len(pages):
+        return False
+    # Scanned PDFs sometimes carry an OCR layer full of broken glyphs
+    readable = sum(1 for ch in visible if ch.isalnum() or ch in ".,-/:€%")
+    return readable / len(visible) >= 0.7 and visible.count("\ufffd") / len(visible) < 0.01
+
+
+async def load_pdf_text_layer(file_url: str, max_pages: int):
+    """Return the usable text layer of a PDF upload, or None for images and scanned PDFs."""
+    import json
+    file_path = await asyncio.to_thread(resolve_upload_path, file_url)
+    mime_type, _ = mimetypes.guess_type(file_path)
+    if mime_type != "application/pdf":
+        return None
+
+    cache_key = f"{await asyncio.to_thread(file_content_hash, file_path)}-text-{max_pages}.json"
+    cached = render_cache.get(cache_key)
+    if cached:
+        layer = json.loads(cached)
+    else:
+        layer = await cpu_pool.run(extract_pdf_text, file_path, max_pages)
+        layer["usable"] = text_layer_usable(layer["pages"])
+        render_cache.put(cache_key, json.dumps(layer).encode())
+    if not layer["usable"]:
+        return None
+    layer["text"] = "\n\n".join(
+        f"--- Seite {index + 1} ---\n{text.strip()}" for index, text in enumerate(layer["pages"])
+    )[:PDF_TEXT_MAX_CHARS]
+    return layer
+
+
+# ============ BANK TRANSACTIONS ============
+
+TRANSACTION_CATEGORY_KEYWORDS = [
+    ("mandatsabgabe", "einnahme", ("mandatsträgerabgabe", "mandatstraegerabgabe", "mandatsabgabe", "fraktionsabgabe")),
+    ("mitgliedsbeitrag", "einnahme", ("mitgliedsbeitrag", "beitrag")),
+    ("spende", "einnahme", ("spende",)),
+    ("zuschuss", "einnahme", ("zuschuss", "förderung", "foerderung")),
+    ("veranstaltung", None, ("veranstaltung", "sommerfest", "parteitag", "ticket")),
+    ("personal", "ausgabe", ("lohn", "gehalt", "honorar")),
+    ("raummiete", "ausgabe", ("miete",)),
+    ("material", "ausgabe", ("material",)),
+    ("marketing", "ausgabe", ("werbung", "druck", "flyer", "plakat")),
+    ("verwaltung", "ausgabe", ("gebühr", "gebuehr", "entgelt", "kontoführung", "kontofuehrung", "versicherung", "porto")),
+]
+
+
+def categorize_transaction(description: str, sender_receiver: str, transaction_type: str):
+    """Keyword rules mirroring the categories of the bank statement prompt. Returns (category, matched)."""
+    text = f"{description or ''} {sender_receiver or ''}".lower()
+    for category, direction, keywords in TRANSACTION_CATEGORY_KEYWORDS:
+        if direction and direction != transaction_type:
+            continue
+        if any(keyword in text for keyword in keywords):
+            return category, True
+    return "sonstiges", False
+
+
+def parse_german_amount(value) -> Optional[float]:
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).replace("EUR", "").replace("€", "").replace("\xa0", "").replace(" ", "").strip()
+    if not text:
+        return None
+    sign = 1
+    if text[-1:] in ("S", "-"):
+        sign, text = -1, text[:-1]
+    elif text[-1:] in ("H", "+"):
+        text = text[:-1]
+    if text.startswith("-"):
+        sign, text = -sign, text[1:]
+    elif text.startswith("+"):
+        text = text[1:]
+    if "," in text:
+        text = text.replace(".", "").replace(",", ".")
+    elif re.fullmatch(r"[1-9]\d{0,2}(\.\d{3})+", text):
+        # "1.234" is a thousands separator, not a decimal point
+        text = text.replace(".", "")
+    # MT940 writes whole amounts with a bare trailing comma ("50,")
+    if not re.fullmatch(r"\d+(\.\d*)?", text):
+        return None
+    return sign * float(text)
+
+
+def parse_german_date(value, reference: Optional[datetime] = None) -> Optional[str]:
+    """ISO date for ``dd.mm.yyyy``/``dd.mm.``; dates without a year take the latest one not after ``reference``."""
+    text = str(value or "").strip()
+    match = re.match(r"^(\d{4})-(\d{2})-(\d{2})", text)
+    if match:
+        return f"{match.group(1)}-{match.group(2)}-{match.group(3)}"
+    match = re.match(r"^(\d{1,2})\.(\d{1,2})\.(\d{2,4})?", text)
+    if not match:
+        return None
+    day, month, year = int(match.group(1)), int(match.group(2)), match.group(3)
+    if year:
+        year = int(year) + (2000 if len(year) == 2 else 0)
+    elif reference:
+        year = reference.year - (1 if (month, day) > (reference.month, reference.day) else 0)
+    else:
+        return None
+    if not (1 <= month <= 12 and 1 <= day <= 31):
+        return None
+    return f"{year:04d}-{month:02d}-{day:02d}"
+
+
+STATEMENT_COLUMN_ALIASES = {
+    "date": ("buchungstag", "buchungsdatum", "datum", "valuta", "wertstellung"),
+    "description": ("verwendungszweck", "buchungstext", "beschreibung", "vorgang", "text"),
+    "counterparty": ("auftraggeber", "empfänger", "zahlungsbeteiligter", "begünstigter", "name"),
+    "amount": ("betrag", "umsatz"),
+    "debit": ("soll", "lastschrift", "ausgang"),
+    "credit": ("haben", "gutschrift", "eingang"),
+}
+
+
+def detect_statement_columns(header: List[str]):
+    cells = [(cell or "").lower() for cell in header]
+    columns = {}
+    for field, aliases in STATEMENT_COLUMN_ALIASES.items():
+        for alias in aliases:
+            index = next((i for i, cell in enumerate(cells) if alias in cell and i not in columns.values()), None)
+            if index is not None:
+                columns[field] = index
+                break
+    if "date" not in columns or not ({"amount", "debit", "credit"} & columns.keys()):
+        return None
+    return columns
+
+
+def statement_reference_date(text: str) -> datetime:
+    """Latest full date printed on the statement (statement date or period end), falling back to today."""
+    now = datetime.now()
+    dates = []
+    for day, month, year in re.findall(r"\b(\d{1,2})\.(\d{1,2})\.(\d{4}|\d{2})\b", text or ""):
+        try:
+            dates.append(datetime(int(year) + (2000 if len(year) == 2 else 0), int(month), int(day)))
+        except ValueError:
+            continue
+    dates = [value for value in dates if value <= now]
+    return max(dates) if dates else now
+
+
+def parse_statement_tables(tables: List[List[List[str]]], reference: Optional[datetime] = None):
+    """Deterministically read transactions from text-layer tables. Returns None when no table fits."""
+    transactions = []
+    for rows in tables:
+        columns = None
+        for row in rows:
+            if columns is None:
+                columns = detect_statement_columns(row)
+                continue
+
+            def cell(field):
+                index = columns.get(field)
+                return row[index] if index is not None and index < len(row) else ""
+
+            date_value = parse_german_date(cell("date").split("\n")[0], reference)
+            amount = parse_german_amount(cell("amount")) if "amount" in columns else None
+            if amount is None:
+                debit = parse_german_amount(cell("debit"))
+                credit = parse_german_amount(cell("credit"))
+                if debit:
+                    amount = -abs(debit)
+                elif credit:
+                    amount = abs(credit)
+            description = " ".join(cell("description").split())
+            counterparty = " ".join(cell("counterparty").split())
+            if not date_value or amount is None:
+                # Wrapped purpose lines continue the previous booking
+                if transactions and (description or counterparty) and not date_value:
+                    transactions[-1]["description"] = " ".join(
+                        part for part in [transactions[-1]["description"], counterparty, description] if part
+                    )
+                continue
+            transactions.append({
+                "description": description,
+                "sender_receiver": counterparty,
+                "amount": round(abs(amount), 2),
+                "date": date_value,
+                "transaction_type": "einnahme" if amount > 0 else "ausgabe",
+            })
+    return transactions or None
+
+
+def annotate_transactions(transactions: List[dict], contact_names: List[str], mandate_names: List[str], classifier=None):
+    """Fill category, contact/mandate matches and confidence for parsed transactions.
+
+    A confident prediction of the organization's category model wins over the keyword rules.
+    """
+    for transaction in transactions:
+        haystack = f"{transaction.get('sender_receiver', '')} {transaction.get('description', '')}".lower()
+        transaction["matched_contact"] = next((name for name in contact_names if name.lower() in haystack), None)
+        transaction["matched_mandate"] = next((name for name in mandate_names if name.lower() in haystack), None)
+        prediction = predict_category(classifier, transaction)
+        if prediction:
+            transaction["category"] = prediction[0]
+            transaction["category_source"] = "model"
+            transaction["category_probability"] = round(prediction[1], 3)
+            transaction["confidence"] = "hoch"
+            continue
+        category, matched = categorize_transaction(
+            transaction.get("description"), transaction.get("sender_receiver"), transaction.get("transaction_type")
+        )
+        if transaction["matched_mandate"] and transaction.get("transaction_type") == "einnahme" and not matched:
+            category, matched = "mandatsabgabe", True
+        transaction["category"] = category
+        transaction["category_source"] = "rules" if matched else None
+        transaction["confidence"] = "hoch" if matched else "niedrig"
+    return transactions
+
+
+# ============ CATEGORY CLASSIFIER ============
+
+TRANSACTION_CATEGORIES = {
+    "einnahme": ["mitgliedsbeitrag", "spende", "mandatsabgabe", "zuschuss", "veranstaltung", "sonstiges"],
+    "ausgabe": ["personal", "raummiete", "material", "marketing", "verwaltung", "veranstaltung", "sonstiges"],
+}
+CATEGORY_MODEL_MIN_SAMPLES = int(os.environ.get("CATEGORY_MODEL_MIN_SAMPLES", 20))
+CATEGORY_MODEL_MAX_SAMPLES = int(os.environ.get("CATEGORY_MODEL_MAX_SAMPLES", 50000))
+CATEGORY_MODEL_MAX_AGE_SECONDS = float(os.environ.get("CATEGORY_MODEL_MAX_AGE_SECONDS", 3600))
+CATEGORY_MODEL_MIN_CONFIDENCE = float(os.environ.get("CATEGORY_MODEL_MIN_CONFIDENCE", 0.8))
+CATEGORY_TOKEN_PATTERN = re.compile(r"[^\W\d_]{2,}")
+
+
+def transaction_tokens(description: Optional[str], sender_receiver: Optional[str]) -> List[str]:
+    """Word tokens of the purpose text plus prefixed counterparty tokens (the full name counts as one token too)."""
+    tokens = CATEGORY_TOKEN_PATTERN.findall((description or "").lower())
+    counterparty = " ".join((sender_receiver or "").lower().split())
+    if counterparty:
+        tokens.extend(f"cp:{token}" for token in CATEGORY_TOKEN_PATTERN.findall(counterparty))
+        tokens.append(f"cpn:{counterparty}")
+    return tokens
+
+
+class TransactionCategoryModel:
+    """Multinomial naive Bayes over transaction tokens, trained on one organization's bookings."""
+
+    def __init__(self, classes, class_types, vocabulary, log_prior, log_likelihood, samples):
+        import numpy as np
+
+        self.classes = classes
+        self.class_types = class_types
+        # Per transaction type: additive mask ruling out categories of the other direction
+        self.type_masks = {
+            transaction_type: np.where([t == transaction_type for t in class_types], 0.0, -np.inf)
+            for transaction_type in set(class_types)
+        }
+        self.vocabulary = vocabulary
+        self.log_prior = log_prior
+        self.log_likelihood = log_likelihood
+        self.samples = samples
+        self.trained_at = datetime.now(timezone.utc).isoformat()
+
+    @classmethod
+    def train(cls, samples, alpha: float = 1.0):
+        """``samples`` are (tokens, category, transaction_type) tuples."""
+        import numpy as np
+
+        labels = sorted({(category, transaction_type) for _, category, transaction_type in samples})
+        label_index = {label: i for i, label in enumerate(labels)}
+        vocabulary = {}
+        rows, columns = [], []
+        class_counts = np.zeros(len(labels))
+        for tokens, category, transaction_type in samples:
+            row = label_index[(category, transaction_type)]
+            class_counts[row] += 1
+            for token in tokens:
+                rows.append(row)
+                columns.append(vocabulary.setdefault(token, len(vocabulary)))
+        counts = np.zeros((len(labels), max(1, len(vocabulary))))
+        np.add.at(counts, (rows, columns), 1)
+        smoothed = counts + alpha
+        log_likelihood = np.log(smoothed) - np.log(smoothed.sum(axis=1, keepdims=True))
+        log_prior = np.log(class_counts / class_counts.sum())
+        return cls(
+            [category for category, _ in labels],
+            [transaction_type for _, transaction_type in labels],
+            vocabulary,
+            log_prior,
+            log_likelihood,
+            len(samples),
+        )
+
+    def predict(self, description: Optional[str], sender_receiver: Optional[str], transaction_type: Optional[str]):
+        """Return (category, probability) or None when no token is known."""
+        import numpy as np
+
+        indexes = [self.vocabulary[token] for token in transaction_tokens(description, sender_receiver) if token in self.vocabulary]
+        if not indexes:
+            return None
+        scores = self.log_prior + self.log_likelihood[:, indexes].sum(axis=1)
+        if transaction_type:
+            if transaction_type not in self.type_masks:
+                return None
+            scores = scores + self.type_masks[transaction_type]
+        probabilities = np.exp(scores - scores.max())
+        probabilities /= probabilities.sum()
+        best = int(probabilities.argmax())
+        return self.classes[best], float(probabilities[best])
+
+
+def load_category_training_samples(organization: str):
+    samples = []
+    sources = (("incomes", "einnahme", "source"), ("expenses", "ausgabe", "vendor"))
+    for collection, transaction_type, counterparty_field in sources:
+        cursor = db[collection].find(
+            {"organization": organization, "category": {"$nin": [None, ""]}},
+            {"description": 1, "category": 1, counterparty_field: 1},
+        ).sort("_id", -1).limit(CATEGORY_MODEL_MAX_SAMPLES)
+        for doc in cursor:
+            tokens = transaction_tokens(doc.get("description"), doc.get(counterparty_field))
+            if tokens:
+                samples.append((tokens, doc["category"], transaction_type))
+    return samples
+
+
+class CategoryModelRegistry:
+    """Per-organization classifiers, (re)trained on a background thread when missing or stale."""
+
+    def __init__(self, max_age: float, min_samples: int):
+        self.max_age = max_age
+        self.min_samples = min_samples
+        self._models = {}
+        self._training = set()
+        self._lock = threading.Lock()
+
+    def get(self, organization: Optional[str]) -> Optional[TransactionCategoryModel]:
+        """Current model (None until the first training finished); schedules retraining when stale."""
+        if not organization:
+            return None
+        entry = self._models.get(organization)
+        if entry is None or time.monotonic() - entry[0] > self.max_age:
+            self.schedule_training(organization)
+        return entry[1] if entry else None
+
+    def schedule_training(self, organization: str):
+        with self._lock:
+            if organization in self._training:
+                return
+            self._training.add(organization)
+        threading.Thread(target=self._train, args=(organization,), daemon=True).start()
+
+    def _train(self, organization: str):
+        try:
+            started = time.perf_counter()
+            samples = load_category_training_samples(organization)
+            model = TransactionCategoryModel.train(samples) if len(samples) >= self.min_samples else None
+            self._models[organization] = (time.monotonic(), model)
+            logger.info(
+                "Category model for %s trained on %s bookings in %.0f ms",
+                organization, len(samples), (time.perf_counter() - started) * 1000,
+            )
+        except Exception as exc:
+            logger.error("Category model training for %s failed: %s", organization, exc)
+        finally:
+            with self._lock:
+                self._training.discard(organization)
+
+    def stats(self, organization: str):
+        entry = self._models.get(organization)
+        model = entry[1] if entry else None
+        return {
+            "organization": organization,
+            "ready": model is not None,
+            "training": organization in self._training,
+            "samples": model.samples if model else 0,
+            "min_samples": self.min_samples,
+            "categories": sorted(set(model.classes)) if model else [],
+            "vocabulary_size": len(model.vocabulary) if model else 0,
+            "trained_at": model.trained_at if model else None,
+            "min_confidence": CATEGORY_MODEL_MIN_CONFIDENCE,
+        }
+
+
+category_models = CategoryModelRegistry(CATEGORY_MODEL_MAX_AGE_SECONDS, CATEGORY_MODEL_MIN_SAMPLES)
+
+
+def predict_category(classifier: Optional[TransactionCategoryModel], transaction: dict):
+    """Confident model prediction as (category, probability), otherwise None."""
+    if classifier is None:
+        return None
+    prediction = classifier.predict(
+        transaction.get("description"), transaction.get("sender_receiver"), transaction.get("transaction_type")
+    )
+    if prediction and prediction[1] >= CATEGORY_MODEL_MIN_CONFIDENCE:
+        return prediction
+    return None
+
+
+def apply_category_model(transactions: List[dict], classifier: Optional[TransactionCategoryModel]):
+    """Override LLM-extracted categories where the organization's model is confident."""
+    for transaction in transactions:
+        if not isinstance(transaction, dict):
+            continue
+        prediction = predict_category(classifier, transaction)
+        if prediction:
+            transaction["category"] = prediction[0]
+            transaction["category_source"] = "model"
+            transaction["category_probability"] = round(prediction[1], 3)
+        else:
+            transaction["category_source"] = "llm"
+    return transactions
+
+
+async def llm_categorize_transactions(transactions: List[dict], organization: Optional[str]):
+    """Ask the text model for categories of the given (low-confidence) transactions in one call."""
+    import json
+
+    if not transactions:
+        return
+    system_message = (
+        "Du bist ein erfahrener Buchhalter. Ordne Banktransaktionen einer Kategorie zu. "
+        "Gib NUR valides JSON zurück, ohne zusätzliche Texte."
+    )
+    lines = [
+        json.dumps({
+            "i": i,
+            "typ": t.get("transaction_type"),
+            "verwendungszweck": t.get("description"),
+            "gegenpartei": t.get("sender_receiver"),
+        }, ensure_ascii=False)
+        for i, t in enumerate(transactions)
+    ]
+    prompt = (
+        f"Kategorien für einnahme: {', '.join(TRANSACTION_CATEGORIES['einnahme'])}\n"
+        f"Kategorien für ausgabe: {', '.join(TRANSACTION_CATEGORIES['ausgabe'])}\n\n"
+        "Transaktionen:\n" + "\n".join(lines) + "\n\n"
+        "Antworte als JSON im Format {\"categories\": [\"kategorie für i=0\", \"kategorie für i=1\", ...]}."
+    )
+    try:
+        response = await run_text_chat(prompt, system_message, model=TEXT_SCAN_MODEL, use_cache=True, organization=organization)
+    except HTTPException as exc:
+        logger.warning("LLM category fallback failed: %s", exc.detail)
+        return
+    data = parse_json_response(response)
+    categories = data.get("categories") if isinstance(data, dict) else None
+    if not isinstance(categories, list):
+        return
+    for transaction, category in zip(transactions, categories):
+        allowed = TRANSACTION_CATEGORIES.get(transaction.get("transaction_type"), TRANSACTION_CATEGORIES["ausgabe"])
+        if category in allowed:
+            transaction["category"] = category
+            transaction["category_source"] = "llm"
+
+
+@app.get("/api/accounting/category-model")
+async def category_model_status(organization: str):
+    """Training state of the organization's transaction category classifier (starts training if needed)"""
+    category_models.get(organization)
+    return category_models.stats(organization)
+
+
+# ============ BANK STATEMENT FILES (CAMT.053 / MT940) ============
+
+def iter_binary_lines(stream, chunk_size: int = 64 * 1024):
+    """Yield decoded lines from a binary stream without loading it completely."""
+    pending = b""
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        pending += chunk
+        lines = pending.split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield decode_statement_line(line)
+    if pending:
+        yield decode_statement_line(pending)
+
+
+def decode_statement_line(line: bytes) -> str:
+    try:
+        return line.decode("utf-8").rstrip("\r")
+    except UnicodeDecodeError:
+        return line.decode("latin-1").rstrip("\r")
+
+
+def xml_local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def iter_camt053_transactions(stream):
+    """Stream bookings (Ntry) from a CAMT.053/CAMT.052 document in constant memory."""
+    import xml.etree.ElementTree as ET
+
+    stack = []
+    for event, elem in ET.iterparse(stream, events=("start", "end")):
+        if event == "start":
+            stack.append(elem)
+            continue
+        stack.pop()
+        if xml_local_name(elem.tag) != "Ntry":
+            continue
+        transaction = camt_entry_to_transaction(elem)
+        if stack:
+            # Drop processed bookings so the tree never grows with the statement
+            stack[-1].remove(elem)
+        if transaction:
+            yield transaction
+
+
+def camt_entry_to_transaction(entry):
+    values = []
+
+    def walk(elem, path):
+        for child in elem:
+            child_path = path + (xml_local_name(child.tag),)
+            if child.text and child.text.strip():
+                values.append((child_path, child.text.strip(), child.attrib))
+            walk(child, child_path)
+
+    walk(entry, ())
+
+    def first(*suffixes):
+        for suffix in suffixes:
+            for path, text, _ in values:
+                if path[-len(suffix):] == suffix:
+                    return text
+        return None
+
+    # CAMT amounts are xs:decimal ("1.500" is one and a half), so they skip the German parsing
+    try:
+        amount = float(first(("Amt",)) or "")
+    except ValueError:
+        return None
+    # Reversals (RvslInd) already carry their own booking direction in CdtDbtInd
+    credit = first(("CdtDbtInd",)) == "CRDT"
+    party = "Dbtr" if credit else "Cdtr"
+    counterparty = first(
+        ("RltdPties", party, "Nm"), ("RltdPties", party, "Pty", "Nm"),
+        ("RltdPties", f"Ultmt{party}", "Nm"), ("RltdPties", f"Ultmt{party}", "Pty", "Nm"),
+    )
+    purpose = " ".join(text for path, text, _ in values if path[-1] == "Ustrd")
+    description = purpose or first(("AddtlTxInf",), ("AddtlNtryInf",)) or ""
+    return {
+        "description": " ".join(description.split()),
+        "sender_receiver": counterparty or "",
+        "amount": round(abs(amount), 2),
+        "date": parse_german_date(first(("BookgDt", "Dt"), ("BookgDt", "DtTm"), ("ValDt", "Dt"))),
+        "transaction_type": "einnahme" if credit else "ausgabe",
+    }
+
+
+MT940_STATEMENT_LINE = re.compile(r"^(\d{6})(\d{4})?(R?[CD])([A-Z])?(\d+,\d{0,2})")
+
+
+def iter_mt940_fields(lines):
+    """Group MT940 lines into (tag, value) fields; continuation lines are appended."""
+    tag, value = None, []
+    for line in lines:
+        match = re.match(r"^:(\d{2}[A-Z]?):(.*)$", line)
+        if match:
+            if tag:
+                yield tag, value
+            tag, value = match.group(1), [match.group(2)]
+        elif tag and line and not line.startswith(("-", "{")):
+            value.append(line)
+    if tag:
+        yield tag, value
+
+
+def parse_mt940_details(lines: List[str]):
+    """Split a :86: field into (counterparty, purpose); handles the German ?xx subfield layout."""
+    text = "".join(lines)
+    if "?" not in text:
+        return "", " ".join(" ".join(lines).split())
+    fields = {}
+    for part in text.split("?")[1:]:
+        code, content = part[:2], part[2:]
+        fields.setdefault(code, []).append(content)
+    purpose_codes = [f"{number:02d}" for number in list(range(20, 30)) + list(range(60, 64))]
+    purpose = "".join("".join(fields.get(code, [])) for code in purpose_codes)
+    purpose = re.sub(r"^(SVWZ|EREF|KREF|MREF|CRED|ABWA)\+", "", purpose)
+    counterparty = "".join(fields.get("32", []) + fields.get("33", []))
+    return " ".join(counterparty.split()), " ".join((purpose or "".join(fields.get("00", []))).split())
+
+
+def iter_mt940_transactions(stream):
+    """Stream bookings (:61: with its :86: details) from an MT940 export in constant memory."""
+    import xml.etree.ElementTree as ET
+
+    current = None
+    for tag, value in iter_mt940_fields(iter_binary_lines(stream)):
+        if tag == "61":
+            if current:
+                yield current
+            current = None
+            match = MT940_STATEMENT_LINE.match(value[0])
+            if not match:
+                continue
+            booking_date, _, mark, _, amount_text = match.groups()
+            amount = parse_german_amount(amount_text)
+            if amount is None:
+                raise ET.ParseError(f"Ungültiger Betrag in Zeile :61:{value[0]}")
+            credit = mark in ("C", "RD")
+            current = {
+                "description": "",
+                "sender_receiver": "",
+                "amount": round(abs(amount), 2),
+                "date": f"20{booking_date[:2]}-{booking_date[2:4]}-{booking_date[4:6]}",
+                "transaction_type": "einnahme" if credit else "ausgabe",
+            }
+        elif tag == "86" and current:
+            current["sender_receiver"], current["description"] = parse_mt940_details(value)
+        elif tag.startswith("62") and current:
+            yield current
+            current = None
+    if current:
+        yield current
+
+
+def detect_statement_format(file_name: str, head: bytes) -> Optional[str]:
+    lower = file_name.lower()
+    stripped = head.lstrip(b"\xef\xbb\xbf \r\n\t")
+    if lower.endswith(".xml") or stripped.startswith(b"<"):
+        return "camt053"
+    if lower.endswith((".sta", ".mt940", ".940")) or stripped.startswith((b":20:", b"{1:")) or b"\n:20:" in head:
+        return "mt940"
+    return None
+
+
+# ============ IMAGE DERIVATIVES ============
+
+IMAGE_DERIVATIVE_FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "jpg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+}
+IMAGE_DERIVATIVE_MAX_EDGE = 4096
+
+derivative_cache = DiskLRUCache(
+    os.path.join(CACHE_DIR, "derivatives"),
+    int(os.environ.get("IMAGE_CACHE_MAX_BYTES", 256 * 1024 * 1024)),
+)
+
+
+def render_image_derivative(file_path: str, width: Optional[int], height: Optional[int], image_format: str, quality: int) -> bytes:
+    """Worker: resize and re-encode an image or the first PDF page."""
+    try:
+        from PIL import Image
+    except ImportError as exc:
+        raise CpuTaskError(500, "Pillow not installed for image conversion") from exc
+
+    mime_type, _ = mimetypes.guess_type(file_path)
+    if mime_type == "application/pdf":
+        try:
+            import fitz  # PyMuPDF
+        except ImportError as exc:
+            raise CpuTaskError(500, "PyMuPDF not installed for PDF processing") from exc
+        doc = fitz.open(file_path)
+        try:
+            if len(doc) == 0:
+                raise CpuTaskError(400, "PDF contains no renderable pages")
+            page = doc.load_page(0)
+            target = max(width or 0, height or 0) or IMAGE_DERIVATIVE_MAX_EDGE // 2
+            scale = min(4.0, max(0.1, target / max(page.rect.width, page.rect.height)))
+            pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale))
+            image = Image.open(BytesIO(pix.tobytes("png")))
+        finally:
+            doc.close()
+    else:
+        try:
+            image = Image.open(file_path)
+            image.load()
+        except Exception as exc:
+            raise CpuTaskError(400, "File is not a supported image") from exc
+
+    if width or height:
+        image.thumbnail((width or IMAGE_DERIVATIVE_MAX_EDGE, height or IMAGE_DERIVATIVE_MAX_EDGE), Image.LANCZOS)
+
+    pil_format, _ = IMAGE_DERIVATIVE_FORMATS[image_format]
+    if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        rgba = image.convert("RGBA")
+        background.paste(rgba, mask=rgba.split()[-1])
+        image = background
+    elif image.mode not in ("RGB", "RGBA", "L", "LA"):
+        image = image.convert("RGBA")
+
+    buffer = BytesIO()
+    save_options = {"optimize": True}
+    if pil_format in ("JPEG", "WEBP"):
+        save_options["quality"] = quality
+    image.save(buffer, format=pil_format, **save_options)
+    return buffer.getvalue()
+
+
+@app.get("/api/files/derivative")
+async def get_file_derivative(
+    file_url: str,
+    width: Optional[int] = Query(None, ge=1, le=IMAGE_DERIVATIVE_MAX_EDGE),
+    height: Optional[int] = Query(None, ge=1, le=IMAGE_DERIVATIVE_MAX_EDGE),
+    format: Optional[str] = "webp",
+    quality: Optional[int] = Query(80, ge=1, le=100),
+):
+    """Serve a resized/re-encoded variant of an uploaded image (or the first page of a PDF)"""
+    image_format = (format or "webp").lower()
+    if image_format not in IMAGE_DERIVATIVE_FORMATS:
+        raise HTTPException(status_code=400, detail="Unsupported format")
+    _, media_type = IMAGE_DERIVATIVE_FORMATS[image_format]
+
+    file_path = await asyncio.to_thread(resolve_upload_path, file_url)
+    params = f"w={width or 0}&h={height or 0}&f={image_format}&q={quality}"
+    content_hash = await asyncio.to_thread(file_content_hash, file_path)
+    key = hashlib.sha256(f"{content_hash}|{params}".encode()).hexdigest()
+    cache_key = f"{key}.{image_format}"
+
+    # Read the bytes rather than serving the path: a concurrent eviction may delete the file before it is sent
+    data = await asyncio.to_thread(derivative_cache.get, cache_key)
+    if data is None:
+        data = await cpu_pool.run(render_image_derivative, file_path, width, height, image_format, quality)
+        await asyncio.to_thread(derivative_cache.put, cache_key, data)
+
+    return Response(
+        content=data,
+        media_type=media_type,
+        headers={"Cache-Control": "public, max-age=31536000, immutable"},
+    )
+
+
+# ============ RESILIENCE ============
+
+class CircuitOpenError(Exception):
+    """Raised without calling the dependency while its circuit breaker is open."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} ist vorübergehend nicht erreichbar")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Opens after consecutive transient failures; after ``reset_timeout`` a single probe call may close it again."""
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = None
+        self.rejected = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def check(self):
+        """Fail fast while open without claiming the half-open probe."""
+        with self._lock:
+            if self.state == "open":
+                remaining = self.opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, remaining)
+
+    def before_call(self):
+        with self._lock:
+            if self.state == "open":
+                remaining = self.opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, remaining)
+                self.state = "half_open"
+            if self.state == "half_open":
+                if self._probing:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, self.reset_timeout)
+                self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probing = False
+
+    def release(self):
+        """End a call that says nothing about the dependency's health (e.g. cancelled by the client)."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self, error: Exception):
+        with self._lock:
+            self.failures += 1
+            self.last_error = f"{type(error).__name__}: {error}"[:200]
+            self._probing = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning("Circuit breaker %s opened: %s", self.name, self.last_error)
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def stats(self):
+        retry_after = None
+        if self.state == "open":
+            retry_after = round(max(0.0, self.opened_at + self.reset_timeout - time.monotonic()), 1)
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "retry_after_seconds": retry_after,
+            "last_error": self.last_error,
+        }
+
+
+circuit_breakers = {}
+circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    with circuit_breakers_lock:
+        breaker = circuit_breakers.get(name)
+        if breaker is None:
+            breaker = circuit_breakers[name] = CircuitBreaker(
+                name,
+                failure_threshold=int(os.environ.get("BREAKER_FAILURE_THRESHOLD", 5)),
+                reset_timeout=float(os.environ.get("BREAKER_RESET_SECONDS", 30)),
+            )
+        return breaker
+
+
+for dependency in ("llm", "sendgrid"):
+    get_circuit_breaker(dependency)
+
+
+RETRY_MAX_ATTEMPTS = int(os.environ.get("RETRY_MAX_ATTEMPTS", 3))
+RETRY_BASE_DELAY_SECONDS = float(os.environ.get("RETRY_BASE_DELAY_SECONDS", 0.5))
+RETRY_MAX_DELAY_SECONDS = float(os.environ.get("RETRY_MAX_DELAY_SECONDS", 8))
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+def retry_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff for the given (zero-based) retry attempt."""
+    return random.uniform(0, min(RETRY_MAX_DELAY_SECONDS, RETRY_BASE_DELAY_SECONDS * (2 ** attempt)))
+
+
+def is_transient_error(error: Exception) -> bool:
+    """True for failures worth retrying: rate limits, 5xx responses, timeouts and dropped connections."""
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, TimeoutError, ConnectionError)):
+        return True
+    if isinstance(error, (smtplib.SMTPException, ssl.SSLError)):
+        return False
+    for attribute in ("status_code", "status", "code"):
+        status = getattr(error, attribute, None)
+        if isinstance(status, int):
+            return status in RETRYABLE_STATUS_CODES
+    detail = str(error).lower()
+    if "quota" in detail:
+        # Exhausted quota does not recover by retrying
+        return False
+    return any(marker in detail for marker in ("rate limit", "ratelimit", "timed out", "timeout", "temporarily", "overloaded", "503", "502"))
+
+
+def call_with_retries(breaker_name: str, fn, *args, **kwargs):
+    """Run a blocking dependency call behind its circuit breaker, retrying transient failures."""
+    breaker = get_circuit_breaker(breaker_name)
+    for attempt in range(RETRY_MAX_ATTEMPTS):
+        breaker.before_call()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as exc:
+            if not is_transient_error(exc):
+                # A rejected request (bad input, auth) says nothing about availability: free the probe only
+                breaker.release()
+                raise
+            breaker.record_failure(exc)
+            # A timed-out call already used its whole budget; retrying would multiply the wait
+            if isinstance(exc, TimeoutError) or attempt + 1 >= RETRY_MAX_ATTEMPTS or breaker.state == "open":
+                raise
+            logger.warning("%s call failed (attempt %s), retrying: %s", breaker_name, attempt + 1, exc)
+            time.sleep(retry_delay(attempt))
+        else:
+            breaker.record_success()
+            return result
+
+
+async def call_with_retries_async(breaker_name: str, call):
+    """Async counterpart of call_with_retries; ``call`` returns a fresh awaitable per attempt."""
+    breaker = get_circuit_breaker(breaker_name)
+    for attempt in range(RETRY_MAX_ATTEMPTS):
+        breaker.before_call()
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception as exc:
+            if not is_transient_error(exc):
+                # A rejected request (bad input, auth) says nothing about availability: free the probe only
+                breaker.release()
+                raise
+            breaker.record_failure(exc)
+            # A timed-out call already used its whole budget; retrying would multiply the wait
+            if isinstance(exc, TimeoutError) or attempt + 1 >= RETRY_MAX_ATTEMPTS or breaker.state == "open":
+                raise
+            logger.warning("%s call failed (attempt %s), retrying: %s", breaker_name, attempt + 1, exc)
+            await asyncio.sleep(retry_delay(attempt))
+        else:
+            breaker.record_success()
+            return result
+
+
+def circuit_open_http_error(error: CircuitOpenError) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail=str(error),
+        headers={"Retry-After": str(max(1, int(error.retry_after + 0.5)))},
+    )
+
+
+# ============ LLM GATEWAY ============
+
+class FairConcurrencyLimiter:
+    """Global concurrency cap plus a per-key cap; waiting keys are served round-robin."""
+
+    def __init__(self, global_limit: int, per_key_limit: int):
+        self.global_limit = global_limit
+        self.per_key_limit = per_key_limit
+        self._active_total = 0
+        self._active = {}
+        self._queues = OrderedDict()
+
+    def _can_run(self, key) -> bool:
+        return self._active_total < self.global_limit and self._active.get(key, 0) < self.per_key_limit
+
+    def _grant(self, key):
+        self._active_total += 1
+        self._active[key] = self._active.get(key, 0) + 1
+
+    def _dispatch(self):
+        granted = True
+        while granted and self._active_total < self.global_limit:
+            granted = False
+            for key in list(self._queues):
+                queue = self._queues[key]
+                while queue and queue[0].done():
+                    queue.pop(0)
+                if not queue:
+                    del self._queues[key]
+                    continue
+                if not self._can_run(key):
+                    continue
+                self._grant(key)
+                queue.pop(0).set_result(None)
+                # Rotate so the next free slot goes to another organization first
+                self._queues.move_to_end(key)
+                if not queue:
+                    del self._queues[key]
+                granted = True
+                break
+
+    async def acquire(self, key):
+        if key not in self._queues and self._can_run(key):
+            self._grant(key)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(key, []).append(future)
+        try:
+            await future
+        except BaseException:
+            if future.done() and not future.cancelled():
+                # Slot was granted while we were being cancelled
+                self.release(key)
+            else:
+                future.cancel()
+                self._dispatch()
+            raise
+
+    def release(self, key):
+        self._active_total -= 1
+        self._active[key] -= 1
+        if not self._active[key]:
+            del self._active[key]
+        self._dispatch()
+
+    def queued(self) -> int:
+        return sum(1 for queue in self._queues.values() for future in queue if not future.done())
+
+    def stats(self):
+        return {
+            "active": self._active_total,
+            "queued": self.queued(),
+            "active_by_org": dict(self._active),
+            "queued_by_org": {
+                key: count
+                for key, count in ((key, sum(1 for f in queue if not f.done())) for key, queue in self._queues.items())
+                if count
+            },
+        }
+
+
+class LlmGateway:
+    """Single entry point for LLM calls: shared credentials, fair concurrency limits and timeouts."""
+
+    def __init__(self, max_concurrency: int, per_org_concurrency: int, timeout: float, queue_timeout: float):
+        self.limiter = FairConcurrencyLimiter(max_concurrency, per_org_concurrency)
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self._api_key = None
+        self.requests = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.errors = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+
+    def api_key(self) -> str:
+        if not self._api_key:
+            self._api_key = get_openai_key()
+        return self._api_key
+
+    async def _acquire(self, key):
+        queued_at = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.limiter.acquire(key), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=429,
+                detail="KI-Dienst ist ausgelastet. Bitte in Kürze erneut versuchen.",
+                headers={"Retry-After": str(max(1, int(self.queue_timeout)))},
+            )
+        wait_ms = (time.perf_counter() - queued_at) * 1000
+        self.wait_ms_total += wait_ms
+        self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+        self.requests += 1
+
+    def _chat(self, system_message: str, model: str, session_prefix: str):
+        from emergentintegrations.llm.chat import LlmChat
+
+        # LlmChat keeps per-session history, so each request gets its own session
+        return LlmChat(
+            api_key=self.api_key(),
+            session_id=f"{session_prefix}-{uuid.uuid4().hex}",
+            system_message=system_message,
+        ).with_model("openai", model)
+
+    async def send(self, organization: Optional[str], system_message: str, message, model: str = "gpt-4o", session_prefix: str = "llm"):
+        key = organization or "_anonymous"
+        try:
+            get_circuit_breaker("llm").check()
+        except CircuitOpenError as exc:
+            raise circuit_open_http_error(exc)
+        await self._acquire(key)
+        try:
+            return await call_with_retries_async(
+                "llm",
+                lambda: asyncio.wait_for(
+                    self._chat(system_message, model, session_prefix).send_message(message), timeout=self.timeout
+                ),
+            )
+        except CircuitOpenError as exc:
+            raise circuit_open_http_error(exc)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise HTTPException(status_code=504, detail="KI-Anfrage hat das Zeitlimit überschritten")
+        except Exception as exc:
+            self.errors += 1
+            raise_llm_error(exc)
+        finally:
+            self.limiter.release(key)
+
+    def _completion_params(self) -> dict:
+        params = {"api_key": self.api_key(), "custom_llm_provider": "openai"}
+        # Emergent universal keys are only accepted by the integration proxy LlmChat talks to as well
+        api_base = os.environ.get("LLM_API_BASE")
+        if not api_base and params["api_key"].startswith("sk-emergent-"):
+            api_base = f"{os.environ.get('INTEGRATION_PROXY_URL', 'https://integrations.emergentagent.com')}/llm"
+        if api_base:
+            params["api_base"] = api_base
+        return params
+
+    async def stream(self, organization: Optional[str], system_message: str, prompt: str, model: str = "gpt-4o"):
+        """Yield completion text as the provider produces it.
+
+        LlmChat only returns whole completions, so streams go through litellm directly. They are not
+        retried (part of the answer may already be on the wire) but count toward the breaker.
+        """
+        import litellm
+
+        key = organization or "_anonymous"
+        params = self._completion_params()
+        breaker = get_circuit_breaker("llm")
+        try:
+            breaker.check()
+        except CircuitOpenError as exc:
+            raise circuit_open_http_error(exc)
+        await self._acquire(key)
+        chunks = None
+        # Only a call that claimed the breaker may release it; a refused one must not clear another caller's probe
+        claimed = False
+        try:
+            try:
+                breaker.before_call()
+            except CircuitOpenError as exc:
+                raise circuit_open_http_error(exc)
+            claimed = True
+            deadline = time.monotonic() + self.timeout
+            response = await asyncio.wait_for(
+                litellm.acompletion(
+                    model=model,
+                    messages=[{"role": "system", "content": system_message}, {"role": "user", "content": prompt}],
+                    stream=True,
+                    **params,
+                ),
+                timeout=self.timeout,
+            )
+            chunks = response.__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout=max(0.0, deadline - time.monotonic()))
+                except StopAsyncIteration:
+                    break
+                text = chunk.choices[0].delta.content if chunk.choices else None
+                if text:
+                    yield text
+            claimed = False
+            breaker.record_success()
+        except HTTPException:
+            raise
+        except asyncio.TimeoutError as exc:
+            claimed = False
+            breaker.record_failure(exc)
+            self.timeouts += 1
+            raise HTTPException(status_code=504, detail="KI-Anfrage hat das Zeitlimit überschritten")
+        except Exception as exc:
+            if is_transient_error(exc):
+                claimed = False
+                breaker.record_failure(exc)
+            self.errors += 1
+            raise_llm_error(exc)
+        finally:
+            if claimed:
+                breaker.release()
+            # Closing the upstream iterator aborts the provider request when the client went away
+            if chunks is not None and hasattr(chunks, "aclose"):
+                try:
+                    await chunks.aclose()
+                except Exception:
+                    pass
+            self.limiter.release(key)
+
+    def stats(self):
+        return {
+            **self.limiter.stats(),
+            "max_concurrency": self.limiter.global_limit,
+            "per_org_concurrency": self.limiter.per_key_limit,
+            "timeout_seconds": self.timeout,
+            "requests": self.requests,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "avg_wait_ms": round(self.wait_ms_total / self.requests, 1) if self.requests else 0.0,
+            "max_wait_ms": round(self.wait_ms_max, 1),
+        }
+
+
+llm_gateway = LlmGateway(
+    max_concurrency=int(os.environ.get("LLM_MAX_CONCURRENCY", 8)),
+    per_org_concurrency=int(os.environ.get("LLM_PER_ORG_CONCURRENCY", 2)),
+    timeout=float(os.environ.get("LLM_TIMEOUT_SECONDS", 120)),
+    queue_timeout=float(os.environ.get("LLM_QUEUE_TIMEOUT_SECONDS", 60)),
+)
+
+
+@app.on_event("startup")
+async def warm_llm_stream_client():
+    # litellm takes seconds to import; load it in the background instead of during the first stream
+    def load():
+        try:
+            import litellm  # noqa: F401
+        except ImportError:
+            pass
+
+    threading.Thread(target=load, daemon=True).start()
+
+
+def resolve_llm_organization(organization: Optional[str], authorization: Optional[str]):
+    """Organization used for per-org LLM limits: explicit value or the caller's own organization."""
+    if organization:
+        return organization
+    user = get_current_user(extract_token(authorization))
+    return user.get("organization") if user else None
+
+
+# ============ LLM HELPERS ============
+
+def parse_json_response(response_text: str):
+    import json
+    if not response_text:
+        return None
+    clean = response_text.strip()
+    if clean.startswith("```json"):
+        clean = clean[7:]
+    if clean.startswith("```"):
+        clean = clean[3:]
+    if clean.endswith("```"):
+        clean = clean[:-3]
+    clean = clean.strip()
+    try:
+        return json.loads(clean)
+    except json.JSONDecodeError:
+        return {"raw": response_text}
+
+
+async def run_vision_chat(prompt: str, system_message: str, images, organization: Optional[str] = None):
+    from emergentintegrations.llm.chat import UserMessage, ImageContent
+
+    file_contents = [ImageContent(image_base64=b64) for _, b64 in images]
+    return await llm_gateway.send(
+        organization, system_message, UserMessage(text=prompt, file_contents=file_contents), session_prefix="vision"
+    )
+
+
+async def run_text_chat(
+    prompt: str,
+    system_message: str,
+    model: str = "gpt-4o",
+    session_prefix: str = "text",
+    use_cache: bool = False,
+    organization: Optional[str] = None,
+):
+    from emergentintegrations.llm.chat import UserMessage
+
+    async def call():
+        return await llm_gateway.send(
+            organization, system_message, UserMessage(text=prompt), model=model, session_prefix=session_prefix
+        )
+
+    if not use_cache:
+        return await call()
+    return await llm_response_cache.get_or_call(llm_cache_key(model, system_message, prompt), call)
+
+
+async def stream_text_chat(
+    prompt: str,
+    system_message: str,
+    model: str = "gpt-4o",
+    use_cache: bool = False,
+    organization: Optional[str] = None,
+):
+    """Streaming counterpart of run_text_chat sharing the same response cache."""
+    cache_key = llm_cache_key(model, system_message, prompt)
+    if use_cache:
+        cached = llm_response_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+    started = time.perf_counter()
+    parts = []
+    async for chunk in llm_gateway.stream(organization, system_message, prompt, model=model):
+        parts.append(chunk)
+        yield chunk
+    if use_cache:
+        llm_response_cache.set(cache_key, "".join(parts), (time.perf_counter() - started) * 1000)
+
+
+def sse_event(data: dict, event: Optional[str] = None) -> str:
+    import json
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def sse_generation_response(chunks):
+    """Server-Sent Events: one "delta" message per chunk, then a "done" event with the full content.
+
+    When the client disconnects Starlette cancels the generator, which closes the upstream call.
+    """
+    async def events():
+        parts = []
+        try:
+            async for chunk in chunks:
+                parts.append(chunk)
+                yield sse_event({"delta": chunk})
+        except ImportError as exc:
+            yield sse_event({"detail": f"{exc.name or 'LLM client'} not installed", "status_code": 500}, event="error")
+            return
+        except HTTPException as exc:
+            yield sse_event({"detail": exc.detail, "status_code": exc.status_code}, event="error")
+            return
+        yield sse_event({"content": "".join(parts), "success": True}, event="done")
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+extraction_cache = DiskLRUCache(
+    os.path.join(CACHE_DIR, "extractions"),
+    int(os.environ.get("EXTRACTION_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+)
+
+
+def extraction_cache_key(file_url: str, kind: str, prompt_version: str, system_message: str, prompt: str) -> str:
+    content_hash = file_content_hash(resolve_upload_path(file_url))
+    prompt_hash = hashlib.sha256(f"{system_message}\n{prompt}".encode()).hexdigest()
+    return hashlib.sha256(f"{content_hash}|{kind}|{prompt_version}|{prompt_hash}".encode()).hexdigest() + ".json"
+
+
+def get_cached_extraction(cache_key: str):
+    import json
+    cached = extraction_cache.get(cache_key)
+    if cached is None:
+        return None
+    try:
+        return json.loads(cached)
+    except json.JSONDecodeError:
+        return None
+
+
+def store_extraction(cache_key: str, data):
+    import json
+    if data is None or (isinstance(data, dict) and "raw" in data):
+        return
+    extraction_cache.put(cache_key, json.dumps(data).encode())
+
+
+# ============ LLM RESPONSE CACHE ============
+
+def llm_cache_key(model: str, system_message: str, prompt: str) -> str:
+    import json
+    normalized = " ".join((prompt or "").split())
+    return hashlib.sha256(json.dumps([model, system_message or "", normalized]).encode()).hexdigest()
+
+
+class LlmResponseCache:
+    """Caches completions and coalesces identical in-flight requests into one upstream call."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self._cache = TTLCache(max_entries, ttl)
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.saved_ms = 0.0
+
+    def get(self, key: str):
+        cached = self._cache.get(key)
+        if cached is None:
+            self.misses += 1
+            return None
+        value, latency_ms = cached
+        self.hits += 1
+        self.saved_ms += latency_ms
+        return value
+
+    def set(self, key: str, value, latency_ms: float):
+        self._cache.set(key, (value, latency_ms))
+
+    async def get_or_call(self, key: str, call):
+        cached = self._cache.get(key)
+        if cached is not None:
+            value, latency_ms = cached
+            self.hits += 1
+            self.saved_ms += latency_ms
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            started = time.perf_counter()
+            value = await asyncio.shield(task)
+            self.saved_ms += (time.perf_counter() - started) * 1000
+            return value
+
+        self.misses += 1
+        # The upstream call runs in its own task so a cancelled caller leaves it running for the others
+        task = asyncio.ensure_future(self._call(key, call))
+        # Avoid "exception was never retrieved" warnings when every caller went away
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    async def _call(self, key: str, call):
+        try:
+            started = time.perf_counter()
+            value = await call()
+            self._cache.set(key, (value, (time.perf_counter() - started) * 1000))
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._cache),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0,
+            "saved_ms": round(self.saved_ms, 1),
+        }
+
+
+llm_response_cache = LlmResponseCache(
+    max_entries=int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 500)),
+    ttl=float(os.environ.get("LLM_CACHE_TTL_SECONDS", 24 * 3600)),
+)
+
+
+# ============ AI ENDPOINTS ============
+
+class AIGenerateRequest(BaseModel):
+    prompt: str
+    context: Optional[str] = None
+    organization: Optional[str] = None
+    use_cache: Optional[bool] = True
+
+class AIEmailGenerateRequest(BaseModel):
+    topic: str
+    template_type: Optional[str] = None
+    organization_name: Optional[str] = None
+    organization: Optional[str] = None
+    use_cache: Optional[bool] = True
+
+@app.post("/api/ai/generate-email")
+async def generate_email(request: AIEmailGenerateRequest, authorization: str = Header(None)):
+    """Generate bulk email content using AI"""
+    try:
+        org_name = request.organization_name or "Ortsverband"
+        
+        system_message = f"""Du bist ein Assistent für eine deutsche politische Organisation ({org_name}).
+Du erstellst professionelle E-Mails auf Deutsch.
+Die E-Mails sollen:
+- Einen passenden, prägnanten Betreff haben
+- Einen freundlichen, professionellen Ton haben
+- Ca. 150-250 Wörter im Body haben
+- Mit "Mit freundlichen Grüßen,\nDer Vorstand" enden
+
+WICHTIG: Gib die Antwort IMMER als valides JSON zurück mit exakt diesen Feldern:
+{{"subject": "Betreff hier", "body": "E-Mail Text hier"}}"""
+
+        response = await run_text_chat(
+            f"Erstelle eine E-Mail zum Thema: {request.topic}",
+            system_message,
+            session_prefix="email",
+            use_cache=request.use_cache,
+            organization=resolve_llm_organization(request.organization, authorization),
+        )
+        
+        # Try to parse JSON from response
+        import json
+        try:
+            # Clean response - remove markdown code blocks if present
+            clean_response = response.strip()
+            if clean_response.startswith("```json"):
+                clean_response = clean_response[7:]
+            if clean_response.startswith("```"):
+                clean_response = clean_response[3:]
+            if clean_response.endswith("```"):
+                clean_response = clean_response[:-3]
+            clean_response = clean_response.strip()
+            
+            result = json.loads(clean_response)
+            return {"subject": result.get("subject", ""), "body": result.get("body", ""), "success": True}
+        except json.JSONDecodeError:
+            # If JSON parsing fails, try to extract subject and body from text
+            lines = response.strip().split("\n")
+            subject = ""
+            body = response
+            for i, line in enumerate(lines):
+                if line.lower().startswith("betreff:"):
+                    subject = line.replace("Betreff:", "").replace("betreff:", "").strip()
+                    body = "\n".join(lines[i+1:]).strip()
+                    break
+            return {"subject": subject, "body": body, "success": True}
+            
+    except ImportError:
+        raise HTTPException(status_code=500, detail="emergentintegrations not installed")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise_llm_error(e)
+
+# Default system messages for different tasks
+TEXT_TASK_SYSTEM_MESSAGES = {
+    "motion": "Du bist ein neutraler, juristisch vorsichtiger Fachautor für kommunale Anträge in Deutschland. Schreibe sachlich, professionell und ohne politische Wertung. Beziehe dich ausschließlich auf das angegebene Thema und erfinde keine Fakten oder Rechtsgrundlagen. Wenn etwas unsicher ist, kennzeichne es allgemein (z. B. Kommunalrecht des Landes / Gemeindeordnung) statt konkrete Paragraphen zu erfinden.",
+    "meeting": "Du bist ein erfahrener Fraktionsgeschäftsführer. Du erstellst professionelle Tagesordnungen und Protokolle für Fraktionssitzungen.",
+    "document": "Du bist ein professioneller Dokumentenanalyst. Du analysierst und fasst Dokumente zusammen.",
+    "general": "Du bist ein hilfreicher Assistent für eine deutsche politische Organisation."
+}
+
+
+class AITextGenerateRequest(BaseModel):
+    prompt: str
+    system_message: Optional[str] = None
+    task_type: Optional[str] = "general"  # motion, meeting, document, etc.
+    organization: Optional[str] = None
+    use_cache: Optional[bool] = True
+
+def text_system_message(request: AITextGenerateRequest) -> str:
+    return request.system_message or TEXT_TASK_SYSTEM_MESSAGES.get(request.task_type, TEXT_TASK_SYSTEM_MESSAGES["general"])
+
+
+@app.post("/api/ai/generate-text")
+async def generate_text(request: AITextGenerateRequest, authorization: str = Header(None)):
+    """Generic AI text generation endpoint"""
+    try:
+        response = await run_text_chat(
+            request.prompt,
+            text_system_message(request),
+            session_prefix="text",
+            use_cache=request.use_cache,
+            organization=resolve_llm_organization(request.organization, authorization),
+        )
+        
+        return {"content": response, "success": True}
+    except ImportError:
+        raise HTTPException(status_code=500, detail="emergentintegrations not installed")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise_llm_error(e)
+
+@app.post("/api/ai/generate-text/stream")
+async def generate_text_stream(request: AITextGenerateRequest, authorization: str = Header(None)):
+    """Generic AI text generation streamed as Server-Sent Events"""
+    return sse_generation_response(stream_text_chat(
+        request.prompt,
+        text_system_message(request),
+        use_cache=request.use_cache,
+        organization=resolve_llm_organization(request.organization, authorization),
+    ))
+
+class AIReceiptScanRequest(BaseModel):
+    file_url: str
+    organization: Optional[str] = None
+    refresh: Optional[bool] = False
+
+
+RECEIPT_SCAN_PROMPT_VERSION = "1"
+BANK_STATEMENT_PROMPT_VERSION = "2"
+BANK_STATEMENT_TEXT_MAX_PAGES = 10
+
+
+async def extract_receipt(file_url: str, organization: Optional[str] = None, refresh: bool = False):
+    """Extract receipt fields from an uploaded file; returns {"data", "cached"}."""
+    system_message = (
+        "Du bist ein Buchhaltungsassistent. Extrahiere die wichtigsten Daten aus einem Beleg. "
+        "Gib NUR valides JSON zurück, ohne zusätzliche Texte."
+    )
+
+    prompt = (
+        "Analysiere den Beleg und extrahiere folgende Felder als JSON:\n"
+        "- description: kurze Beschreibung des Belegs\n"
+        "- vendor: Name des Ausstellers/Lieferanten\n"
+        "- amount: Betrag als Zahl (nur die Zahl, kein EUR-Zeichen)\n"
+        "- date: Datum im Format YYYY-MM-DD\n"
+        "- transaction_type: entweder \"einnahme\" oder \"ausgabe\"\n"
+        "- category: passende Kategorie (einnahme: mitgliedsbeitrag, spende, veranstaltung, zuschuss, sonstiges; ausgabe: personal, raummiete, material, marketing, verwaltung, sonstiges)\n"
+        "- notes: weitere relevante Informationen\n\n"
+        "Antworte NUR mit JSON."
+    )
+
+    cache_key = await asyncio.to_thread(extraction_cache_key, file_url, "receipt", RECEIPT_SCAN_PROMPT_VERSION, system_message, prompt)
+    if not refresh:
+        cached = get_cached_extraction(cache_key)
+        if cached is not None:
+            return {"data": cached, "cached": True}
+
+    text_layer = await load_pdf_text_layer(file_url, max_pages=2)
+    if text_layer:
+        metrics = {"path": "text", "pages": len(text_layer["pages"]), "text_chars": len(text_layer["text"])}
+        llm_started = time.perf_counter()
+        response = await run_text_chat(
+            f"{prompt}\n\nText des Belegs:\n{text_layer['text']}", system_message, model=TEXT_SCAN_MODEL,
+            organization=organization,
+        )
+    else:
+        images, metrics = await prepare_scan_images(file_url)
+        metrics["path"] = "vision"
+        llm_started = time.perf_counter()
+        response = await run_vision_chat(prompt, system_message, images, organization=organization)
+    metrics["llm_ms"] = round((time.perf_counter() - llm_started) * 1000, 1)
+    record_scan_metrics("receipt", file_url, organization, metrics)
+    data = parse_json_response(response)
+    store_extraction(cache_key, data)
+    return {"data": data, "cached": False}
+
+
+@app.post("/api/ai/scan-receipt")
+async def scan_receipt(request: AIReceiptScanRequest):
+    result = await extract_receipt(request.file_url, request.organization, request.refresh)
+    return {"success": True, **result}
+
+
+class AIBankStatementScanRequest(BaseModel):
+    file_url: str
+    organization: str
+    refresh: Optional[bool] = False
+
+
+@app.post("/api/ai/scan-bank-statement")
+async def scan_bank_statement(request: AIBankStatementScanRequest):
+    contacts = list(db.contacts.find({"organization": request.organization}))
+    mandate_levies = list(db.mandate_levies.find({"organization": request.organization}))
+
+    contact_names = [f"{c.get('first_name','')} {c.get('last_name','')}".strip() for c in contacts]
+    contact_names = [name for name in contact_names if name]
+    mandate_names = list({m.get("contact_name") for m in mandate_levies if m.get("contact_name")})
+
+    contact_hint = ", ".join(contact_names[:50])
+    mandate_hint = ", ".join(mandate_names[:50])
+
+    system_message = (
+        "Du bist ein erfahrener Buchhalter. Du erkennst Transaktionen in deutschen Kontoauszügen. "
+        "Gib NUR valides JSON zurück, ohne zusätzliche Texte."
+    )
 
     prompt = (
         f"Analysiere den Kontoauszug und extrahiere ALLE Transaktionen.\n\n"
@@ -1118,18 +3264,8 @@ async def scan_bank_statement(request: AIBankStatementScanRequest):
         "- amount: Betrag als positive Zahl\n"
         "- date: Datum im Format YYYY-MM-DD\n"
         "- transaction_type: \"einnahme\" oder \"ausgabe\"\n"
-        "- category: klassifiziere automatisch:\n"
-        "  * \"mitgliedsbeitrag\" bei Mitgliedsbeitrag/Beitrag\n"
-        "  * \"spende\" bei Spende/Spendeneingang\n"
-        "  * \"mandatsabgabe\" bei Mandatsträgerabgabe/Fraktionsabgabe\n"
-        "  * \"zuschuss\" bei Zuschuss/Förderung\n"
-        "  * \"veranstaltung\" bei Veranstaltungsbezug\n"
-        "  * \"personal\" bei Lohn/Gehalt/Honorar\n"
-        "  * \"raummiete\" bei Miete\n"
-        "  * \"material\" bei Materialeinkauf\n"
-        "  * \"marketing\" bei Werbung/Drucksachen\n"
-        "  * \"verwaltung\" bei Bankgebühren/Versicherung/Verwaltungskosten\n"
-        "  * sonst \"sonstiges\"\n"
+        f"- category: einnahme: {', '.join(TRANSACTION_CATEGORIES['einnahme'])}; "
+        f"ausgabe: {', '.join(TRANSACTION_CATEGORIES['ausgabe'])}\n"
         "- matched_contact: Name des passenden Kontakts falls erkennbar\n"
         "- matched_mandate: Name des Mandatsträgers falls erkennbar\n"
         "- confidence: \"hoch\", \"mittel\" oder \"niedrig\"\n\n"
@@ -1137,218 +3273,1915 @@ async def scan_bank_statement(request: AIBankStatementScanRequest):
         "{\"transactions\": [ ... ]}"
     )
 
-    response = await run_vision_chat(prompt, system_message, images)
-    data = parse_json_response(response) or {}
-    transactions = []
-    if isinstance(data, dict):
-        transactions = data.get("transactions") or []
-    if not isinstance(transactions, list):
-        transactions = []
+    cache_key = await asyncio.to_thread(extraction_cache_key, request.file_url, "bank_statement", BANK_STATEMENT_PROMPT_VERSION, system_message, prompt)
+    if not request.refresh:
+        cached = get_cached_extraction(cache_key)
+        if cached is not None:
+            return {"success": True, "transactions": cached, "cached": True}
+
+    text_layer = await load_pdf_text_layer(request.file_url, max_pages=BANK_STATEMENT_TEXT_MAX_PAGES)
+    if text_layer:
+        metrics = {"path": "table", "pages": len(text_layer["pages"]), "text_chars": len(text_layer["text"]), "llm_ms": 0.0}
+        transactions = parse_statement_tables(text_layer["tables"], reference=statement_reference_date(text_layer["text"]))
+        if transactions:
+            annotate_transactions(transactions, contact_names, mandate_names, category_models.get(request.organization))
+            await llm_categorize_transactions(
+                [t for t in transactions if not t.get("category_source")], request.organization
+            )
+            record_scan_metrics("bank_statement", request.file_url, request.organization, metrics)
+            store_extraction(cache_key, transactions)
+            return {"success": True, "transactions": transactions, "cached": False}
+
+        metrics["path"] = "text"
+        llm_started = time.perf_counter()
+        response = await run_text_chat(
+            f"{prompt}\n\nText des Kontoauszugs:\n{text_layer['text']}", system_message, model=TEXT_SCAN_MODEL,
+            organization=request.organization,
+        )
+    else:
+        images, metrics = await prepare_scan_images(request.file_url, max_pages=3)
+        metrics["path"] = "vision"
+        llm_started = time.perf_counter()
+        response = await run_vision_chat(prompt, system_message, images, organization=request.organization)
+    metrics["llm_ms"] = round((time.perf_counter() - llm_started) * 1000, 1)
+    record_scan_metrics("bank_statement", request.file_url, request.organization, metrics)
+    data = parse_json_response(response) or {}
+    transactions = []
+    if isinstance(data, dict) and "raw" not in data:
+        transactions = data.get("transactions") or []
+        if isinstance(transactions, list):
+            apply_category_model(transactions, category_models.get(request.organization))
+            store_extraction(cache_key, transactions)
+    if not isinstance(transactions, list):
+        transactions = []
+
+    return {"success": True, "transactions": transactions, "cached": False}
+
+class BankStatementImportRequest(BaseModel):
+    file_url: str
+    organization: str
+
+
+@app.post("/api/accounting/import-bank-statement")
+async def import_bank_statement(request: BankStatementImportRequest):
+    """Import CAMT.053 XML or MT940 bank statements without LLM calls (streamed JSON response)"""
+    import json
+
+    key = resolve_upload_key(request.file_url)
+    if not await asyncio.to_thread(storage.exists, key):
+        raise HTTPException(status_code=404, detail="File not found")
+    head = await asyncio.to_thread(read_upload_head, key, 512)
+    statement_format = detect_statement_format(key, head)
+    if not statement_format:
+        raise HTTPException(status_code=400, detail="Unbekanntes Kontoauszugsformat (erwartet CAMT.053 oder MT940)")
+
+    contacts = db.contacts.find({"organization": request.organization}, {"first_name": 1, "last_name": 1})
+    contact_names = [f"{c.get('first_name','')} {c.get('last_name','')}".strip() for c in contacts]
+    contact_names = [name for name in contact_names if name]
+    mandate_names = [name for name in db.mandate_levies.distinct("contact_name", {"organization": request.organization}) if name]
+    parser = iter_camt053_transactions if statement_format == "camt053" else iter_mt940_transactions
+    classifier = category_models.get(request.organization)
+
+    def generate():
+        import xml.etree.ElementTree as ET
+
+        yield f'{{"success": true, "format": "{statement_format}", "transactions": ['
+        count = 0
+        error = None
+        try:
+            with storage.open(key) as stream:
+                for transaction in parser(stream):
+                    annotate_transactions([transaction], contact_names, mandate_names, classifier)
+                    yield ("," if count else "") + json.dumps(transaction, ensure_ascii=False)
+                    count += 1
+        except (ET.ParseError, ValueError) as exc:
+            logger.error("Bank statement import failed after %s bookings: %s", count, exc)
+            error = f"Kontoauszug konnte nicht vollständig gelesen werden: {exc}"
+        except Exception:
+            # The header is already sent, so even unexpected errors must end in a valid JSON body
+            logger.exception("Bank statement import failed after %s bookings", count)
+            error = "Kontoauszug konnte nicht vollständig gelesen werden"
+        yield f'], "count": {count}, "error": {json.dumps(error)}}}'
+
+    return StreamingResponse(generate(), media_type="application/json")
+
+
+NOTICE_SYSTEM_MESSAGE = """Du bist ein erfahrener Verwaltungsangestellter einer deutschen politischen Partei.
+Du erstellst professionelle, formelle Gebührenbescheide für Mandatsträgerabgaben.
+Der Bescheid soll:
+- Als formeller Geschäftsbrief formatiert sein
+- Absender oben links, Datum oben rechts, Empfänger darunter
+- Alle relevanten Abrechnungsdaten übersichtlich darstellen
+- Höflich aber bestimmt formuliert sein
+- Eine klare Zahlungsaufforderung mit Frist enthalten
+- Mit einer Grußformel enden"""
+
+
+PROTOCOL_SYSTEM_MESSAGE = """Du bist ein erfahrener Protokollführer für politische Gremien in Deutschland. 
+Du erstellst professionelle, formelle Sitzungsprotokolle im deutschen Stil.
+Verwende die korrekte Protokollstruktur mit:
+- Kopfdaten (Datum, Zeit, Ort, Anwesende)
+- Tagesordnungspunkte
+- Beschlüsse und Abstimmungsergebnisse
+- Unterschriftszeilen"""
+
+
+INVITATION_SYSTEM_MESSAGE = """Du bist ein erfahrener Geschäftsführer einer politischen Fraktion in Deutschland.
+Du erstellst professionelle, förmliche Einladungen zu Fraktionssitzungen.
+Die Einladungen sollen:
+- Höflich und professionell sein
+- Alle relevanten Informationen enthalten (Datum, Zeit, Ort, Tagesordnung)
+- Eine klare Struktur haben
+- Mit einer passenden Anrede beginnen und einer Grußformel enden"""
+
+
+class AINoticeGenerateRequest(BaseModel):
+    prompt: str
+    levy_data: Optional[dict] = None
+    organization_data: Optional[dict] = None
+    organization: Optional[str] = None
+    use_cache: Optional[bool] = True
+
+@app.post("/api/ai/generate-notice")
+async def generate_notice(request: AINoticeGenerateRequest, authorization: str = Header(None)):
+    """Generate levy notice/Gebührenbescheid using AI"""
+    try:
+        response = await run_text_chat(
+            request.prompt,
+            NOTICE_SYSTEM_MESSAGE,
+            session_prefix="notice",
+            use_cache=request.use_cache,
+            organization=resolve_llm_organization(request.organization, authorization),
+        )
+        
+        return {"content": response, "success": True}
+    except ImportError:
+        raise HTTPException(status_code=500, detail="emergentintegrations not installed")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise_llm_error(e)
+
+@app.post("/api/ai/generate-notice/stream")
+async def generate_notice_stream(request: AINoticeGenerateRequest, authorization: str = Header(None)):
+    """Generate levy notice streamed as Server-Sent Events"""
+    return sse_generation_response(stream_text_chat(
+        request.prompt,
+        NOTICE_SYSTEM_MESSAGE,
+        use_cache=request.use_cache,
+        organization=resolve_llm_organization(request.organization, authorization),
+    ))
+
+@app.post("/api/ai/generate-protocol")
+async def generate_protocol(request: AIGenerateRequest, authorization: str = Header(None)):
+    """Generate meeting protocol using AI"""
+    try:
+        response = await run_text_chat(
+            request.prompt,
+            PROTOCOL_SYSTEM_MESSAGE,
+            session_prefix="protocol",
+            use_cache=request.use_cache,
+            organization=resolve_llm_organization(request.organization, authorization),
+        )
+        
+        return {"content": response, "success": True}
+    except ImportError:
+        raise HTTPException(status_code=500, detail="emergentintegrations not installed")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise_llm_error(e)
+
+@app.post("/api/ai/generate-protocol/stream")
+async def generate_protocol_stream(request: AIGenerateRequest, authorization: str = Header(None)):
+    """Generate meeting protocol streamed as Server-Sent Events"""
+    return sse_generation_response(stream_text_chat(
+        request.prompt,
+        PROTOCOL_SYSTEM_MESSAGE,
+        use_cache=request.use_cache,
+        organization=resolve_llm_organization(request.organization, authorization),
+    ))
+
+@app.post("/api/ai/generate-invitation")
+async def generate_invitation(request: AIGenerateRequest, authorization: str = Header(None)):
+    """Generate meeting invitation using AI"""
+    try:
+        response = await run_text_chat(
+            request.prompt,
+            INVITATION_SYSTEM_MESSAGE,
+            session_prefix="invitation",
+            use_cache=request.use_cache,
+            organization=resolve_llm_organization(request.organization, authorization),
+        )
+        
+        return {"content": response, "success": True}
+    except ImportError:
+        raise HTTPException(status_code=500, detail="emergentintegrations not installed")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise_llm_error(e)
+
+@app.get("/api/ai/cache/stats")
+async def ai_cache_stats():
+    return llm_response_cache.stats()
+
+@app.get("/api/ai/gateway/stats")
+async def ai_gateway_stats():
+    return llm_gateway.stats()
+
+# ============ LEVY NOTICES ============
+
+LEVY_NOTICE_PAYMENT_DAYS = int(os.environ.get("LEVY_NOTICE_PAYMENT_DAYS", 14))
+LEVY_NOTICE_FIELDS = {
+    "contact_id": 1, "contact_name": 1, "mandate_type": 1, "mandate_body": 1, "period_month": 1,
+    "gross_income": 1, "levy_rate": 1, "final_levy": 1, "deductions": 1, "organization": 1,
+}
+NOTICE_ORGANIZATION_FIELDS = {"name": 1, "display_name": 1, "address": 1, "city": 1, "iban": 1}
+
+DEFAULT_LEVY_NOTICE_TEMPLATE = """{{ sender.name }}
+{{ sender.address or "[Adresse]" }}
+
+{{ today | date_de }}
+
+{{ recipient.name }}
+{{ recipient.address or "[Adresse des Empfängers]" }}
+
+Gebührenbescheid – Mandatsträgerabgabe {{ levy.period_month }}
+
+Sehr geehrte(r) {{ recipient.name }},
+
+gemäß der Satzung zur Mandatsträgerabgabe berechnen wir Ihnen für den Abrechnungsmonat {{ levy.period_month }} folgende Abgabe:
+
+Mandat: {{ recipient.mandate_type }}{% if recipient.mandate_body %} bei {{ recipient.mandate_body }}{% endif %}
+
+Brutto-Aufwandsentschädigung: {{ levy.gross_income | euro }}
+Abgabesatz: {{ levy.levy_rate }}%
+Abzüge/Freibetrag: {{ levy.deductions | euro }}
+────────────────────────────────
+Zu zahlende Abgabe: {{ levy.final_levy | euro }}
+
+Bitte überweisen Sie den Betrag bis zum {{ due_date | date_de }} auf folgendes Konto:
+{{ sender.iban or "[BANKVERBINDUNG EINFÜGEN]" }}
+Verwendungszweck: MTA {{ levy.period_month }} {{ recipient.name }}
+
+Mit freundlichen Grüßen,
+Der Vorstand"""
+
+
+def format_euro_de(value) -> str:
+    try:
+        amount = float(value or 0)
+    except (TypeError, ValueError):
+        amount = 0.0
+    return f"{amount:,.2f} €".replace(",", "X").replace(".", ",").replace("X", ".")
+
+
+def format_date_de(value) -> str:
+    if isinstance(value, datetime):
+        return value.strftime("%d.%m.%Y")
+    return format_meeting_date(value)
+
+
+def create_notice_environment():
+    from jinja2.sandbox import SandboxedEnvironment
+
+    # Templates are edited by organization admins, so they run sandboxed
+    environment = SandboxedEnvironment(autoescape=False, keep_trailing_newline=False)
+    environment.filters["euro"] = format_euro_de
+    environment.filters["date_de"] = format_date_de
+    return environment
+
+
+notice_environment = create_notice_environment()
+
+
+@lru_cache(maxsize=64)
+def compile_notice_template(source: str):
+    return notice_environment.from_string(source)
 
-    return {"success": True, "transactions": transactions}
 
-class AINoticeGenerateRequest(BaseModel):
-    prompt: str
-    levy_data: Optional[dict] = None
-    organization_data: Optional[dict] = None
+def load_levy_for_notice(levy_id: str) -> dict:
+    if not ObjectId.is_valid(levy_id):
+        raise HTTPException(status_code=404, detail="Levy not found")
+    levy = db.mandate_levies.find_one({"_id": ObjectId(levy_id)}, LEVY_NOTICE_FIELDS)
+    if not levy:
+        raise HTTPException(status_code=404, detail="Levy not found")
+    return levy
+
+
+def get_notice_organization(organization: Optional[str]) -> dict:
+    return db.organizations.find_one({"name": organization}, NOTICE_ORGANIZATION_FIELDS) or {}
+
+
+def get_levy_notice_template(organization: Optional[str], template_id: Optional[str] = None) -> str:
+    """Body template of the organization's levy notice print template, or the built-in default."""
+    query = {"organization": organization, "document_type": "levy_notice", "body_template": {"$nin": [None, ""]}}
+    if template_id:
+        if not ObjectId.is_valid(template_id):
+            raise HTTPException(status_code=404, detail="Template not found")
+        query["_id"] = ObjectId(template_id)
+    templates = list(db.print_templates.find(query, {"body_template": 1, "is_default": 1}))
+    if template_id and not templates:
+        raise HTTPException(status_code=404, detail="Template not found")
+    if not templates:
+        return DEFAULT_LEVY_NOTICE_TEMPLATE
+    template = next((t for t in templates if t.get("is_default")), templates[0])
+    return template["body_template"]
+
+
+def levy_notice_context(levy: dict, org: dict, contact: Optional[dict] = None, today: Optional[datetime] = None) -> dict:
+    today = today or datetime.now()
+    return {
+        "sender": {
+            "name": org.get("display_name") or org.get("name") or levy.get("organization") or "[Organisation]",
+            "address": ", ".join(filter(None, [org.get("address"), org.get("city")])),
+            "iban": org.get("iban"),
+        },
+        "recipient": {
+            "name": levy.get("contact_name") or "",
+            "address": (contact or {}).get("address"),
+            "mandate_type": levy.get("mandate_type") or "",
+            "mandate_body": levy.get("mandate_body"),
+        },
+        "levy": {
+            "period_month": levy.get("period_month") or "",
+            "gross_income": levy.get("gross_income") or 0,
+            "levy_rate": levy.get("levy_rate") or 0,
+            "deductions": levy.get("deductions") or 0,
+            "final_levy": levy.get("final_levy") or 0,
+        },
+        "today": today,
+        "due_date": today + timedelta(days=LEVY_NOTICE_PAYMENT_DAYS),
+    }
+
+
+def render_levy_notice(source: str, levy: dict, org: dict, contact: Optional[dict] = None) -> str:
+    from jinja2 import TemplateError
 
-@app.post("/api/ai/generate-notice")
-async def generate_notice(request: AINoticeGenerateRequest):
-    """Generate levy notice/Gebührenbescheid using AI"""
-    from dotenv import load_dotenv
-    load_dotenv()
-    
     try:
-        from emergentintegrations.llm.chat import LlmChat, UserMessage
-        
-        api_key = get_openai_key()
-        
-        system_message = """Du bist ein erfahrener Verwaltungsangestellter einer deutschen politischen Partei.
-Du erstellst professionelle, formelle Gebührenbescheide für Mandatsträgerabgaben.
-Der Bescheid soll:
-- Als formeller Geschäftsbrief formatiert sein
-- Absender oben links, Datum oben rechts, Empfänger darunter
-- Alle relevanten Abrechnungsdaten übersichtlich darstellen
-- Höflich aber bestimmt formuliert sein
-- Eine klare Zahlungsaufforderung mit Frist enthalten
-- Mit einer Grußformel enden"""
+        return compile_notice_template(source).render(**levy_notice_context(levy, org, contact))
+    except TemplateError as exc:
+        raise HTTPException(status_code=400, detail=f"Bescheidvorlage fehlerhaft: {exc}")
 
-        chat = LlmChat(
-            api_key=api_key,
-            session_id=f"notice-{datetime.now().timestamp()}",
-            system_message=system_message
-        ).with_model("openai", "gpt-4o")
-        
-        user_message = UserMessage(text=request.prompt)
-        response = await chat.send_message(user_message)
-        
-        return {"content": response, "success": True}
+
+def get_levy_contacts(levies: List[dict]) -> dict:
+    contact_ids = [ObjectId(l["contact_id"]) for l in levies if ObjectId.is_valid(l.get("contact_id") or "")]
+    if not contact_ids:
+        return {}
+    return {str(c["_id"]): c for c in db.contacts.find({"_id": {"$in": contact_ids}}, {"address": 1})}
+
+
+LEVY_NOTICE_BATCH_MAX = int(os.environ.get("LEVY_NOTICE_BATCH_MAX", 500))
+
+
+@app.get("/api/mandate-levies/notice-template/default")
+async def get_default_levy_notice_template():
+    """Built-in notice template, the starting point for organization templates in the template editor"""
+    return {"body_template": DEFAULT_LEVY_NOTICE_TEMPLATE}
+
+
+class LevyNoticeBatchRequest(BaseModel):
+    organization: str
+    levy_ids: Optional[List[str]] = None
+    period_month: Optional[str] = None
+    template_id: Optional[str] = None
+
+
+@app.post("/api/mandate-levies/notices")
+async def render_levy_notices(request: LevyNoticeBatchRequest):
+    """Render levy notices for many mandate holders from the organization's notice template (no LLM)"""
+    started = time.perf_counter()
+    if not request.levy_ids and not request.period_month:
+        raise HTTPException(status_code=400, detail="levy_ids oder period_month angeben")
+    query = {"organization": request.organization}
+    if request.levy_ids:
+        query["_id"] = {"$in": [ObjectId(levy_id) for levy_id in request.levy_ids if ObjectId.is_valid(levy_id)]}
+    if request.period_month:
+        query["period_month"] = request.period_month
+    levies = list(db.mandate_levies.find(query, LEVY_NOTICE_FIELDS).limit(LEVY_NOTICE_BATCH_MAX + 1))
+    if len(levies) > LEVY_NOTICE_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"Maximal {LEVY_NOTICE_BATCH_MAX} Bescheide pro Anfrage")
+    org = get_notice_organization(request.organization)
+    source = get_levy_notice_template(request.organization, request.template_id)
+    contacts = get_levy_contacts(levies)
+    notices = [
+        {
+            "levy_id": str(levy["_id"]),
+            "contact_name": levy.get("contact_name"),
+            "content": render_levy_notice(source, levy, org, contacts.get(str(levy.get("contact_id")))),
+        }
+        for levy in levies
+    ]
+    return {
+        "success": True,
+        "notices": notices,
+        "count": len(notices),
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+# ============ PROMPT CONTEXT ============
+
+AI_PROMPT_TOKEN_BUDGET = int(os.environ.get("AI_PROMPT_TOKEN_BUDGET", 2000))
+PROMPT_CHARS_PER_TOKEN = 4
+prompt_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """Token count with tiktoken when its encoding is available, otherwise a chars/4 estimate."""
+    global prompt_encoding
+    if not text:
+        return 0
+    if TIKTOKEN_AVAILABLE and prompt_encoding is None:
+        try:
+            prompt_encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as exc:
+            logger.warning("tiktoken encoding unavailable, estimating tokens: %s", exc)
+            prompt_encoding = False
+    if prompt_encoding:
+        try:
+            return len(prompt_encoding.encode(text))
+        except ImportError as exc:
+            # Some encodings load optional extensions on first use
+            logger.warning("tiktoken encoding unavailable, estimating tokens: %s", exc)
+            prompt_encoding = False
+    return -(-len(text) // PROMPT_CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Shorten a section to ``max_tokens``: lists lose trailing entries (with a count), prose keeps head and tail."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    lines = [line for line in text.split("\n") if line.strip()]
+    if len(lines) > 1:
+        kept = []
+        for line in lines:
+            note = f"… ({len(lines) - len(kept) - 1} weitere Einträge gekürzt)"
+            if count_tokens("\n".join(kept + [line, note])) > max_tokens:
+                break
+            kept.append(line)
+        return "\n".join(kept + [f"… ({len(lines) - len(kept)} weitere Einträge gekürzt)"])
+    max_chars = max(0, max_tokens * PROMPT_CHARS_PER_TOKEN - 8)
+    head = text[: max_chars * 2 // 3].rsplit(" ", 1)[0]
+    tail = text[len(text) - max_chars // 3:].split(" ", 1)[-1] if max_chars // 3 else ""
+    return f"{head} […] {tail}".strip()
+
+
+def build_prompt(template: str, sections: dict, budget: int):
+    """Fill ``template`` with the sections, shrinking the largest ones until the prompt fits ``budget`` tokens.
+
+    The fixed template text is always kept; the remaining budget is shared so that short sections stay whole
+    and long ones get an equal share of what is left. Returns (prompt, stats).
+    """
+    fixed_tokens = count_tokens(template.format(**{name: "" for name in sections}))
+    available = max(0, budget - fixed_tokens)
+    sizes = {name: count_tokens(text) for name, text in sections.items()}
+    allowed = {}
+    remaining = available
+    pending = sorted(sections, key=lambda name: sizes[name])
+    while pending:
+        share = remaining // len(pending)
+        name = pending.pop(0)
+        allowed[name] = min(sizes[name], share)
+        remaining -= allowed[name]
+
+    filled = {}
+    truncated = []
+    for name, text in sections.items():
+        if sizes[name] > allowed[name]:
+            filled[name] = truncate_to_tokens(text, allowed[name])
+            truncated.append(name)
+        else:
+            filled[name] = text
+    prompt = template.format(**filled)
+    return prompt, {
+        "prompt_tokens": count_tokens(prompt),
+        "budget": budget,
+        "source_tokens": fixed_tokens + sum(sizes.values()),
+        "truncated_sections": truncated,
+    }
+
+
+def format_meeting_date(value, with_time: bool = False) -> str:
+    if not value:
+        return ""
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return str(value)
+    return parsed.strftime("%d.%m.%Y %H:%M" if with_time else "%d.%m.%Y")
+
+
+def format_agenda_lines(meeting: dict) -> List[str]:
+    """TOP lines in the numbering the invitation form uses: fixed items around one TOP with sub-items."""
+    items = meeting.get("agenda_items") or []
+    if not items:
+        return [line.strip() for line in (meeting.get("agenda") or "").split("\n") if line.strip()]
+    fixed_start = [i for i in items if i.get("type") in ("fixed_start", "fixed")]
+    fixed_end = [i for i in items if i.get("type") == "fixed_end"]
+    middle = [i for i in items if i.get("type") not in ("fixed_start", "fixed_end", "fixed")]
+    lines = [f"TOP {n + 1}: {item.get('title', '')}" for n, item in enumerate(fixed_start)]
+    for n, item in enumerate(middle):
+        number = f"TOP {len(fixed_start) + 1}" if n == 0 else f"  {len(fixed_start) + 1}.{n}"
+        lines.append(f"{number}: {item.get('title', '')}")
+    first_end = len(fixed_start) + (2 if middle else 1)
+    lines.extend(f"TOP {first_end + n}: {item.get('title', '')}" for n, item in enumerate(fixed_end))
+    return lines
+
+
+def get_fraction_meeting_for_prompt(meeting_id: str) -> dict:
+    if not ObjectId.is_valid(meeting_id):
+        raise HTTPException(status_code=404, detail="Meeting not found")
+    meeting = db.fraction_meetings.find_one(
+        {"_id": ObjectId(meeting_id)},
+        {"title": 1, "date": 1, "location": 1, "agenda": 1, "agenda_items.title": 1, "agenda_items.type": 1,
+         "attendees": 1, "notes": 1, "organization": 1},
+    )
+    if not meeting:
+        raise HTTPException(status_code=404, detail="Meeting not found")
+    return meeting
+
+
+PROTOCOL_PROMPT_TEMPLATE = """Erstelle ein professionelles Sitzungsprotokoll für eine Fraktionssitzung:
+
+Titel: {title}
+Datum: {date}
+Ort: {location}
+Teilnehmer:
+{attendees}
+Tagesordnung:
+{agenda}
+Notizen:
+{notes}
+
+Erstelle ein strukturiertes Protokoll mit allen TOPs. Verwende Platzhalter [Name] für noch ausstehende Details. Jeder TOP hat Überschrift, Diskussion und ggf. Abstimmungsergebnis. Füge am Ende Unterschriftenzeilen für Sitzungsleitung und Protokollführer ein."""
+
+INVITATION_PROMPT_TEMPLATE = """Erstelle eine vollständige, professionelle Einladung für eine Fraktionssitzung.
+
+Titel: {title}
+Datum: {date}
+Ort: {location}
+
+Der Einladungstext soll folgendes VOLLSTÄNDIG enthalten:
+1. Förmliche Anrede und Einleitung
+2. Die vollständige Tagesordnung mit allen TOPs (genau so wie unten angegeben, keine Änderungen):
+{agenda}
+3. Abschließende Grußformel
+
+Wichtig: Die Tagesordnung soll DIREKT im Einladungstext integriert sein, nicht separat. Kein separater "Tagesordnung:"-Block nötig, sondern fließend im Text."""
+
+NOTICE_PROMPT_TEMPLATE = """Erstelle einen formellen Gebührenbescheid (auf Deutsch) für einen Mandatsträger.
+
+Absender (oben links im Briefkopf):
+{sender}
+
+Empfänger:
+{recipient}
+
+Abrechnungsdaten:
+{billing}
+
+Der Bescheid soll als formeller Brief aufgebaut sein mit vollständigem Briefkopf (Absender oben links, Ort und Datum oben rechts, Empfänger darunter). Professionell und förmlich. Zahlungsziel: 14 Tage nach Erhalt. Bankverbindung: {iban}"""
+
+
+def build_protocol_prompt(meeting: dict, budget: int):
+    return build_prompt(PROTOCOL_PROMPT_TEMPLATE, {
+        "title": meeting.get("title") or "",
+        "date": format_meeting_date(meeting.get("date")),
+        "location": meeting.get("location") or "",
+        "agenda": "\n".join(format_agenda_lines(meeting)) or "–",
+        "attendees": "\n".join(f"- {name}" for name in meeting.get("attendees") or []) or "–",
+        "notes": meeting.get("notes") or "–",
+    }, budget)
+
+
+def build_invitation_prompt(meeting: dict, budget: int):
+    return build_prompt(INVITATION_PROMPT_TEMPLATE, {
+        "title": meeting.get("title") or "",
+        "date": format_meeting_date(meeting.get("date"), with_time=True),
+        "location": meeting.get("location") or "",
+        "agenda": "\n".join(format_agenda_lines(meeting)),
+    }, budget)
+
+
+def build_notice_prompt(levy: dict, org: dict, budget: int, tone: Optional[str] = None):
+    context = levy_notice_context(levy, org)
+    sender, recipient, billing = context["sender"], context["recipient"], context["levy"]
+    template = NOTICE_PROMPT_TEMPLATE + ("\n\nGewünschter Ton: {tone}" if tone else "")
+    sections = {
+        "sender": f"{sender['name']}\n{sender['address'] or '[Adresse]'}",
+        "recipient": (
+            f"- Name: {recipient['name']}\n"
+            f"- Mandat: {recipient['mandate_type']} bei {recipient['mandate_body'] or '–'}"
+        ),
+        "billing": (
+            f"- Abrechnungsmonat: {billing['period_month']}\n"
+            f"- Brutto-Aufwandsentschädigung: {format_euro_de(billing['gross_income'])}\n"
+            f"- Abgabesatz: {billing['levy_rate']}%\n"
+            f"- Berechnete Abgabe: {format_euro_de(billing['final_levy'])}\n"
+            f"- Freibetrag/Abzüge: {format_euro_de(billing['deductions'])}\n"
+            f"- Zu zahlende Abgabe: {format_euro_de(billing['final_levy'])}"
+        ),
+        "iban": sender["iban"] or "[BANKVERBINDUNG EINFÜGEN]",
+    }
+    if tone:
+        sections["tone"] = tone
+    return build_prompt(template, sections, budget)
+
+
+class AIMeetingContextRequest(BaseModel):
+    meeting_id: str
+    max_prompt_tokens: Optional[int] = None
+    use_cache: Optional[bool] = True
+
+
+class AILevyContextRequest(BaseModel):
+    levy_id: str
+    tone: Optional[str] = None  # free-text tone; without it the notice is rendered from the template
+    template_id: Optional[str] = None
+    max_prompt_tokens: Optional[int] = None
+    use_cache: Optional[bool] = True
+
+
+@app.post("/api/ai/fraction-meetings/generate-protocol")
+async def generate_meeting_protocol(request: AIMeetingContextRequest):
+    """Generate a fraction meeting protocol from the stored meeting (prompt built server-side)"""
+    meeting = get_fraction_meeting_for_prompt(request.meeting_id)
+    prompt, stats = build_protocol_prompt(meeting, request.max_prompt_tokens or AI_PROMPT_TOKEN_BUDGET)
+    try:
+        content = await run_text_chat(
+            prompt,
+            PROTOCOL_SYSTEM_MESSAGE,
+            session_prefix="protocol",
+            use_cache=request.use_cache,
+            organization=meeting.get("organization"),
+        )
     except ImportError:
         raise HTTPException(status_code=500, detail="emergentintegrations not installed")
+    except HTTPException:
+        raise
     except Exception as e:
         raise_llm_error(e)
+    return {"content": content, "success": True, **stats}
 
-@app.post("/api/ai/generate-protocol")
-async def generate_protocol(request: AIGenerateRequest):
-    """Generate meeting protocol using AI"""
-    from dotenv import load_dotenv
-    load_dotenv()
-    
-    try:
-        from emergentintegrations.llm.chat import LlmChat, UserMessage
-        
-        api_key = get_openai_key()
-        
-        system_message = """Du bist ein erfahrener Protokollführer für politische Gremien in Deutschland. 
-Du erstellst professionelle, formelle Sitzungsprotokolle im deutschen Stil.
-Verwende die korrekte Protokollstruktur mit:
-- Kopfdaten (Datum, Zeit, Ort, Anwesende)
-- Tagesordnungspunkte
-- Beschlüsse und Abstimmungsergebnisse
-- Unterschriftszeilen"""
 
-        chat = LlmChat(
-            api_key=api_key,
-            session_id=f"protocol-{datetime.now().timestamp()}",
-            system_message=system_message
-        ).with_model("openai", "gpt-4o")
-        
-        user_message = UserMessage(text=request.prompt)
-        response = await chat.send_message(user_message)
-        
-        return {"content": response, "success": True}
+@app.post("/api/ai/fraction-meetings/generate-invitation")
+async def generate_meeting_invitation(request: AIMeetingContextRequest):
+    """Generate a fraction meeting invitation from the stored meeting (prompt built server-side)"""
+    meeting = get_fraction_meeting_for_prompt(request.meeting_id)
+    prompt, stats = build_invitation_prompt(meeting, request.max_prompt_tokens or AI_PROMPT_TOKEN_BUDGET)
+    try:
+        content = await run_text_chat(
+            prompt,
+            INVITATION_SYSTEM_MESSAGE,
+            session_prefix="invitation",
+            use_cache=request.use_cache,
+            organization=meeting.get("organization"),
+        )
     except ImportError:
         raise HTTPException(status_code=500, detail="emergentintegrations not installed")
+    except HTTPException:
+        raise
     except Exception as e:
         raise_llm_error(e)
+    return {"content": content, "success": True, **stats}
 
-@app.post("/api/ai/generate-invitation")
-async def generate_invitation(request: AIGenerateRequest):
-    """Generate meeting invitation using AI"""
-    from dotenv import load_dotenv
-    load_dotenv()
-    
-    try:
-        from emergentintegrations.llm.chat import LlmChat, UserMessage
-        
-        api_key = get_openai_key()
-        
-        system_message = """Du bist ein erfahrener Geschäftsführer einer politischen Fraktion in Deutschland.
-Du erstellst professionelle, förmliche Einladungen zu Fraktionssitzungen.
-Die Einladungen sollen:
-- Höflich und professionell sein
-- Alle relevanten Informationen enthalten (Datum, Zeit, Ort, Tagesordnung)
-- Eine klare Struktur haben
-- Mit einer passenden Anrede beginnen und einer Grußformel enden"""
 
-        chat = LlmChat(
-            api_key=api_key,
-            session_id=f"invitation-{datetime.now().timestamp()}",
-            system_message=system_message
-        ).with_model("openai", "gpt-4o")
-        
-        user_message = UserMessage(text=request.prompt)
-        response = await chat.send_message(user_message)
-        
-        return {"content": response, "success": True}
+@app.post("/api/ai/mandate-levies/generate-notice")
+async def generate_levy_notice(request: AILevyContextRequest):
+    """Levy notice for a stored levy: template rendering, or the LLM when a custom tone is requested"""
+    levy = load_levy_for_notice(request.levy_id)
+    org = get_notice_organization(levy.get("organization"))
+    if not request.tone:
+        source = get_levy_notice_template(levy.get("organization"), request.template_id)
+        contact = get_levy_contacts([levy]).get(str(levy.get("contact_id")))
+        return {"content": render_levy_notice(source, levy, org, contact), "success": True, "renderer": "template"}
+
+    prompt, stats = build_notice_prompt(levy, org, request.max_prompt_tokens or AI_PROMPT_TOKEN_BUDGET, request.tone)
+    try:
+        content = await run_text_chat(
+            prompt,
+            NOTICE_SYSTEM_MESSAGE,
+            session_prefix="notice",
+            use_cache=request.use_cache,
+            organization=levy.get("organization"),
+        )
     except ImportError:
         raise HTTPException(status_code=500, detail="emergentintegrations not installed")
+    except HTTPException:
+        raise
     except Exception as e:
         raise_llm_error(e)
+    return {"content": content, "success": True, "renderer": "llm", **stats}
+
+
+# ============ BATCH RECEIPT SCANS ============
+
+RECEIPT_BATCH_MAX_FILES = int(os.environ.get("RECEIPT_BATCH_MAX_FILES", 500))
+RECEIPT_BATCH_CONCURRENCY = int(os.environ.get("RECEIPT_BATCH_CONCURRENCY", 4))
+RECEIPT_BATCH_ITEM_ATTEMPTS = 3
+# Running jobs renew this lease; one that lapses belongs to a process that died
+SCAN_JOB_LEASE_SECONDS = int(os.environ.get("SCAN_JOB_LEASE_SECONDS", 60))
+
+background_tasks = set()
+
+
+def spawn_background_task(coro):
+    """Run a coroutine detached from the request; keeps a reference so it is not garbage collected."""
+    task = asyncio.get_running_loop().create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+class ReceiptBatchScanRequest(BaseModel):
+    file_urls: List[str]
+    organization: str
+    refresh: Optional[bool] = False
+
+
+async def scan_batch_item(job_id: ObjectId, index: int, file_url: str, organization: str, refresh: bool, semaphore: asyncio.Semaphore):
+    async with semaphore:
+        db.scan_jobs.update_one({"_id": job_id}, {"$set": {f"items.{index}.status": "running"}})
+        result = None
+        error = None
+        for attempt in range(RECEIPT_BATCH_ITEM_ATTEMPTS):
+            try:
+                result = await extract_receipt(file_url, organization, refresh)
+                break
+            except HTTPException as exc:
+                error = exc.detail
+                # Render queue full or LLM breaker open: back off instead of failing the receipt
+                if exc.status_code in (429, 503) and attempt + 1 < RECEIPT_BATCH_ITEM_ATTEMPTS:
+                    retry_after = (exc.headers or {}).get("Retry-After")
+                    await asyncio.sleep(float(retry_after) if retry_after else retry_delay(attempt))
+                    continue
+                break
+            except Exception as exc:
+                logger.error("Batch receipt scan failed for %s: %s", file_url, exc)
+                error = str(exc)
+                break
+
+    now = datetime.now(timezone.utc).isoformat()
+    if result is not None:
+        db.scan_jobs.update_one(
+            {"_id": job_id},
+            {
+                "$set": {
+                    f"items.{index}.status": "done",
+                    f"items.{index}.data": result["data"],
+                    f"items.{index}.cached": result["cached"],
+                    "updated_date": now,
+                },
+                "$inc": {"processed": 1, "succeeded": 1},
+            },
+        )
+    else:
+        db.scan_jobs.update_one(
+            {"_id": job_id},
+            {
+                "$set": {f"items.{index}.status": "failed", f"items.{index}.error": error, "updated_date": now},
+                "$inc": {"processed": 1, "failed": 1},
+            },
+        )
+
+
+def scan_job_lease() -> dict:
+    return {
+        "owner": f"{socket.gethostname()}-{os.getpid()}",
+        "lease_expires_at": (datetime.now(timezone.utc) + timedelta(seconds=SCAN_JOB_LEASE_SECONDS)).isoformat(),
+    }
+
+
+async def renew_scan_job_lease(job_id: ObjectId):
+    while True:
+        await asyncio.sleep(SCAN_JOB_LEASE_SECONDS / 3)
+        db.scan_jobs.update_one({"_id": job_id}, {"$set": scan_job_lease()})
+
+
+def interrupt_stale_scan_jobs(job_id: Optional[ObjectId] = None):
+    """Mark open jobs whose lease lapsed as interrupted; jobs of live processes keep running."""
+    query = {
+        "status": {"$in": ["queued", "running"]},
+        # Jobs from before leases existed have none and count as lapsed
+        "$or": [{"lease_expires_at": {"$lte": datetime.now(timezone.utc).isoformat()}}, {"lease_expires_at": None}],
+    }
+    if job_id is not None:
+        query["_id"] = job_id
+    db.scan_jobs.update_many(
+        query,
+        {"$set": {"status": "interrupted", "finished_date": datetime.now(timezone.utc).isoformat()}},
+    )
+
+
+async def run_receipt_batch(job_id: ObjectId, file_urls: List[str], organization: str, refresh: bool):
+    started = time.perf_counter()
+    db.scan_jobs.update_one(
+        {"_id": job_id},
+        {"$set": {"status": "running", "started_date": datetime.now(timezone.utc).isoformat(), **scan_job_lease()}},
+    )
+    heartbeat = asyncio.create_task(renew_scan_job_lease(job_id))
+    semaphore = asyncio.Semaphore(RECEIPT_BATCH_CONCURRENCY)
+    try:
+        outcomes = await asyncio.gather(
+            *[
+                scan_batch_item(job_id, index, file_url, organization, refresh, semaphore)
+                for index, file_url in enumerate(file_urls)
+            ],
+            return_exceptions=True,
+        )
+    finally:
+        heartbeat.cancel()
+    for outcome in outcomes:
+        if isinstance(outcome, Exception):
+            logger.error("Batch receipt scan job %s: %s", job_id, outcome)
+    job = db.scan_jobs.find_one({"_id": job_id}, {"succeeded": 1, "failed": 1, "total": 1})
+    if job.get("succeeded", 0) + job.get("failed", 0) < job.get("total", 0):
+        status = "failed"
+    elif job.get("failed"):
+        status = "completed_with_errors" if job.get("succeeded") else "failed"
+    else:
+        status = "completed"
+    db.scan_jobs.update_one(
+        {"_id": job_id},
+        {"$set": {
+            "status": status,
+            "finished_date": datetime.now(timezone.utc).isoformat(),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        }},
+    )
+
+
+@app.post("/api/ai/scan-receipts/batch")
+async def scan_receipts_batch(request: ReceiptBatchScanRequest):
+    """Start a background job scanning many receipts; poll /api/ai/scan-jobs/{job_id} for progress"""
+    file_urls = [url for url in request.file_urls if url]
+    if not file_urls:
+        raise HTTPException(status_code=400, detail="Keine Belege angegeben")
+    if len(file_urls) > RECEIPT_BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"Maximal {RECEIPT_BATCH_MAX_FILES} Belege pro Stapel")
+    for file_url in file_urls:
+        resolve_upload_key(file_url)
+
+    now = datetime.now(timezone.utc).isoformat()
+    job = {
+        "kind": "receipt",
+        "organization": request.organization,
+        "status": "queued",
+        "total": len(file_urls),
+        "processed": 0,
+        "succeeded": 0,
+        "failed": 0,
+        "items": [{"file_url": file_url, "status": "pending"} for file_url in file_urls],
+        "created_date": now,
+        "updated_date": now,
+        **scan_job_lease(),
+    }
+    job_id = db.scan_jobs.insert_one(job).inserted_id
+    spawn_background_task(run_receipt_batch(job_id, file_urls, request.organization, request.refresh))
+    return {"success": True, "job_id": str(job_id), "status": "queued", "total": len(file_urls)}
+
+
+@app.get("/api/ai/scan-jobs/{job_id}")
+async def get_scan_job(job_id: str, include_items: bool = True):
+    if not ObjectId.is_valid(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    projection = None if include_items else {"items": 0}
+    interrupt_stale_scan_jobs(ObjectId(job_id))
+    job = db.scan_jobs.find_one({"_id": ObjectId(job_id)}, projection)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job = serialize_doc(job)
+    job["progress"] = round(job["processed"] / job["total"], 3) if job.get("total") else 1.0
+    return job
+
+
+# ============ DATEV PLACEHOLDER ============
+
+@app.get("/api/datev/status")
+async def datev_status():
+    return {
+        "status": "placeholder",
+        "message": "DATEVconnect online Integration ist in Vorbereitung.",
+    }
+
+# ============ SMTP HELPERS ============
+
+SMTP_TIMEOUT_SECONDS = float(os.environ.get("SMTP_TIMEOUT_SECONDS", 30))
+
+
+SMTP_POOL_SIZE = int(os.environ.get("SMTP_POOL_SIZE", 4))
+SMTP_POOL_IDLE_SECONDS = float(os.environ.get("SMTP_POOL_IDLE_SECONDS", 120))
+SMTP_NOOP_AFTER_SECONDS = float(os.environ.get("SMTP_NOOP_AFTER_SECONDS", 10))
+
+
+class SmtpConnectionPool:
+    """Authenticated SMTP sessions kept open per server/account and reused across messages.
+
+    A keepalive thread sends NOOP to idle sessions every ``noop_after`` seconds so servers with short
+    idle timeouts do not drop them, and closes sessions that failed the probe or sat unused past ``idle_timeout``.
+    """
+
+    def __init__(self, max_per_key: int, idle_timeout: float, noop_after: float):
+        self.max_per_key = max_per_key
+        self.idle_timeout = idle_timeout
+        self.noop_after = noop_after
+        self._idle = {}
+        self._open = {}
+        self._condition = threading.Condition()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.connects = 0
+        self.reuses = 0
+        self.reconnects = 0
+        self.keepalives = 0
+        self.dropped = 0
+
+    @staticmethod
+    def key(settings: dict):
+        password_hash = hashlib.sha256((settings.get("password") or "").encode()).hexdigest()
+        return settings["host"], settings["port"], settings.get("username"), password_hash
+
+    @staticmethod
+    def connect(settings: dict) -> smtplib.SMTP:
+        server = smtplib.SMTP(settings["host"], settings["port"], timeout=SMTP_TIMEOUT_SECONDS)
+        try:
+            server.starttls(context=ssl.create_default_context())
+            server.login(settings["username"], settings["password"])
+        except Exception:
+            server.close()
+            raise
+        return server
+
+    @staticmethod
+    def close_quietly(server: smtplib.SMTP):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    def acquire(self, settings: dict):
+        """Return ``(server, reused)``; opens a new session only when no healthy idle one is available."""
+        key = self.key(settings)
+        deadline = time.monotonic() + SMTP_TIMEOUT_SECONDS
+        while True:
+            stale = []
+            server = None
+            with self._condition:
+                idle = self._idle.setdefault(key, [])
+                while idle:
+                    candidate, last_used = idle.pop()
+                    if time.monotonic() - last_used > self.idle_timeout:
+                        stale.append(candidate)
+                        self._open[key] -= 1
+                        continue
+                    server = candidate
+                    break
+                if server is None and self._open.get(key, 0) < self.max_per_key:
+                    self._open[key] = self._open.get(key, 0) + 1
+                    server = False
+                if server is None and not stale:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"Keine freie SMTP-Verbindung zu {settings['host']}")
+                    self._condition.wait(remaining)
+                    continue
+            for connection in stale:
+                self.close_quietly(connection)
+            if server is None:
+                continue
+            if server is False:
+                try:
+                    server = self.connect(settings)
+                except Exception:
+                    self._forget(key)
+                    raise
+                self.connects += 1
+                return server, False
+            if time.monotonic() - last_used > self.noop_after:
+                # The server may have dropped a session that sat idle; probe it before handing it out
+                try:
+                    healthy = server.noop()[0] == 250
+                except Exception:
+                    healthy = False
+                if not healthy:
+                    server.close()
+                    self._forget(key)
+                    continue
+            self.reuses += 1
+            return server, True
+
+    def release(self, settings: dict, server: smtplib.SMTP):
+        with self._condition:
+            self._idle.setdefault(self.key(settings), []).append((server, time.monotonic()))
+            self._condition.notify()
+
+    def discard(self, settings: dict, server: smtplib.SMTP):
+        server.close()
+        self._forget(self.key(settings))
+
+    def _forget(self, key):
+        with self._condition:
+            self._open[key] -= 1
+            self._condition.notify()
+
+    def sendmail(self, settings: dict, from_addr: str, to_list: List[str], message: str):
+        for attempt in range(2):
+            server, reused = self.acquire(settings)
+            try:
+                server.sendmail(from_addr, to_list, message)
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as exc:
+                # Rejected message on a live session; smtplib already reset the transaction
+                if getattr(exc, "smtp_code", None) == 421:
+                    self.discard(settings, server)
+                else:
+                    self.release(settings, server)
+                raise
+            except Exception as exc:
+                self.discard(settings, server)
+                # A pooled session can be closed by the server between the health check and DATA
+                if reused and attempt == 0 and isinstance(exc, (smtplib.SMTPServerDisconnected, ConnectionError)):
+                    self.reconnects += 1
+                    continue
+                raise
+            self.release(settings, server)
+            return
+
+    def keepalive(self):
+        """NOOP idle sessions not used for ``noop_after`` seconds; dead and expired ones are closed."""
+        now = time.monotonic()
+        due = []
+        with self._condition:
+            for key, servers in self._idle.items():
+                due.extend((key, server, last_used) for server, last_used in servers if now - last_used > self.noop_after)
+                self._idle[key] = [(server, last_used) for server, last_used in servers if now - last_used <= self.noop_after]
+        healthy = {}
+        for key, server, last_used in due:
+            if now - last_used > self.idle_timeout:
+                self.close_quietly(server)
+                self._forget(key)
+                continue
+            try:
+                alive = server.noop()[0] == 250
+            except Exception:
+                alive = False
+            if not alive:
+                server.close()
+                self._forget(key)
+                self.dropped += 1
+                continue
+            self.keepalives += 1
+            healthy.setdefault(key, []).append((server, last_used))
+        with self._condition:
+            for key, servers in healthy.items():
+                # Older sessions go back below the recently used ones, which are handed out first
+                self._idle.setdefault(key, [])[:0] = servers
+            self._condition.notify_all()
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopping.wait(max(1.0, self.noop_after)):
+            try:
+                self.keepalive()
+            except Exception as exc:
+                logger.error("SMTP keepalive failed: %s", exc)
+
+    def close_all(self):
+        self._stopping.set()
+        with self._condition:
+            idle = [server for servers in self._idle.values() for server, _ in servers]
+            for key, servers in self._idle.items():
+                self._open[key] -= len(servers)
+            self._idle = {}
+        for server in idle:
+            self.close_quietly(server)
+
+    def stats(self):
+        with self._condition:
+            return {
+                "servers": len([key for key, count in self._open.items() if count]),
+                "open": sum(self._open.values()),
+                "idle": sum(len(servers) for servers in self._idle.values()),
+                "connects": self.connects,
+                "reuses": self.reuses,
+                "reconnects": self.reconnects,
+                "keepalives": self.keepalives,
+                "dropped": self.dropped,
+            }
+
+
+smtp_pool = SmtpConnectionPool(SMTP_POOL_SIZE, SMTP_POOL_IDLE_SECONDS, SMTP_NOOP_AFTER_SECONDS)
+
+
+def get_org_smtp_settings(organization: str):
+    org = db.organizations.find_one({"name": organization})
+    if not org:
+        raise HTTPException(status_code=404, detail="Organisation nicht gefunden")
+
+    smtp_fields = ["smtp_host", "smtp_port", "smtp_username", "smtp_password", "smtp_from_email"]
+    missing = [field for field in smtp_fields if not org.get(field)]
+    if missing:
+        raise HTTPException(status_code=400, detail="SMTP-Konfiguration unvollständig")
+
+    return {
+        "host": org.get("smtp_host"),
+        "port": int(org.get("smtp_port")),
+        "username": org.get("smtp_username"),
+        "password": org.get("smtp_password"),
+        "from_email": org.get("smtp_from_email"),
+        "from_name": org.get("smtp_from_name") or org.get("display_name") or "KommunalCRM",
+    }
+
+
+EMAIL_ATTACHMENT_MAX_BYTES = int(os.environ.get("EMAIL_ATTACHMENT_MAX_BYTES", 20 * 1024 * 1024))
+EMAIL_ATTACHMENT_CACHE_BYTES = int(os.environ.get("EMAIL_ATTACHMENT_CACHE_BYTES", 64 * 1024 * 1024))
+
+
+class EncodedAttachmentCache:
+    """Encoded attachments by upload key; uploads never change, so entries only leave by LRU eviction."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._building = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def get(self, key, build):
+        entry = self._lookup(key)
+        if entry is not None:
+            return entry[0]
+        with self._lock:
+            building = self._building.setdefault(key, threading.Lock())
+        # Concurrent sends of the same attachment wait for one encoder instead of encoding in parallel
+        with building:
+            entry = self._lookup(key)
+            if entry is not None:
+                return entry[0]
+            value, size = build()
+            with self._lock:
+                self.misses += 1
+                self._building.pop(key, None)
+                self._entries[key] = (value, size)
+                self.size += size
+                while self.size > self.max_bytes and len(self._entries) > 1:
+                    _, (_, evicted_size) = self._entries.popitem(last=False)
+                    self.size -= evicted_size
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.size, "hits": self.hits, "misses": self.misses}
+
+
+email_attachment_cache = EncodedAttachmentCache(EMAIL_ATTACHMENT_CACHE_BYTES)
+
+
+def resolve_email_attachment(organization: str, attachment_url: Optional[str] = None, document_id: Optional[str] = None,
+                             attachment_base64: Optional[str] = None, attachment_filename: Optional[str] = None) -> Optional[dict]:
+    """Reference ``{"key", "filename"}`` to a stored upload; inline base64 content is stored as an upload first."""
+    if document_id:
+        document = None
+        if ObjectId.is_valid(document_id):
+            document = db.documents.find_one(
+                {"_id": ObjectId(document_id), "organization": organization}, {"file_url": 1, "file_name": 1, "title": 1}
+            )
+        if not document or not document.get("file_url"):
+            raise HTTPException(status_code=404, detail="Dokument nicht gefunden")
+        attachment_url = document["file_url"]
+        attachment_filename = attachment_filename or document.get("file_name") or document.get("title")
+    if attachment_url:
+        key = resolve_upload_key(attachment_url)
+        if not storage.exists(key):
+            raise HTTPException(status_code=404, detail="Anhang nicht gefunden")
+        return {"key": key, "filename": attachment_filename or key.split("_", 1)[-1]}
+    if attachment_base64 and attachment_filename:
+        data = base64.b64decode(attachment_base64)
+        if len(data) > EMAIL_ATTACHMENT_MAX_BYTES:
+            raise HTTPException(status_code=400, detail="Anhang ist zu groß")
+        # Keyed by content so repeated sends of the same file reuse one stored upload
+        key = f"{hashlib.sha256(data).hexdigest()[:32]}_{os.path.basename(attachment_filename)}"
+        if not storage.exists(key):
+            storage.save(key, data, mimetypes.guess_type(attachment_filename)[0])
+        return {"key": key, "filename": attachment_filename}
+    return None
+
+
+def read_email_attachment(attachment: dict) -> bytes:
+    data = storage.read(attachment["key"])
+    if len(data) > EMAIL_ATTACHMENT_MAX_BYTES:
+        raise HTTPException(status_code=400, detail="Anhang ist zu groß")
+    return data
+
+
+def attachment_content_type(filename: str) -> str:
+    return mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+
+def mime_attachment_text(attachment: dict) -> str:
+    """Serialized base64 MIME part, built once per attachment and spliced into every message that carries it."""
+    def build():
+        maintype, subtype = attachment_content_type(attachment["filename"]).split("/", 1)
+        part = MIMEBase(maintype, subtype)
+        part.set_payload(read_email_attachment(attachment))
+        encoders.encode_base64(part)
+        part.add_header("Content-Disposition", "attachment", filename=attachment["filename"])
+        text = part.as_string()
+        return text, len(text)
+
+    return email_attachment_cache.get(("mime", attachment["key"], attachment["filename"]), build)
+
+
+def render_email_message(message: MIMEMultipart, attachment: Optional[dict] = None) -> str:
+    if not attachment:
+        return message.as_string()
+    # Flattening a large base64 part costs far more than sending it; append the cached text as the last part instead
+    boundary = f"==============={uuid.uuid4().hex}=="
+    message.set_boundary(boundary)
+    head, closing, tail = message.as_string().rpartition(f"--{boundary}--")
+    return f"{head}--{boundary}\n{mime_attachment_text(attachment)}\n{closing}{tail}"
+
+
+def base64_attachment_content(attachment: dict) -> str:
+    def build():
+        content = base64.b64encode(read_email_attachment(attachment)).decode()
+        return content, len(content)
+
+    return email_attachment_cache.get(("base64", attachment["key"]), build)
+
+
+def send_smtp_email(settings: dict, to_list: List[str], subject: str, body: str, attachment: Optional[dict] = None):
+    message = MIMEMultipart()
+    message["From"] = f"{settings['from_name']} <{settings['from_email']}>"
+    message["To"] = ", ".join(to_list)
+    message["Subject"] = subject
+
+    message.attach(MIMEText(body or "", "plain"))
+
+    call_with_retries(
+        f"smtp:{settings['host']}", smtp_pool.sendmail, settings, settings["from_email"], to_list,
+        render_email_message(message, attachment),
+    )
+
+
+SMTP_HOST_CONCURRENCY = int(os.environ.get("SMTP_HOST_CONCURRENCY", SMTP_POOL_SIZE))
+# smtplib blocks, so sends run on their own threads; the event loop only awaits them
+smtp_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("SMTP_EXECUTOR_THREADS", 32)), thread_name_prefix="smtp"
+)
+smtp_host_limits = {}
+
+
+def smtp_host_limit(host: str) -> asyncio.Semaphore:
+    """Per-host bound on parallel sends; only used from the API event loop."""
+    limit = smtp_host_limits.get(host)
+    if limit is None:
+        limit = smtp_host_limits[host] = asyncio.Semaphore(SMTP_HOST_CONCURRENCY)
+    return limit
+
+
+async def send_smtp_email_async(settings: dict, to_list: List[str], subject: str, body: str, attachment: Optional[dict] = None):
+    async with smtp_host_limit(settings["host"]):
+        await asyncio.get_running_loop().run_in_executor(
+            smtp_executor,
+            functools.partial(send_smtp_email, settings, to_list, subject, body, attachment),
+        )
+
+
+async def send_smtp_emails_individually(settings: dict, recipients: List[str], subject: str, body: str, attachment: Optional[dict] = None):
+    """Send one message per recipient concurrently; returns ``(sent, failed)`` with failed mapping address to error."""
+    outcomes = await asyncio.gather(
+        *[
+            send_smtp_email_async(settings, [recipient], subject, body, attachment)
+            for recipient in recipients
+        ],
+        return_exceptions=True,
+    )
+    sent = [recipient for recipient, outcome in zip(recipients, outcomes) if not isinstance(outcome, BaseException)]
+    failed = {recipient: outcome for recipient, outcome in zip(recipients, outcomes) if isinstance(outcome, BaseException)}
+    return sent, failed
 
-# ============ DATEV PLACEHOLDER ============
 
-@app.get("/api/datev/status")
-async def datev_status():
-    return {
-        "status": "placeholder",
-        "message": "DATEVconnect online Integration ist in Vorbereitung.",
-    }
+# ============ RECIPIENTS ============
 
-# ============ SMTP HELPERS ============
+RECIPIENT_CACHE_TTL_SECONDS = float(os.environ.get("RECIPIENT_CACHE_TTL_SECONDS", 600))
+# Writes to these collections change who an audience resolves to
+AUDIENCE_COLLECTIONS = {"contacts", "member_groups"}
 
-def get_org_smtp_settings(organization: str):
-    org = db.organizations.find_one({"name": organization})
-    if not org:
-        raise HTTPException(status_code=404, detail="Organisation nicht gefunden")
 
-    smtp_fields = ["smtp_host", "smtp_port", "smtp_username", "smtp_password", "smtp_from_email"]
-    missing = [field for field in smtp_fields if not org.get(field)]
-    if missing:
-        raise HTTPException(status_code=400, detail="SMTP-Konfiguration unvollständig")
+class Audience(BaseModel):
+    organization: Optional[str] = None
+    users: Optional[bool] = True  # registered users of the organization
+    contacts: Optional[bool] = True  # contacts with an email address
+    roles: Optional[List[str]] = None  # only users with one of these roles
+    groups: Optional[List[str]] = None  # only contacts in one of these member groups
+    exclude_groups: Optional[List[str]] = None
 
-    return {
-        "host": org.get("smtp_host"),
-        "port": int(org.get("smtp_port")),
-        "username": org.get("smtp_username"),
-        "password": org.get("smtp_password"),
-        "from_email": org.get("smtp_from_email"),
-        "from_name": org.get("smtp_from_name") or org.get("display_name") or "KommunalCRM",
+
+def audience_cache_key(audience: Audience) -> str:
+    import json
+    normalized = {
+        field: sorted(value) if isinstance(value, list) else value
+        for field, value in audience.model_dump().items()
     }
+    return json.dumps(normalized, sort_keys=True)
 
 
-def send_smtp_email(settings: dict, to_list: List[str], subject: str, body: str, attachment_base64: Optional[str] = None, attachment_filename: Optional[str] = None):
-    message = MIMEMultipart()
-    message["From"] = f"{settings['from_name']} <{settings['from_email']}>"
-    message["To"] = ", ".join(to_list)
-    message["Subject"] = subject
+def get_audience_version(organization: str) -> int:
+    doc = db.audience_versions.find_one({"organization": organization}, {"version": 1})
+    return doc["version"] if doc else 0
 
-    message.attach(MIMEText(body or "", "plain"))
 
-    if attachment_base64 and attachment_filename:
-        part = MIMEBase("application", "octet-stream")
-        part.set_payload(base64.b64decode(attachment_base64))
-        encoders.encode_base64(part)
-        part.add_header("Content-Disposition", f"attachment; filename={attachment_filename}")
-        message.attach(part)
+def bump_audience_version(organization: Optional[str]):
+    """Invalidate cached recipient sets of an organization after its users, contacts or groups changed."""
+    if organization:
+        db.audience_versions.update_one({"organization": organization}, {"$inc": {"version": 1}}, upsert=True)
+
+
+recipient_cache = TTLCache(max_entries=512, ttl=RECIPIENT_CACHE_TTL_SECONDS)
+recipient_cache_lock = threading.Lock()
+
+
+def group_member_ids(organization: str, group_ids: List[str]) -> List[ObjectId]:
+    groups = db.member_groups.find(
+        {"organization": organization, "_id": {"$in": [ObjectId(gid) for gid in group_ids if ObjectId.is_valid(gid)]}},
+        {"member_ids": 1},
+    )
+    return list({ObjectId(mid) for group in groups for mid in group.get("member_ids") or [] if ObjectId.is_valid(mid)})
+
+
+def resolve_recipients(audience: Audience) -> List[str]:
+    """Deduplicated email addresses of an audience; cached until the organization's audience version changes."""
+    organization = audience.organization
+    key = (organization, audience_cache_key(audience), get_audience_version(organization))
+    with recipient_cache_lock:
+        cached = recipient_cache.get(key)
+    if cached is not None:
+        return list(cached)
+
+    emails = {}
+
+    def add(address):
+        address = (address or "").strip()
+        if address:
+            emails.setdefault(address.lower(), address)
+
+    base_query = {"organization": organization, "email": {"$nin": [None, ""]}, "email_opt_out": {"$ne": True}}
+    if audience.users:
+        query = dict(base_query)
+        if audience.roles:
+            query["$or"] = [{"org_role": {"$in": audience.roles}}, {"role": {"$in": audience.roles}}]
+        for user in db.users.find(query, {"email": 1, "_id": 0}):
+            add(user.get("email"))
+    if audience.contacts:
+        query = dict(base_query)
+        id_filter = {}
+        if audience.groups:
+            id_filter["$in"] = group_member_ids(organization, audience.groups)
+        if audience.exclude_groups:
+            id_filter["$nin"] = group_member_ids(organization, audience.exclude_groups)
+        if id_filter:
+            query["_id"] = id_filter
+        for contact in db.contacts.find(query, {"email": 1, "_id": 0}):
+            add(contact.get("email"))
+
+    recipients = tuple(emails.values())
+    with recipient_cache_lock:
+        recipient_cache.set(key, recipients)
+    return list(recipients)
+
+
+@app.post("/api/recipients/resolve")
+async def resolve_audience(audience: Audience):
+    """Preview who an audience expression reaches"""
+    if not audience.organization:
+        raise HTTPException(status_code=400, detail="Organization missing")
+    recipients = resolve_recipients(audience)
+    return {"count": len(recipients), "recipients": recipients}
 
-    context = ssl.create_default_context()
-    with smtplib.SMTP(settings["host"], settings["port"]) as server:
-        server.starttls(context=context)
-        server.login(settings["username"], settings["password"])
-        server.sendmail(settings["from_email"], to_list, message.as_string())
+
+@app.on_event("startup")
+async def create_recipient_indexes():
+    db.users.create_index([("organization", 1), ("email", 1)])
+    db.contacts.create_index([("organization", 1), ("email", 1)])
+    db.member_groups.create_index("organization")
+    db.audience_versions.create_index("organization", unique=True)
 
 
 # ============ EMAIL ENDPOINTS ============
 
 class SendEmailRequest(BaseModel):
-    to: List[str]
+    to: Optional[List[str]] = None
+    audience: Optional[Audience] = None  # resolved server-side instead of an explicit address list
     subject: str
     body: str
+    attachment_url: Optional[str] = None  # /api/uploads/... file sent as attachment
+    document_id: Optional[str] = None  # or a stored document
     attachment_base64: Optional[str] = None
     attachment_filename: Optional[str] = None
+    queue: Optional[bool] = None  # default: queue when there are more than EMAIL_SYNC_MAX_RECIPIENTS recipients
+
+
+SENDGRID_API_HOST = os.environ.get("SENDGRID_API_HOST", "https://api.sendgrid.com")
+# SendGrid accepts at most 1000 personalizations per request
+SENDGRID_BATCH_SIZE = max(1, min(1000, int(os.environ.get("SENDGRID_BATCH_SIZE", 1000))))
+SENDGRID_BATCH_CONCURRENCY = int(os.environ.get("SENDGRID_BATCH_CONCURRENCY", 4))
+# A rejected address is isolated by halving its batch; 10 levels reach single recipients in a full batch
+SENDGRID_BISECT_MAX_DEPTH = int(os.environ.get("SENDGRID_BISECT_MAX_DEPTH", 10))
+# SendGrid requires verified sender - always use the verified sender email
+# Organization's smtp_from_email may not be verified in SendGrid
+SENDGRID_VERIFIED_SENDER = "info@mandatpro.de"
 
+sendgrid_clients = {}
+sendgrid_clients_lock = threading.Lock()
 
-def send_email_via_sendgrid(to_list: List[str], subject: str, body: str, from_email: str = None, from_name: str = None):
-    """Send email using SendGrid API"""
+
+def get_sendgrid_client():
     sendgrid_key = os.environ.get("SENDGRID_API_KEY")
-    
     if not sendgrid_key or not SENDGRID_AVAILABLE:
         raise Exception("SendGrid nicht konfiguriert. Bitte SENDGRID_API_KEY in .env setzen.")
-    
-    # SendGrid requires verified sender - always use the verified sender email
-    # Organization's smtp_from_email may not be verified in SendGrid
-    VERIFIED_SENDER = "info@mandatpro.de"
-    sender = VERIFIED_SENDER
-    
+    with sendgrid_clients_lock:
+        client = sendgrid_clients.get((sendgrid_key, SENDGRID_API_HOST))
+        if client is None:
+            client = sendgrid_clients[(sendgrid_key, SENDGRID_API_HOST)] = SendGridAPIClient(sendgrid_key, host=SENDGRID_API_HOST)
+        return client
+
+
+def build_sendgrid_message(recipients: List[str], subject: str, body: str, display_name: str, attachment: Optional[dict] = None):
+    # is_multiple puts every recipient in its own personalization, so nobody sees the other addresses
+    message = Mail(
+        from_email=(SENDGRID_VERIFIED_SENDER, display_name),
+        to_emails=recipients,
+        subject=subject,
+        html_content=f"<pre style='font-family: Arial, sans-serif;'>{body}</pre>",
+        is_multiple=True,
+    )
+    if attachment:
+        message.attachment = Attachment(
+            FileContent(base64_attachment_content(attachment)),
+            FileName(attachment["filename"]),
+            FileType(attachment_content_type(attachment["filename"])),
+            Disposition("attachment"),
+        )
+    return message
+
+
+def sendgrid_rejected_recipient(error) -> bool:
+    """True when a 400 points at a personalization/recipient field rather than the whole payload."""
+    import json
+    if getattr(error, "status_code", None) != 400:
+        return False
+    try:
+        errors = json.loads(getattr(error, "body", None) or b"{}").get("errors") or []
+    except (ValueError, AttributeError):
+        return False
+    return any(
+        str(item.get("field") or "").startswith(("personalizations", "to"))
+        for item in errors if isinstance(item, dict)
+    )
+
+
+def send_sendgrid_batches(to_list: List[str], subject: str, body: str, from_name: str = None,
+                          attachment: Optional[dict] = None) -> dict:
+    """Send in batches of SENDGRID_BATCH_SIZE; returns the recipients that failed, mapped to their error."""
+    client = get_sendgrid_client()
     # Use from_name from organization if provided, otherwise use a default
     display_name = from_name if from_name else "KommunalCRM"
-    
-    for recipient in to_list:
-        # Use tuple format for from_email to include display name
-        message = Mail(
-            from_email=(sender, display_name),
-            to_emails=recipient,
+    batches = [to_list[i:i + SENDGRID_BATCH_SIZE] for i in range(0, len(to_list), SENDGRID_BATCH_SIZE)]
+
+    def send_batch(recipients: List[str], depth: int = 0) -> dict:
+        message = build_sendgrid_message(recipients, subject, body, display_name, attachment)
+        try:
+            response = call_with_retries("sendgrid", client.send, message)
+            logger.info(f"SendGrid email sent to {len(recipients)} recipients: {response.status_code}")
+            return {}
+        except Exception as e:
+            if sendgrid_rejected_recipient(e) and len(recipients) > 1 and depth < SENDGRID_BISECT_MAX_DEPTH:
+                # One rejected address fails the whole request; halve the batch until it is isolated.
+                # Errors about the payload itself (sender, template, key scope) fail the batch once instead.
+                middle = len(recipients) // 2
+                return {**send_batch(recipients[:middle], depth + 1), **send_batch(recipients[middle:], depth + 1)}
+            logger.error(f"SendGrid error for {len(recipients)} recipients: {type(e).__name__}: {e}")
+            return {recipient: e for recipient in recipients}
+
+    if len(batches) <= 1:
+        return send_batch(batches[0]) if batches else {}
+
+    with ThreadPoolExecutor(max_workers=min(SENDGRID_BATCH_CONCURRENCY, len(batches))) as executor:
+        results = list(executor.map(send_batch, batches))
+    return {recipient: error for failed in results for recipient, error in failed.items()}
+
+
+def send_email_via_sendgrid(to_list: List[str], subject: str, body: str, from_email: str = None, from_name: str = None, attachment: Optional[dict] = None):
+    """Send email using SendGrid API; raises only when no recipient could be reached, otherwise returns the failures."""
+    failed = send_sendgrid_batches(to_list, subject, body, from_name=from_name, attachment=attachment)
+    if failed and len(failed) == len(to_list):
+        raise next(iter(failed.values()))
+    return failed
+
+
+# ============ EMAIL OUTBOX ============
+
+EMAIL_SYNC_MAX_RECIPIENTS = int(os.environ.get("EMAIL_SYNC_MAX_RECIPIENTS", 5))
+EMAIL_WORKER_COUNT = int(os.environ.get("EMAIL_WORKER_COUNT", 4))
+EMAIL_LEASE_SECONDS = float(os.environ.get("EMAIL_LEASE_SECONDS", 300))
+EMAIL_POLL_SECONDS = float(os.environ.get("EMAIL_POLL_SECONDS", 2))
+EMAIL_MAX_ATTEMPTS = int(os.environ.get("EMAIL_MAX_ATTEMPTS", 5))
+EMAIL_OUTBOX_INSERT_BATCH = 1000
+EMAIL_RETRY_BASE_SECONDS = float(os.environ.get("EMAIL_RETRY_BASE_SECONDS", 30))
+EMAIL_RETRY_MAX_SECONDS = float(os.environ.get("EMAIL_RETRY_MAX_SECONDS", 1800))
+EMAIL_RATE_LIMITS = {
+    "sendgrid": float(os.environ.get("EMAIL_RATE_SENDGRID_PER_SECOND", 10)),
+    "smtp": float(os.environ.get("EMAIL_RATE_SMTP_PER_SECOND", 2)),
+}
+
+
+class RateLimiter:
+    """Token bucket shared by all workers sending through one provider."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+rate_limiters = {}
+rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider: str) -> RateLimiter:
+    """One bucket per provider; SMTP is limited per host (``smtp:<host>``)."""
+    with rate_limiters_lock:
+        limiter = rate_limiters.get(provider)
+        if limiter is None:
+            limiter = rate_limiters[provider] = RateLimiter(EMAIL_RATE_LIMITS[provider.split(":", 1)[0]])
+        return limiter
+
+
+def email_provider_for(organization: str) -> str:
+    # Same order as the synchronous path: SendGrid when configured, otherwise the organization's SMTP server
+    if os.environ.get("SENDGRID_API_KEY") and SENDGRID_AVAILABLE:
+        return "sendgrid"
+    return f"smtp:{get_org_smtp_settings(organization)['host']}"
+
+
+def create_email_job(organization: str, subject: str, body: str, total: int, attachment: Optional[dict] = None,
+                     created_by: Optional[str] = None, merge: bool = False) -> dict:
+    now = datetime.now(timezone.utc).isoformat()
+    job = {
+        "organization": organization,
+        "provider": email_provider_for(organization),
+        "subject": subject,
+        "body": body,
+        "attachment": attachment,
+        # Merge jobs carry a rendered subject and body on every outbox entry
+        "merge": merge,
+        "status": "queued",
+        "total": total,
+        "sent": 0,
+        "failed": 0,
+        "created_by": created_by,
+        "created_date": now,
+        "updated_date": now,
+    }
+    job["_id"] = db.email_jobs.insert_one(job).inserted_id
+    return job
+
+
+def enqueue_outbox_entries(job: dict, entries) -> int:
+    """Insert outbox entries in chunks as they are produced; workers start on the first chunk."""
+    now = datetime.now(timezone.utc).isoformat()
+    count = 0
+    chunk = []
+    for entry in entries:
+        chunk.append({
+            "job_id": job["_id"],
+            "organization": job["organization"],
+            "provider": job["provider"],
+            "status": "queued",
+            "attempts": 0,
+            "next_attempt_at": now,
+            "lease_owner": None,
+            "lease_expires_at": None,
+            "created_date": now,
+            **entry,
+        })
+        if len(chunk) >= EMAIL_OUTBOX_INSERT_BATCH:
+            db.email_outbox.insert_many(chunk)
+            count += len(chunk)
+            chunk = []
+            email_workers.wake()
+    if chunk:
+        db.email_outbox.insert_many(chunk)
+        count += len(chunk)
+    email_workers.wake()
+    return count
+
+
+def enqueue_email_job(organization: str, to_list: List[str], subject: str, body: str,
+                      attachment: Optional[dict] = None, created_by: Optional[str] = None) -> dict:
+    """Store the message and one outbox entry per recipient; workers deliver them in the background."""
+    recipients = list(dict.fromkeys(address.strip() for address in to_list if address and address.strip()))
+    if not recipients:
+        raise HTTPException(status_code=400, detail="Keine Empfänger angegeben")
+    job = create_email_job(organization, subject, body, len(recipients), attachment=attachment, created_by=created_by)
+    enqueue_outbox_entries(job, ({"to": recipient} for recipient in recipients))
+    return {"job_id": str(job["_id"]), "total": len(recipients), "provider": job["provider"]}
+
+
+def email_retry_at(attempts: int) -> str:
+    delay = min(EMAIL_RETRY_MAX_SECONDS, EMAIL_RETRY_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+    return (datetime.now(timezone.utc) + timedelta(seconds=random.uniform(delay / 2, delay))).isoformat()
+
+
+def deliver_outbox_items(items: List[dict], job: dict) -> dict:
+    """Send one outbox batch: all recipients in a single SendGrid request, or a single SMTP message.
+
+    Returns the recipients SendGrid rejected; errors affecting the whole batch are raised.
+    """
+    provider = items[0]["provider"]
+    subject = items[0].get("subject", job["subject"])
+    body = items[0].get("body", job["body"])
+    get_rate_limiter(provider).acquire()
+    if provider == "sendgrid":
+        return send_sendgrid_batches(
+            to_list=[item["to"] for item in items],
             subject=subject,
-            html_content=f"<pre style='font-family: Arial, sans-serif;'>{body}</pre>"
+            body=body,
+            from_name=(db.organizations.find_one({"name": job["organization"]}, {"smtp_from_name": 1}) or {}).get("smtp_from_name"),
+            attachment=job.get("attachment"),
         )
+    send_smtp_email(
+        settings=get_org_smtp_settings(job["organization"]),
+        to_list=[item["to"] for item in items],
+        subject=subject,
+        body=body,
+        attachment=job.get("attachment"),
+    )
+    return {}
+
+
+class EmailOutboxWorkers:
+    """Threads draining ``db.email_outbox``; entries are leased so several processes can share the outbox."""
+
+    def __init__(self, worker_count: int):
+        self.worker_count = worker_count
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.threads = []
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+
+    def start(self):
+        if self.threads:
+            return
+        for index in range(self.worker_count):
+            thread = threading.Thread(target=self._run, args=(f"{self.owner}-{index}",), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def claim(self, worker_id: str) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        return db.email_outbox.find_one_and_update(
+            {"$or": [
+                {"status": "queued", "next_attempt_at": {"$lte": now.isoformat()}},
+                # Lease ran out: the worker holding it crashed or the process was restarted
+                {"status": "sending", "lease_expires_at": {"$lte": now.isoformat()}},
+            ]},
+            {
+                "$set": {
+                    "status": "sending",
+                    "lease_owner": worker_id,
+                    "lease_expires_at": (now + timedelta(seconds=EMAIL_LEASE_SECONDS)).isoformat(),
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("next_attempt_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def _run(self, worker_id: str):
+        while not self._stopping.is_set():
+            try:
+                item = self.claim(worker_id)
+            except Exception as exc:
+                logger.error("Email outbox claim failed: %s", exc)
+                item = None
+            if item is None:
+                self._wakeup.wait(EMAIL_POLL_SECONDS)
+                self._wakeup.clear()
+                continue
+            try:
+                self.process(item, worker_id)
+            except Exception as exc:
+                logger.error("Email outbox worker %s failed on %s: %s", worker_id, item["_id"], exc)
+
+    def claim_batch(self, item: dict, worker_id: str) -> List[dict]:
+        """Lease further queued recipients of the same job so SendGrid gets them in one request."""
+        now = datetime.now(timezone.utc)
+        ids = [
+            doc["_id"]
+            for doc in db.email_outbox.find(
+                {"job_id": item["job_id"], "status": "queued", "next_attempt_at": {"$lte": now.isoformat()}},
+                {"_id": 1},
+            ).limit(SENDGRID_BATCH_SIZE - 1)
+        ]
+        if not ids:
+            return []
+        db.email_outbox.update_many(
+            {"_id": {"$in": ids}, "status": "queued"},
+            {
+                "$set": {
+                    "status": "sending",
+                    "lease_owner": worker_id,
+                    "lease_expires_at": (now + timedelta(seconds=EMAIL_LEASE_SECONDS)).isoformat(),
+                },
+                "$inc": {"attempts": 1},
+            },
+        )
+        return list(db.email_outbox.find({"_id": {"$in": ids}, "status": "sending", "lease_owner": worker_id}))
+
+    def process(self, item: dict, worker_id: str):
+        job = db.email_jobs.find_one({"_id": item["job_id"]})
+        if not job:
+            db.email_outbox.delete_one({"_id": item["_id"]})
+            return
+        if job["status"] == "queued":
+            db.email_jobs.update_one(
+                {"_id": job["_id"], "status": "queued"},
+                {"$set": {"status": "running", "started_date": datetime.now(timezone.utc).isoformat()}},
+            )
+        items = [item]
+        if item["provider"] == "sendgrid" and SENDGRID_BATCH_SIZE > 1 and not job.get("merge"):
+            items += self.claim_batch(item, worker_id)
+        exhausted = [entry for entry in items if entry["attempts"] > EMAIL_MAX_ATTEMPTS]
+        if exhausted:
+            # Leases kept expiring mid-delivery; give up instead of retrying forever
+            self.finish(exhausted, job, worker_id, "failed", "Zustellung nach mehreren Versuchen abgebrochen")
+            items = [entry for entry in items if entry["attempts"] <= EMAIL_MAX_ATTEMPTS]
+            if not items:
+                return
         try:
-            sg = SendGridAPIClient(sendgrid_key)
-            response = sg.send(message)
-            logger.info(f"SendGrid email sent to {recipient}: {response.status_code}")
-        except Exception as e:
-            logger.error(f"SendGrid error for {recipient}: {type(e).__name__}: {e}")
-            raise
+            failures = deliver_outbox_items(items, job)
+        except Exception as exc:
+            failures = {entry["to"]: exc for entry in items}
+        delivered = [entry for entry in items if entry["to"] not in failures]
+        if delivered:
+            self.finish(delivered, job, worker_id, "sent")
+        by_error = {}
+        for entry in items:
+            if entry["to"] in failures:
+                error = failures[entry["to"]]
+                by_error.setdefault(id(error), (error, []))[1].append(entry)
+        for error, entries in by_error.values():
+            self.fail(entries, job, worker_id, error)
+
+    def fail(self, items: List[dict], job: dict, worker_id: str, exc: Exception):
+        """Requeue or finish entries after a failed delivery, depending on the error."""
+        if isinstance(exc, CircuitOpenError):
+            # The provider is known to be down; wait for the breaker instead of spending an attempt
+            retry_at = datetime.now(timezone.utc) + timedelta(seconds=exc.retry_after)
+            db.email_outbox.update_many(
+                {"_id": {"$in": [entry["_id"] for entry in items]}, "lease_owner": worker_id},
+                {
+                    "$set": {"status": "queued", "next_attempt_at": retry_at.isoformat(), "last_error": str(exc)},
+                    "$inc": {"attempts": -1},
+                },
+            )
+            return
+        error = (exc.detail if isinstance(exc, HTTPException) else f"{type(exc).__name__}: {exc}")[:500]
+        retryable = not isinstance(exc, HTTPException) and is_transient_error(exc)
+        failed = []
+        for entry in items:
+            if retryable and entry["attempts"] < EMAIL_MAX_ATTEMPTS:
+                db.email_outbox.update_one({"_id": entry["_id"], "lease_owner": worker_id}, {"$set": {
+                    "status": "queued",
+                    "next_attempt_at": email_retry_at(entry["attempts"]),
+                    "last_error": error,
+                }})
+            else:
+                failed.append(entry)
+        if failed:
+            self.finish(failed, job, worker_id, "failed", error)
+
+    def finish(self, items: List[dict], job: dict, worker_id: str, status: str, error: Optional[str] = None):
+        now = datetime.now(timezone.utc).isoformat()
+        finished = []
+        for entry in items:
+            result = db.email_outbox.update_one({"_id": entry["_id"], "lease_owner": worker_id}, {"$set": {
+                "status": status,
+                "last_error": error,
+                "finished_date": now,
+                "lease_owner": None,
+                "lease_expires_at": None,
+            }})
+            # Otherwise another worker took over after our lease expired and will record the outcome
+            if result.modified_count:
+                finished.append(entry)
+        if not finished:
+            return
+        db.email_logs.insert_many([
+            {
+                "to": [entry["to"]],
+                "subject": entry.get("subject", job["subject"]),
+                "body_preview": (entry.get("body", job.get("body")) or "")[:200],
+                "has_attachment": bool(job.get("attachment")),
+                "attachment_filename": (job.get("attachment") or {}).get("filename"),
+                "sent_at": now,
+                "status": status,
+                "error": error,
+                "attempts": entry["attempts"],
+                "job_id": str(job["_id"]),
+                "organization": entry["organization"],
+            }
+            for entry in finished
+        ])
+        counts = db.email_jobs.find_one_and_update(
+            {"_id": job["_id"]},
+            {"$inc": {status: len(finished)}, "$set": {"updated_date": now}},
+            projection={"total": 1, "sent": 1, "failed": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if counts and counts["sent"] + counts["failed"] >= counts["total"]:
+            final_status = "completed" if not counts["failed"] else ("completed_with_errors" if counts["sent"] else "failed")
+            db.email_jobs.update_one(
+                {"_id": job["_id"], "status": {"$in": ["queued", "running"]}},
+                {"$set": {"status": final_status, "finished_date": now}},
+            )
+
+
+email_workers = EmailOutboxWorkers(EMAIL_WORKER_COUNT)
+
+
+@app.get("/api/email/jobs/{job_id}")
+async def get_email_job(job_id: str, include_items: bool = False):
+    """Progress of a queued email job; ``include_items`` lists every recipient with its delivery state"""
+    if not ObjectId.is_valid(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    job = db.email_jobs.find_one({"_id": ObjectId(job_id)}, {"body": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    pending = {
+        row["_id"]: row["count"]
+        for row in db.email_outbox.aggregate([
+            {"$match": {"job_id": job["_id"], "status": {"$in": ["queued", "sending"]}}},
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}},
+        ])
+    }
+    job = serialize_doc(job)
+    job["queued"] = pending.get("queued", 0)
+    job["sending"] = pending.get("sending", 0)
+    job["progress"] = round((job["sent"] + job["failed"]) / job["total"], 3) if job.get("total") else 1.0
+    if include_items:
+        job["items"] = [
+            {
+                "to": item["to"],
+                "subject": item.get("subject", job["subject"]),
+                "status": item["status"],
+                "attempts": item.get("attempts", 0),
+                "next_attempt_at": item.get("next_attempt_at") if item["status"] == "queued" else None,
+                "error": item.get("last_error"),
+            }
+            for item in db.email_outbox.find({"job_id": ObjectId(job_id)}, {"body": 0}).sort("_id", 1)
+        ]
+    return job
 
 
 @app.post("/api/email/send-invitation")
@@ -1366,6 +5199,39 @@ async def send_invitation_email(
     if not organization:
         raise HTTPException(status_code=400, detail="Organization missing")
 
+    to_list = list(request.to or [])
+    if request.audience:
+        to_list += resolve_recipients(request.audience.model_copy(update={"organization": organization}))
+    if not to_list:
+        raise HTTPException(status_code=400, detail="Keine Empfänger angegeben")
+
+    attachment = await asyncio.to_thread(
+        resolve_email_attachment,
+        organization,
+        attachment_url=request.attachment_url,
+        document_id=request.document_id,
+        attachment_base64=request.attachment_base64,
+        attachment_filename=request.attachment_filename,
+    )
+    queue = request.queue if request.queue is not None else len(to_list) > EMAIL_SYNC_MAX_RECIPIENTS
+    if queue:
+        job = enqueue_email_job(
+            organization,
+            to_list,
+            request.subject,
+            request.body,
+            attachment=attachment,
+            created_by=user.get("id"),
+        )
+        return {
+            "success": True,
+            "queued": True,
+            "job_id": job["job_id"],
+            "message": f"Versand an {job['total']} Empfänger eingeplant",
+            "recipients": to_list,
+        }
+
+    failed = {}
     try:
         # Try SendGrid first (if configured), then fall back to SMTP
         sendgrid_key = os.environ.get("SENDGRID_API_KEY")
@@ -1373,36 +5239,39 @@ async def send_invitation_email(
             org_data = db.organizations.find_one({"name": organization})
             from_email = org_data.get("smtp_from_email") if org_data else None
             from_name = org_data.get("smtp_from_name") if org_data else None
-            send_email_via_sendgrid(
-                to_list=request.to,
+            failed = await asyncio.to_thread(
+                send_email_via_sendgrid,
+                to_list=to_list,
                 subject=request.subject,
                 body=request.body,
                 from_email=from_email,
-                from_name=from_name
+                from_name=from_name,
+                attachment=attachment,
             )
         else:
             # Fall back to SMTP
             settings = get_org_smtp_settings(organization)
-            send_smtp_email(
+            await send_smtp_email_async(
                 settings=settings,
-                to_list=request.to,
+                to_list=to_list,
                 subject=request.subject,
                 body=request.body,
-                attachment_base64=request.attachment_base64,
-                attachment_filename=request.attachment_filename,
+                attachment=attachment,
             )
         status = "sent"
-        message = f"Einladung an {len(request.to)} Empfänger gesendet"
+        message = f"Einladung an {len(to_list)} Empfänger gesendet"
+        if failed:
+            message = f"Einladung an {len(to_list) - len(failed)} von {len(to_list)} Empfängern gesendet"
     except Exception as exc:
         status = "failed"
         message = f"E-Mail Versand fehlgeschlagen: {exc}"
 
     email_log = {
-        "to": request.to,
+        "to": to_list,
         "subject": request.subject,
         "body_preview": request.body[:200] if request.body else "",
-        "has_attachment": bool(request.attachment_base64),
-        "attachment_filename": request.attachment_filename,
+        "has_attachment": bool(attachment),
+        "attachment_filename": attachment["filename"] if attachment else None,
         "sent_at": datetime.now(timezone.utc).isoformat(),
         "status": status,
         "organization": organization,
@@ -1415,23 +5284,167 @@ async def send_invitation_email(
     return {
         "success": True,
         "message": message,
-        "recipients": request.to,
+        "recipients": to_list,
+        "failed": list(failed),
+    }
+
+
+# ============ MAIL MERGE ============
+
+MERGE_FIELD_PATTERN = re.compile(r"\{(\w+)\}")
+MERGE_FIELDS = ("vorname", "nachname", "name", "email", "gruppe", "offene_abgabe", "organisation")
+
+
+def compile_merge_template(source: str) -> str:
+    """Turn ``{vorname}``-style placeholders into a format string once per campaign.
+
+    Unknown placeholders and other braces stay literal, so rendering is a single ``format_map`` call.
+    """
+    parts = []
+    position = 0
+    for match in MERGE_FIELD_PATTERN.finditer(source):
+        field = match.group(1).lower()
+        if field not in MERGE_FIELDS:
+            continue
+        parts.append(source[position:match.start()].replace("{", "{{").replace("}", "}}"))
+        parts.append("{" + field + "}")
+        position = match.end()
+    parts.append(source[position:].replace("{", "{{").replace("}", "}}"))
+    return "".join(parts)
+
+
+def load_merge_recipients(organization: str, contact_ids: Optional[List[str]] = None, group_id: Optional[str] = None):
+    """Merge variables per contact with an email address; returns ``(recipients, skipped)``.
+
+    Addresses come from resolve_recipients so opt-outs apply exactly as for every other sender.
+    """
+    query = {"organization": organization}
+    groups = list(db.member_groups.find({"organization": organization}, {"name": 1, "member_ids": 1}))
+    if group_id:
+        group = next((g for g in groups if str(g["_id"]) == group_id), None)
+        if not group:
+            raise HTTPException(status_code=404, detail="Gruppe nicht gefunden")
+        contact_ids = [cid for cid in group.get("member_ids") or [] if not contact_ids or cid in contact_ids]
+    if contact_ids is not None:
+        query["_id"] = {"$in": [ObjectId(cid) for cid in contact_ids if ObjectId.is_valid(cid)]}
+
+    group_names = {}
+    for group in groups:
+        for member_id in group.get("member_ids") or []:
+            group_names.setdefault(member_id, []).append(group.get("name") or "")
+    outstanding = {
+        row["_id"]: row["amount"]
+        for row in db.mandate_levies.aggregate([
+            {"$match": {"organization": organization, "status": {"$ne": "bezahlt"}}},
+            {"$group": {"_id": "$contact_id", "amount": {"$sum": "$final_levy"}}},
+        ])
+    }
+
+    reachable = {
+        email.lower()
+        for email in resolve_recipients(Audience(organization=organization, users=False, groups=[group_id] if group_id else None))
+    }
+    recipients = []
+    seen = set()
+    skipped = 0
+    contacts = db.contacts.find(query, {"first_name": 1, "last_name": 1, "email": 1, "member_group": 1})
+    for contact in contacts:
+        email = (contact.get("email") or "").strip()
+        if not email or email.lower() in seen or email.lower() not in reachable:
+            skipped += 1
+            continue
+        seen.add(email.lower())
+        contact_id = str(contact["_id"])
+        first_name = contact.get("first_name") or ""
+        last_name = contact.get("last_name") or ""
+        recipients.append({
+            "vorname": first_name,
+            "nachname": last_name,
+            "name": f"{first_name} {last_name}".strip(),
+            "email": email,
+            "gruppe": ", ".join(group_names.get(contact_id) or filter(None, [contact.get("member_group")])),
+            "offene_abgabe": format_euro_de(outstanding.get(contact_id, 0)),
+            "organisation": organization,
+        })
+    return recipients, skipped
+
+
+def render_merge_messages(subject: str, body: str, recipients: List[dict]):
+    subject_format = compile_merge_template(subject)
+    body_format = compile_merge_template(body)
+    for values in recipients:
+        yield {"to": values["email"], "subject": subject_format.format_map(values), "body": body_format.format_map(values)}
+
+
+class EmailCampaignRequest(BaseModel):
+    subject: str
+    body: str
+    contact_ids: Optional[List[str]] = None
+    group_id: Optional[str] = None
+    attachment_url: Optional[str] = None
+    document_id: Optional[str] = None
+    attachment_base64: Optional[str] = None
+    attachment_filename: Optional[str] = None
+
+
+@app.post("/api/email/campaigns")
+async def send_email_campaign(
+    request: EmailCampaignRequest,
+    authorization: str = Header(None),
+    authorization_query: Optional[str] = Query(None, alias="authorization"),
+):
+    """Personalized bulk mail: one rendered message per contact, queued in the outbox"""
+    token = extract_token(authorization, authorization_query)
+    user = get_current_user(token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    organization = user.get("organization")
+    if not organization:
+        raise HTTPException(status_code=400, detail="Organization missing")
+    if not request.subject.strip() or not request.body.strip():
+        raise HTTPException(status_code=400, detail="Betreff und Nachricht sind erforderlich")
+
+    recipients, skipped = load_merge_recipients(organization, request.contact_ids, request.group_id)
+    if not recipients:
+        raise HTTPException(status_code=400, detail="Keine Empfänger mit E-Mail-Adresse")
+    attachment = await asyncio.to_thread(
+        resolve_email_attachment,
+        organization,
+        attachment_url=request.attachment_url,
+        document_id=request.document_id,
+        attachment_base64=request.attachment_base64,
+        attachment_filename=request.attachment_filename,
+    )
+
+    started = time.perf_counter()
+    job = create_email_job(
+        organization,
+        request.subject,
+        request.body,
+        len(recipients),
+        attachment=attachment,
+        created_by=user.get("id"),
+        merge=True,
+    )
+    enqueue_outbox_entries(job, render_merge_messages(request.subject, request.body, recipients))
+    return {
+        "success": True,
+        "job_id": str(job["_id"]),
+        "total": len(recipients),
+        "skipped": skipped,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        "message": f"Versand an {len(recipients)} Empfänger eingeplant",
     }
 
+
 class ReminderSendRequest(BaseModel):
     meeting_id: str
     meeting_type: Optional[str] = "meeting"
 
 
-def collect_org_recipients(organization: str):
-    emails = set()
-    for user in db.users.find({"organization": organization}):
-        if user.get("email"):
-            emails.add(user["email"])
-    for contact in db.contacts.find({"organization": organization}):
-        if contact.get("email"):
-            emails.add(contact["email"])
-    return list(emails)
+def meeting_reminder_audience(organization: str, meeting: dict) -> Audience:
+    # Meetings may narrow their reminder to an audience (e.g. member groups); default is the whole organization
+    return Audience(**{**(meeting.get("reminder_audience") or {}), "organization": organization})
 
 
 def build_meeting_reminder_body(meeting: dict, meeting_type: str):
@@ -1447,16 +5460,39 @@ def build_meeting_reminder_body(meeting: dict, meeting_type: str):
     )
 
 
-def send_meeting_reminder(organization: str, meeting: dict, meeting_type: str):
-    recipients = collect_org_recipients(organization)
+async def send_meeting_reminder(organization: str, meeting: dict, meeting_type: str, urgent: bool = False,
+                                reminder_key: Optional[str] = None) -> dict:
+    """Send or hold a reminder per recipient; failed recipients are handed to the outbox for retries."""
+    result = {"sent": 0, "held": 0, "retrying": [], "retry_job_id": None}
+    recipients = resolve_recipients(meeting_reminder_audience(organization, meeting))
     if not recipients:
-        return 0
+        return result
 
-    settings = get_org_smtp_settings(organization)
     subject = f"Erinnerung: {meeting.get('title', 'Sitzung')}"
     body = build_meeting_reminder_body(meeting, meeting_type)
-    send_smtp_email(settings, recipients, subject, body)
-    return len(recipients)
+    # Reminders ride along in the digest unless the meeting starts before it would go out
+    immediate = queue_notifications(
+        organization, recipients, "meeting_reminder", subject, body,
+        urgent=urgent, deliver_by=parse_meeting_start(meeting.get("date")), dedupe_key=reminder_key,
+    )
+    result["held"] = len(recipients) - len(immediate)
+    if not immediate:
+        return result
+
+    settings = get_org_smtp_settings(organization)
+    # One message per recipient keeps the member list private
+    sent, failed = await send_smtp_emails_individually(settings, immediate, subject, body)
+    for recipient, error in failed.items():
+        logger.error("Reminder to %s failed: %s", recipient, error)
+    if failed and not sent:
+        raise next(iter(failed.values()))
+    result["sent"] = len(sent)
+    if failed:
+        # The reminder counts as sent for everyone else, so only the failures are retried
+        job = enqueue_email_job(organization, list(failed), subject, body)
+        result["retrying"] = list(failed)
+        result["retry_job_id"] = job["job_id"]
+    return result
 
 
 @app.post("/api/reminders/send-now")
@@ -1470,52 +5506,390 @@ async def send_reminder_now(request: ReminderSendRequest):
     if not organization:
         raise HTTPException(status_code=400, detail="Organization missing")
 
-    count = send_meeting_reminder(organization, meeting, request.meeting_type)
+    result = await send_meeting_reminder(organization, meeting, request.meeting_type, urgent=True)
     db[collection].update_one({"_id": meeting["_id"]}, {"$set": {"reminder_sent": True, "reminder_sent_date": datetime.now(timezone.utc).isoformat()}})
+    reminder_scheduler.unschedule(collection, request.meeting_id)
+
+    return {
+        "success": True,
+        "recipients": result["sent"] + result["held"],
+        "retrying": result["retrying"],
+        "retry_job_id": result["retry_job_id"],
+    }
 
-    return {"success": True, "recipients": count}
 
+REMINDER_COLLECTIONS = {"meetings": "meeting", "fraction_meetings": "fraction_meeting"}
+REMINDER_OFFSETS_MINUTES = [int(v) for v in os.environ.get("REMINDER_OFFSETS_MINUTES", "1440").split(",") if v.strip()]
+REMINDER_RETRY_SECONDS = int(os.environ.get("REMINDER_RETRY_SECONDS", "300"))
+# Full reload of the queue; catches meetings written outside the API
+REMINDER_RESYNC_SECONDS = int(os.environ.get("REMINDER_RESYNC_SECONDS", "21600"))
+# How often the leader picks up meetings written through other processes
+REMINDER_POLL_SECONDS = int(os.environ.get("REMINDER_POLL_SECONDS", "5"))
+# A crashed leader is replaced once its lease runs out; must exceed clock skew between nodes
+LEADER_LEASE_SECONDS = int(os.environ.get("LEADER_LEASE_SECONDS", "15"))
+# Naive meeting dates come from datetime-local inputs and are local wall-clock times
+APP_TIMEZONE = ZoneInfo(os.environ.get("APP_TIMEZONE", "Europe/Berlin"))
 
-def send_due_reminders():
-    now = datetime.now(timezone.utc)
-    window = now + timedelta(hours=24)
-    start = now.isoformat()
-    end = window.isoformat()
-
-    for collection_name in ["meetings", "fraction_meetings"]:
-        meetings = db[collection_name].find({"date": {"$gte": start, "$lte": end}, "reminder_sent": {"$ne": True}})
-        for meeting in meetings:
-            organization = meeting.get("organization")
-            if not organization:
-                continue
+
+def parse_meeting_start(value) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=APP_TIMEZONE)
+    return parsed.astimezone(timezone.utc)
+
+
+def parse_reminder_offsets(value) -> Optional[List[int]]:
+    """Validate ``reminder_offsets_minutes``: a list of non-negative whole minutes, or None for the default."""
+    if value is None:
+        return None
+    if not isinstance(value, list):
+        raise ValueError("reminder_offsets_minutes must be a list")
+    offsets = []
+    for offset in value:
+        if isinstance(offset, bool) or not isinstance(offset, (int, str)) or not str(offset).strip().isdigit():
+            raise ValueError(f"Invalid reminder offset: {offset!r}")
+        offsets.append(int(offset))
+    return offsets
+
+
+def meeting_reminder_offsets(meeting: dict) -> List[int]:
+    """Minutes before the start at which reminders go out; meetings may override the default."""
+    offsets = parse_reminder_offsets(meeting.get("reminder_offsets_minutes"))
+    if offsets is None:
+        offsets = REMINDER_OFFSETS_MINUTES
+    return sorted(set(offsets), reverse=True)
+
+
+def validate_reminder_fields(data: dict):
+    """Normalize reminder settings in a meeting write before it is stored."""
+    if "reminder_offsets_minutes" in data:
+        try:
+            data["reminder_offsets_minutes"] = parse_reminder_offsets(data["reminder_offsets_minutes"])
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Ungültige Erinnerungszeiten")
+
+
+def reminder_key(meeting: dict, offset: int) -> str:
+    # Keyed by the start date so a rescheduled meeting is reminded again
+    return f"{meeting.get('date')}|{offset}"
+
+
+class LeaderLease:
+    """Lease document in ``db.leader_leases``; only the process holding an unexpired lease runs the named job."""
+
+    def __init__(self, name: str, on_change=None):
+        self.name = name
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self.on_change = on_change
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._set_leader(False)
+        try:
+            # Hand over right away instead of making the next leader wait for expiry
+            db.leader_leases.delete_one({"_id": self.name, "owner": self.owner})
+        except Exception as exc:
+            logger.error("Releasing lease %s failed: %s", self.name, exc)
+
+    def acquire(self) -> bool:
+        """Take the lease if it is free or expired, or extend it if already ours."""
+        now = datetime.now(timezone.utc)
+        try:
+            lease = db.leader_leases.find_one_and_update(
+                {"_id": self.name, "$or": [{"owner": self.owner}, {"expires_at": {"$lte": now.isoformat()}}]},
+                {"$set": {
+                    "owner": self.owner,
+                    "expires_at": (now + timedelta(seconds=LEADER_LEASE_SECONDS)).isoformat(),
+                    "renewed_at": now.isoformat(),
+                }},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # The upsert lost against a live lease held by another process
+            return False
+        return lease is not None
+
+    def _set_leader(self, leader: bool):
+        if leader == self.is_leader:
+            return
+        self.is_leader = leader
+        logger.info("%s %s leadership of %s", self.owner, "acquired" if leader else "lost", self.name)
+        if self.on_change:
+            self.on_change(leader)
+
+    def _run(self):
+        while not self._stopping.is_set():
             try:
-                send_meeting_reminder(organization, meeting, "meeting" if collection_name == "meetings" else "fraction_meeting")
-                db[collection_name].update_one({"_id": meeting["_id"]}, {"$set": {"reminder_sent": True, "reminder_sent_date": datetime.now(timezone.utc).isoformat()}})
+                leader = self.acquire()
             except Exception as exc:
-                logger.error("Reminder send failed: %s", exc)
+                # Without a renewal we cannot rule out that another process has taken over
+                logger.error("Lease %s renewal failed: %s", self.name, exc)
+                leader = False
+            if not self._stopping.is_set():
+                self._set_leader(leader)
+            self._stopping.wait(LEADER_LEASE_SECONDS / 3)
 
 
-def start_reminder_scheduler():
-    global reminder_scheduler_started
-    if reminder_scheduler_started:
-        return
-    reminder_scheduler_started = True
+class ReminderScheduler:
+    """Min-heap of reminder due times; one thread sleeps until the earliest entry.
 
-    def loop():
-        while True:
+    Entries are never removed from the heap. Each carries the meeting's version at push time and is
+    dropped when it pops with an outdated one, so rescheduling or deleting a meeting is O(log n).
+    Only the lease holder keeps a queue; every send is additionally claimed on the meeting document.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._versions = {}
+        self._counter = 0
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread = None
+        self._event_loop = None
+        self._next_resync = 0.0
+        self._next_poll = 0.0
+        self._watermark = None
+        self.lease = LeaderLease("reminders", on_change=self._leadership_changed)
+
+    def start(self, event_loop: asyncio.AbstractEventLoop):
+        if self._thread:
+            return
+        self._event_loop = event_loop
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self.lease.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        self.lease.stop()
+
+    def _leadership_changed(self, leader: bool):
+        with self._condition:
+            self._heap = []
+            self._versions = {}
+            # A new leader cannot know what was written while it followed
+            self._next_resync = 0.0
+            self._condition.notify()
+
+    def status(self) -> dict:
+        with self._condition:
+            live = [entry for entry in self._heap if self._versions.get(entry[2]) == entry[1]]
+            return {
+                "leader": self.lease.is_leader,
+                "owner": self.lease.owner,
+                "pending": len(live),
+                "next_due": datetime.fromtimestamp(min(live)[0], timezone.utc).isoformat() if live else None,
+            }
+
+    def schedule(self, collection_name: str, meeting: dict, retry_offset: Optional[int] = None):
+        """(Re)plan all unsent reminders of a meeting, replacing whatever was queued for it."""
+        if not self.lease.is_leader:
+            # The leader sees the write on its next poll
+            return
+        meeting_key = (collection_name, str(meeting["_id"]))
+        start = parse_meeting_start(meeting.get("date"))
+        now = datetime.now(timezone.utc)
+        entries = []
+        if start and start > now and not meeting.get("reminder_sent") and meeting.get("organization"):
+            sent = set(meeting.get("reminders_sent") or [])
+            for offset in meeting_reminder_offsets(meeting):
+                if reminder_key(meeting, offset) in sent:
+                    continue
+                due = start - timedelta(minutes=offset)
+                if offset == retry_offset:
+                    due = max(due, now + timedelta(seconds=REMINDER_RETRY_SECONDS))
+                entries.append((due.timestamp(), offset))
+            # Offsets already passed collapse into one reminder now instead of a burst
+            overdue = [offset for due, offset in entries if due <= now.timestamp()]
+            entries = [(due, offset) for due, offset in entries if offset not in overdue[1:]]
+        with self._condition:
+            version = self._versions.get(meeting_key, 0) + 1
+            self._versions[meeting_key] = version
+            for due, offset in entries:
+                self._counter += 1
+                heapq.heappush(self._heap, (due, version, meeting_key, self._counter, offset, meeting.get("date")))
+            if not entries:
+                self._versions.pop(meeting_key, None)
+            self._condition.notify()
+
+    def unschedule(self, collection_name: str, meeting_id: str):
+        with self._condition:
+            self._versions.pop((collection_name, meeting_id), None)
+
+    def resync(self):
+        self._watermark = datetime.now(timezone.utc).isoformat()
+        horizon = datetime.now(timezone.utc) - timedelta(days=1)
+        with self._condition:
+            self._heap = []
+            self._versions = {}
+        # Coarse string prefilter only; exact due times are computed from parsed dates
+        self._load({"date": {"$gte": horizon.date().isoformat()}, "reminder_sent": {"$ne": True}})
+
+    def poll_changes(self):
+        """Re-plan meetings written since the last poll, including those written through other processes."""
+        since = self._watermark
+        # Overlap a little so writes still in flight at the last poll are not missed
+        self._watermark = (datetime.now(timezone.utc) - timedelta(seconds=REMINDER_POLL_SECONDS)).isoformat()
+        self._load({"updated_date": {"$gt": since}})
+
+    def _load(self, query: dict):
+        for collection_name in REMINDER_COLLECTIONS:
+            meetings = db[collection_name].find(
+                query, {"date": 1, "organization": 1, "reminder_offsets_minutes": 1, "reminders_sent": 1, "reminder_sent": 1},
+            )
+            for meeting in meetings:
+                try:
+                    self.schedule(collection_name, meeting)
+                except Exception as exc:
+                    # One bad document must not leave every later meeting unscheduled until the next resync
+                    logger.error("Skipping reminders for %s %s: %s", collection_name, meeting.get("_id"), exc)
+
+    def _next_due(self, deadline: float) -> Optional[tuple]:
+        """Pop the earliest live entry once it is due; otherwise sleep until it or ``deadline`` (monotonic)."""
+        with self._condition:
+            # A leadership change resets _next_resync; return so the caller reloads
+            while not self._stopping and self.lease.is_leader and self._next_resync and time.monotonic() < deadline:
+                while self._heap and self._versions.get(self._heap[0][2]) != self._heap[0][1]:
+                    heapq.heappop(self._heap)
+                timeout = deadline - time.monotonic()
+                if self._heap:
+                    wait = self._heap[0][0] - time.time()
+                    if wait <= 0:
+                        return heapq.heappop(self._heap)
+                    timeout = min(timeout, wait)
+                self._condition.wait(timeout)
+        return None
+
+    def _run(self):
+        while not self._stopping:
             try:
-                send_due_reminders()
+                if not self.lease.is_leader:
+                    with self._condition:
+                        self._condition.wait(LEADER_LEASE_SECONDS / 3)
+                    continue
+                now = time.monotonic()
+                if now >= self._next_resync:
+                    self._next_resync = now + REMINDER_RESYNC_SECONDS
+                    self._next_poll = now + REMINDER_POLL_SECONDS
+                    self.resync()
+                elif now >= self._next_poll:
+                    self._next_poll = now + REMINDER_POLL_SECONDS
+                    self.poll_changes()
+                entry = self._next_due(min(self._next_resync, self._next_poll))
+                if entry is not None:
+                    self.fire(entry)
             except Exception as exc:
                 logger.error("Reminder scheduler error: %s", exc)
-            time.sleep(3600)
+                time.sleep(5)
+
+    def fire(self, entry: tuple):
+        _, _, (collection_name, meeting_id), _, offset, date_value = entry
+        meeting = db[collection_name].find_one({"_id": ObjectId(meeting_id)})
+        # Changed since it was queued: the write path has already pushed fresh entries
+        if not meeting or meeting.get("date") != date_value or meeting.get("reminder_sent"):
+            return
+        key = reminder_key(meeting, offset)
+        # Overdue offsets are collapsed into this send, so claim them as well
+        start = parse_meeting_start(date_value)
+        now = datetime.now(timezone.utc)
+        keys = [reminder_key(meeting, other) for other in meeting_reminder_offsets(meeting)
+                if other == offset or start - timedelta(minutes=other) <= now]
+        # The claim is the only write that decides who sends: a deposed leader that has not yet
+        # noticed its lost lease finds the key already taken
+        claimed = db[collection_name].find_one_and_update(
+            {"_id": meeting["_id"], "date": date_value, "reminder_sent": {"$ne": True}, "reminders_sent": {"$ne": key}},
+            {
+                "$addToSet": {"reminders_sent": {"$each": keys}},
+                "$set": {"reminder_claimed_by": self.lease.owner, "reminder_claimed_date": now.isoformat()},
+            },
+            return_document=ReturnDocument.AFTER,
+        )
+        if claimed is None:
+            return
+        try:
+            # Sends are scheduled on the API loop so they share its per-host SMTP limits
+            asyncio.run_coroutine_threadsafe(
+                send_meeting_reminder(
+                    claimed["organization"], claimed, REMINDER_COLLECTIONS[collection_name],
+                    # A failed send is retried under the same key, so held digest entries are not duplicated
+                    reminder_key=f"{collection_name}:{meeting_id}|{key}",
+                ),
+                self._event_loop,
+            ).result()
+        except Exception as exc:
+            logger.error("Reminder send failed for %s %s: %s", collection_name, meeting_id, exc)
+            claimed = db[collection_name].find_one_and_update(
+                {"_id": meeting["_id"]}, {"$pullAll": {"reminders_sent": keys}}, return_document=ReturnDocument.AFTER,
+            )
+            if claimed:
+                self.schedule(collection_name, claimed, retry_offset=offset)
+            return
+        db[collection_name].update_one({"_id": meeting["_id"]}, {"$set": {"reminder_sent_date": datetime.now(timezone.utc).isoformat()}})
+        self.schedule(collection_name, claimed)
 
-    thread = threading.Thread(target=loop, daemon=True)
-    thread.start()
+
+reminder_scheduler = ReminderScheduler()
+
+
+@app.get("/api/reminders/status")
+async def reminder_status():
+    return reminder_scheduler.status()
 
 
 @app.on_event("startup")
 async def schedule_reminders_on_startup():
-    start_reminder_scheduler()
+    for collection_name in REMINDER_COLLECTIONS:
+        db[collection_name].create_index("updated_date")
+    reminder_scheduler.start(asyncio.get_running_loop())
+
+
+@app.on_event("shutdown")
+async def stop_reminder_scheduler():
+    reminder_scheduler.stop()
+
+
+@app.on_event("startup")
+async def mark_interrupted_scan_jobs():
+    # Batch jobs run in-process; only those whose process stopped renewing the lease are dead
+    db.scan_jobs.create_index([("status", 1), ("lease_expires_at", 1)])
+    interrupt_stale_scan_jobs()
+
+
+@app.on_event("startup")
+async def start_email_workers():
+    db.email_outbox.create_index([("status", 1), ("next_attempt_at", 1)])
+    db.email_outbox.create_index("job_id")
+    email_workers.start()
+    smtp_pool.start()
+
+
+@app.on_event("shutdown")
+async def stop_cpu_pool_on_shutdown():
+    cpu_pool.shutdown()
+
+
+@app.on_event("shutdown")
+async def stop_email_workers():
+    email_workers.stop()
+    smtp_pool.close_all()
+    smtp_executor.shutdown(wait=False)
 
 
 class SmtpTestRequest(BaseModel):
@@ -1541,7 +5915,7 @@ Organisation: {request.organization}
 Mit freundlichen Grüßen,
 KommunalCRM System"""
         
-        send_smtp_email(settings, [request.test_email], subject, body)
+        await send_smtp_email_async(settings, [request.test_email], subject, body)
         
         return {
             "success": True,
@@ -1553,6 +5927,229 @@ KommunalCRM System"""
         logger.error("SMTP test failed: %s", str(e))
         raise HTTPException(status_code=500, detail=f"SMTP-Test fehlgeschlagen: {str(e)}")
 
+
+# ============ NOTIFICATION DIGEST ============
+
+# Non-urgent notifications wait this long and go out as one message per recipient; 0 sends everything at once
+NOTIFICATION_DIGEST_SECONDS = int(os.environ.get("NOTIFICATION_DIGEST_SECONDS", "3600"))
+NOTIFICATION_URGENT_TYPES = {
+    value.strip() for value in os.environ.get("NOTIFICATION_URGENT_TYPES", "password_reset,support_ticket_urgent").split(",")
+    if value.strip()
+}
+NOTIFICATION_FLUSH_CHECK_SECONDS = int(os.environ.get("NOTIFICATION_FLUSH_CHECK_SECONDS", "30"))
+
+
+def queue_notifications(organization: str, recipients: List[str], notification_type: str, subject: str, body: str,
+                        urgent: bool = False, deliver_by: Optional[datetime] = None,
+                        dedupe_key: Optional[str] = None) -> List[str]:
+    """Hold a notification for each recipient's next digest; returns the recipients that need it right away.
+
+    Urgent types, notifications due before the digest would go out and users who switched the digest off
+    are returned to the caller instead of being held. With a ``dedupe_key`` a retried notification is held
+    at most once per recipient.
+    """
+    now = datetime.now(timezone.utc)
+    flush_at = now + timedelta(seconds=NOTIFICATION_DIGEST_SECONDS)
+    if (urgent or notification_type in NOTIFICATION_URGENT_TYPES or NOTIFICATION_DIGEST_SECONDS <= 0
+            or (deliver_by is not None and deliver_by <= flush_at)):
+        return list(recipients)
+
+    opted_out = {
+        (user.get("email") or "").lower()
+        for user in db.users.find({"email": {"$in": list(recipients)}, "notification_digest": False}, {"email": 1})
+    }
+    immediate = [recipient for recipient in recipients if recipient.lower() in opted_out]
+    held = [recipient for recipient in recipients if recipient.lower() not in opted_out]
+    if not held:
+        return immediate
+    entry = {
+        "subject": subject,
+        "body": body,
+        "status": "pending",
+        "flush_at": flush_at.isoformat(),
+        "created_date": now.isoformat(),
+    }
+    if not dedupe_key:
+        db.notification_digest.insert_many([
+            {"organization": organization, "recipient": recipient.lower(), "type": notification_type, **entry}
+            for recipient in held
+        ])
+        return immediate
+    try:
+        db.notification_digest.bulk_write([
+            UpdateOne(
+                {"organization": organization, "recipient": recipient.lower(), "type": notification_type, "dedupe_key": dedupe_key},
+                {"$setOnInsert": entry},
+                upsert=True,
+            )
+            for recipient in held
+        ], ordered=False)
+    except BulkWriteError as exc:
+        # A concurrent upsert of the same entry lost the race on the unique index; it is held already
+        if any(error.get("code") != 11000 for error in exc.details.get("writeErrors", [])):
+            raise
+    return immediate
+
+
+def render_digest(items: List[dict]) -> dict:
+    if len(items) == 1:
+        return {"subject": items[0]["subject"], "body": items[0]["body"]}
+    sections = [f"{item['subject']}\n{'-' * len(item['subject'])}\n{item['body']}" for item in items]
+    return {
+        "subject": f"KommunalCRM: {len(items)} neue Benachrichtigungen",
+        "body": f"Ihre Benachrichtigungen seit {format_meeting_date(items[0]['created_date'], with_time=True)} UTC:\n\n"
+                + "\n\n\n".join(sections),
+    }
+
+
+class NotificationDigest:
+    """Flushes due digests through the email outbox; the lease keeps one flusher per deployment."""
+
+    def __init__(self):
+        self.lease = LeaderLease("notification_digest")
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self.lease.start()
+
+    def stop(self):
+        self._stopping.set()
+        self.lease.stop()
+
+    def flush_due(self, organization: Optional[str] = None) -> int:
+        """Send every recipient whose oldest held notification is due, with all they have pending."""
+        query = {"status": "pending", "flush_at": {"$lte": datetime.now(timezone.utc).isoformat()}}
+        if organization:
+            query["organization"] = organization
+        due = {(item["organization"], item["recipient"]) for item in db.notification_digest.find(query, {"organization": 1, "recipient": 1})}
+        messages = {}
+        for org, recipient in due:
+            flush_id = uuid.uuid4().hex
+            # Claimed before reading, so notifications queued meanwhile wait for the next digest
+            db.notification_digest.update_many(
+                {"organization": org, "recipient": recipient, "status": "pending"},
+                {"$set": {"status": "flushed", "flush_id": flush_id, "flushed_date": datetime.now(timezone.utc).isoformat()}},
+            )
+            items = list(db.notification_digest.find({"flush_id": flush_id}).sort("created_date", 1))
+            if items:
+                messages.setdefault(org, []).append((flush_id, {"to": recipient, **render_digest(items)}))
+        queued = 0
+        for org, flushes in messages.items():
+            try:
+                job = create_email_job(org, "Benachrichtigungen", "", len(flushes), merge=True)
+                queued += enqueue_outbox_entries(job, [entry for _, entry in flushes])
+            except Exception as exc:
+                logger.error("Digest for %s could not be queued: %s", org, exc)
+                # Hand the notifications back; they go out with the next digest instead of being lost
+                db.notification_digest.update_many(
+                    {"flush_id": {"$in": [flush_id for flush_id, _ in flushes]}},
+                    {
+                        "$set": {
+                            "status": "pending",
+                            "flush_at": (datetime.now(timezone.utc) + timedelta(seconds=NOTIFICATION_DIGEST_SECONDS)).isoformat(),
+                        },
+                        "$unset": {"flush_id": "", "flushed_date": ""},
+                    },
+                )
+        return queued
+
+    def _run(self):
+        while not self._stopping.is_set():
+            if self.lease.is_leader:
+                try:
+                    self.flush_due()
+                except Exception as exc:
+                    logger.error("Notification digest flush failed: %s", exc)
+            self._stopping.wait(NOTIFICATION_FLUSH_CHECK_SECONDS)
+
+
+notification_digest = NotificationDigest()
+
+
+def notify(organization: str, recipients: List[str], notification_type: str, subject: str, body: str):
+    """Digest-aware notification through the outbox, for senders that do not wait for delivery."""
+    recipients = [recipient for recipient in recipients if recipient]
+    immediate = queue_notifications(organization, recipients, notification_type, subject, body)
+    if immediate:
+        enqueue_email_job(organization, immediate, subject, body)
+
+
+def notify_support_ticket(ticket: dict, previous: Optional[dict] = None):
+    urgent = ticket.get("priority") == "dringend"
+    try:
+        # Support mail goes out through the app owner's organization, never the customer's own mail account
+        owner_email = ((db.app_settings.find_one() or {}).get("app_owner_email") or "").strip().lower()
+        owner = db.users.find_one({"email": owner_email}, {"organization": 1}) if owner_email else None
+        if not owner or not owner.get("organization"):
+            return
+        if previous is None:
+            notify(
+                owner["organization"], [owner_email],
+                "support_ticket_urgent" if urgent else "support_ticket_created",
+                f"Neue Support-Anfrage: {ticket.get('subject', '')}",
+                f"Organisation: {ticket.get('organization_name', '')}\n"
+                f"Kontakt: {ticket.get('contact_email', '')}\n"
+                f"Priorität: {ticket.get('priority', '')}\n\n{ticket.get('description', '')}",
+            )
+        elif ticket.get("status") != previous.get("status") and ticket.get("contact_email"):
+            notify(
+                owner["organization"], [ticket["contact_email"]],
+                "support_ticket_urgent" if urgent else "support_ticket_status",
+                f"Support-Anfrage aktualisiert: {ticket.get('subject', '')}",
+                f"Der Status Ihrer Anfrage wurde auf \"{ticket.get('status')}\" gesetzt."
+                + (f"\n\nLösung:\n{ticket['resolution']}" if ticket.get("resolution") else ""),
+            )
+    except Exception as exc:
+        # A missing mail setup must not fail the ticket write itself
+        logger.error("Support ticket notification failed: %s", exc)
+
+
+@app.get("/api/notifications/digest")
+async def get_notification_digest(organization: str):
+    """Held notifications per recipient"""
+    pending = db.notification_digest.aggregate([
+        {"$match": {"organization": organization, "status": "pending"}},
+        {"$group": {"_id": "$recipient", "count": {"$sum": 1}, "flush_at": {"$min": "$flush_at"}}},
+    ])
+    return {
+        "window_seconds": NOTIFICATION_DIGEST_SECONDS,
+        "recipients": [{"recipient": entry["_id"], "count": entry["count"], "flush_at": entry["flush_at"]} for entry in pending],
+    }
+
+
+@app.post("/api/notifications/digest/flush")
+async def flush_notification_digest(organization: str):
+    """Send held notifications of an organization now instead of at their digest time"""
+    db.notification_digest.update_many(
+        {"organization": organization, "status": "pending"},
+        {"$set": {"flush_at": datetime.now(timezone.utc).isoformat()}},
+    )
+    return {"success": True, "messages": await asyncio.to_thread(notification_digest.flush_due, organization)}
+
+
+@app.on_event("startup")
+async def start_notification_digest():
+    db.notification_digest.create_index([("status", 1), ("flush_at", 1)])
+    db.notification_digest.create_index([("organization", 1), ("recipient", 1), ("status", 1)])
+    db.notification_digest.create_index("flush_id")
+    db.notification_digest.create_index(
+        [("organization", 1), ("recipient", 1), ("type", 1), ("dedupe_key", 1)],
+        unique=True,
+        partialFilterExpression={"dedupe_key": {"$exists": True}},
+    )
+    notification_digest.start()
+
+
+@app.on_event("shutdown")
+async def stop_notification_digest():
+    notification_digest.stop()
+
+
 # ============ PDF GENERATION ============
 
 @app.post("/api/pdf/generate-invitation")
@@ -4,6 +4,10 @@ Tests for:
 - POST /api/ai/generate-email - Bulk email generation with AI
 - POST /api/ai/generate-protocol - Meeting protocol generation with AI
 - POST /api/ai/generate-invitation - Meeting invitation generation with AI
+- POST /api/ai/generate-protocol/stream - Protocol generation streamed as Server-Sent Events
+- POST /api/ai/fraction-meetings/generate-protocol - Protocol prompt built server-side from a stored meeting
+- POST /api/ai/mandate-levies/generate-notice - Levy notice prompt built server-side from a stored levy
+- GET /api/ai/gateway/stats - LLM gateway queue depth and wait time
 """
 
 import pytest
@@ -23,6 +27,39 @@ class TestHealthCheck:
         assert data["status"] == "healthy"
         print("✓ Health check passed")
 
+    def test_health_reports_circuit_breakers(self):
+        """Test dependency circuit breaker state is part of the health output"""
+        response = requests.get(f"{BASE_URL}/api/health")
+        assert response.status_code == 200
+        breakers = response.json()["circuit_breakers"]
+        assert {"llm", "sendgrid"} <= set(breakers)
+        for state in breakers.values():
+            assert state["state"] in ("closed", "open", "half_open")
+        print(f"✓ Circuit breakers reported: {', '.join(sorted(breakers))}")
+
+    def test_health_reports_smtp_pool(self):
+        """Test pooled SMTP connection counters are part of the health output"""
+        response = requests.get(f"{BASE_URL}/api/health")
+        assert response.status_code == 200
+        pool = response.json()["smtp_pool"]
+        assert pool["idle"] <= pool["open"]
+        assert {"connects", "reuses", "reconnects"} <= set(pool)
+        print(f"✓ SMTP pool reported: {pool['open']} open connections")
+
+
+class TestAIGatewayStats:
+    """Tests for /api/ai/gateway/stats endpoint"""
+
+    def test_gateway_stats(self):
+        """Test gateway limits and queue metrics are reported"""
+        response = requests.get(f"{BASE_URL}/api/ai/gateway/stats")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["max_concurrency"] >= data["per_org_concurrency"] >= 1
+        assert data["queued"] >= 0
+        assert "avg_wait_ms" in data and "max_wait_ms" in data
+        print(f"✓ Gateway stats: {data['active']} active, {data['queued']} queued")
+
 
 class TestAIEmailGeneration:
     """Tests for /api/ai/generate-email endpoint"""
@@ -131,6 +168,156 @@ class TestAIProtocolGeneration:
         assert len(data["content"]) > 50
         print("✓ Detailed protocol generated")
 
+    def test_stream_protocol(self):
+        """Test protocol tokens arrive as SSE deltas followed by a done event"""
+        import json
+        response = requests.post(
+            f"{BASE_URL}/api/ai/generate-protocol/stream",
+            json={"prompt": "Kurzes Protokoll: Fraktionssitzung, TOP 1 Begrüßung, TOP 2 Verschiedenes"},
+            stream=True,
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+
+        deltas, event, done = [], None, None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                event = line[7:]
+            elif line.startswith("data: "):
+                payload = json.loads(line[6:])
+                assert event != "error", payload
+                if event == "done":
+                    done = payload
+                    break
+                deltas.append(payload["delta"])
+        assert done is not None and done["success"] == True
+        assert "".join(deltas) == done["content"]
+        print(f"✓ Protocol streamed in {len(deltas)} chunks")
+
+
+class TestAIServerSideContext:
+    """Tests for generation endpoints that take a record id instead of a prompt"""
+
+    def test_protocol_from_stored_meeting(self):
+        """Test the prompt is built from the meeting and kept within the token budget"""
+        meeting = requests.post(
+            f"{BASE_URL}/api/fraction_meetings",
+            json={
+                "title": "TEST_Context_Meeting",
+                "organization": "demo-org",
+                "date": "2026-04-15T18:00:00",
+                "location": "Rathaus",
+                "agenda": "TOP 1: Begrüßung\nTOP 2: Haushalt",
+                "attendees": [f"Mitglied {i}" for i in range(400)],
+            },
+        ).json()
+        try:
+            response = requests.post(
+                f"{BASE_URL}/api/ai/fraction-meetings/generate-protocol",
+                json={"meeting_id": meeting["id"], "max_prompt_tokens": 400},
+            )
+            assert response.status_code == 200
+            data = response.json()
+            assert data["success"] == True
+            assert data["prompt_tokens"] <= 400 < data["source_tokens"]
+            assert "attendees" in data["truncated_sections"]
+            assert len(data["content"]) > 50
+            print(f"✓ Protocol from stored meeting ({data['prompt_tokens']} prompt tokens)")
+        finally:
+            requests.delete(f"{BASE_URL}/api/fraction_meetings/{meeting['id']}")
+
+    def test_unknown_meeting(self):
+        """Test unknown meeting ids return 404"""
+        response = requests.post(
+            f"{BASE_URL}/api/ai/fraction-meetings/generate-protocol",
+            json={"meeting_id": "000000000000000000000000"},
+        )
+        assert response.status_code == 404
+        print("✓ Unknown meeting returns 404")
+
+    def test_unknown_levy(self):
+        """Test unknown levy ids return 404"""
+        response = requests.post(
+            f"{BASE_URL}/api/ai/mandate-levies/generate-notice",
+            json={"levy_id": "not-an-id"},
+        )
+        assert response.status_code == 404
+        print("✓ Unknown levy returns 404")
+
+
+class TestLevyNoticeTemplate:
+    """Tests for levy notices rendered from the notice template without the LLM"""
+
+    def test_render_notices(self):
+        """Test single and bulk notices are rendered from the stored levy"""
+        levy = requests.post(
+            f"{BASE_URL}/api/mandate_levies",
+            json={
+                "contact_name": "TEST_Notice Mandatsträger",
+                "mandate_type": "Ratsmitglied",
+                "mandate_body": "Stadtrat",
+                "period_month": "2026-03",
+                "gross_income": 1234.5,
+                "levy_rate": 10,
+                "deductions": 0,
+                "final_levy": 123.45,
+                "organization": "TEST_notice-org",
+            },
+        ).json()
+        try:
+            response = requests.post(
+                f"{BASE_URL}/api/ai/mandate-levies/generate-notice",
+                json={"levy_id": levy["id"]},
+            )
+            assert response.status_code == 200
+            data = response.json()
+            assert data["renderer"] == "template"
+            assert "Mandatsträgerabgabe 2026-03" in data["content"]
+            assert "1.234,50 €" in data["content"]
+            assert "Zu zahlende Abgabe: 123,45 €" in data["content"]
+
+            response = requests.post(
+                f"{BASE_URL}/api/mandate-levies/notices",
+                json={"organization": "TEST_notice-org", "period_month": "2026-03"},
+            )
+            assert response.status_code == 200
+            data = response.json()
+            assert data["count"] == 1
+            assert data["notices"][0]["levy_id"] == levy["id"]
+            print(f"✓ Levy notices rendered in {data['duration_ms']} ms")
+        finally:
+            requests.delete(f"{BASE_URL}/api/mandate_levies/{levy['id']}")
+
+    def test_organization_template_and_filter(self):
+        """Test a saved levy_notice print template is used and unfiltered bulk requests are rejected"""
+        levy = requests.post(
+            f"{BASE_URL}/api/mandate_levies",
+            json={"contact_name": "TEST_Notice Vorlage", "period_month": "2026-04", "final_levy": 50, "organization": "TEST_notice-org"},
+        ).json()
+        template = requests.post(
+            f"{BASE_URL}/api/print_templates",
+            json={
+                "name": "TEST_Bescheid",
+                "organization": "TEST_notice-org",
+                "document_type": "levy_notice",
+                "body_template": "Bescheid für {{ recipient.name }}: {{ levy.final_levy | euro }}",
+            },
+        ).json()
+        try:
+            response = requests.post(
+                f"{BASE_URL}/api/mandate-levies/notices",
+                json={"organization": "TEST_notice-org", "levy_ids": [levy["id"]]},
+            )
+            assert response.status_code == 200
+            assert response.json()["notices"][0]["content"] == "Bescheid für TEST_Notice Vorlage: 50,00 €"
+
+            response = requests.post(f"{BASE_URL}/api/mandate-levies/notices", json={"organization": "TEST_notice-org"})
+            assert response.status_code == 400
+            print("✓ Organization notice template applied")
+        finally:
+            requests.delete(f"{BASE_URL}/api/print_templates/{template['id']}")
+            requests.delete(f"{BASE_URL}/api/mandate_levies/{levy['id']}")
+
 
 class TestAIInvitationGeneration:
     """Tests for /api/ai/generate-invitation endpoint"""
@@ -0,0 +1,154 @@
+"""
+Test structured bank statement import for KommunalCRM
+Tests:
+- POST /api/accounting/import-bank-statement - CAMT.053 XML and MT940 without LLM calls
+- GET /api/accounting/category-model - Per-organization category classifier status
+"""
+import io
+
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+CAMT053 = """<?xml version="1.0" encoding="UTF-8"?>
+<Document xmlns="urn:iso:std:iso:20022:tech:xsd:camt.053.001.02">
+  <BkToCstmrStmt>
+    <Stmt>
+      <Id>TEST-1</Id>
+      <Ntry>
+        <Amt Ccy="EUR">25.00</Amt>
+        <CdtDbtInd>CRDT</CdtDbtInd>
+        <BookgDt><Dt>2026-02-01</Dt></BookgDt>
+        <NtryDtls><TxDtls>
+          <RltdPties><Dbtr><Nm>Erika Mustermann</Nm></Dbtr></RltdPties>
+          <RmtInf><Ustrd>Mitgliedsbeitrag Februar</Ustrd></RmtInf>
+        </TxDtls></NtryDtls>
+      </Ntry>
+      <Ntry>
+        <Amt Ccy="EUR">450.00</Amt>
+        <CdtDbtInd>DBIT</CdtDbtInd>
+        <BookgDt><Dt>2026-02-03</Dt></BookgDt>
+        <NtryDtls><TxDtls>
+          <RltdPties><Cdtr><Nm>Stadthalle GmbH</Nm></Cdtr></RltdPties>
+          <RmtInf><Ustrd>Miete Sitzungssaal</Ustrd></RmtInf>
+        </TxDtls></NtryDtls>
+      </Ntry>
+      <Ntry>
+        <Amt Ccy="EUR">25.00</Amt>
+        <CdtDbtInd>DBIT</CdtDbtInd>
+        <RvslInd>true</RvslInd>
+        <BookgDt><Dt>2026-02-04</Dt></BookgDt>
+        <NtryDtls><TxDtls>
+          <RltdPties><Cdtr><Nm>Erika Mustermann</Nm></Cdtr></RltdPties>
+          <RmtInf><Ustrd>Ruecklastschrift Mitgliedsbeitrag</Ustrd></RmtInf>
+        </TxDtls></NtryDtls>
+      </Ntry>
+    </Stmt>
+  </BkToCstmrStmt>
+</Document>
+"""
+
+MT940 = """:20:STARTUMSE
+:25:37040044/0532013000
+:28C:00000/001
+:60F:C260201EUR1000,00
+:61:2602010201CR100,00NTRFNONREF
+:86:166?00GUTSCHRIFT?20SVWZ+Spende Sommerfest?32Max Muster
+:61:2602030203C50,NTRFNONREF
+:86:166?00GUTSCHRIFT?20SVWZ+Mitgliedsbeitrag?32Erika Muster
+:61:2602050205DR4,90NCHGNONREF
+:86:805?00ENTGELT?20Kontofuehrungsgebuehr
+:62F:C260205EUR1145,10
+-
+"""
+
+
+def upload(name, content):
+    response = requests.post(
+        f"{BASE_URL}/api/files/upload",
+        files={"file": (name, io.BytesIO(content.encode()), "application/octet-stream")},
+    )
+    assert response.status_code == 200, f"Upload failed: {response.text}"
+    return response.json()["file_url"]
+
+
+class TestBankStatementImport:
+    """Tests for /api/accounting/import-bank-statement"""
+
+    def test_import_camt053(self):
+        """Test CAMT.053 bookings are mapped to the transaction schema"""
+        file_url = upload("statement.xml", CAMT053)
+        response = requests.post(
+            f"{BASE_URL}/api/accounting/import-bank-statement",
+            json={"file_url": file_url, "organization": "demo-org"},
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["success"] == True
+        assert data["format"] == "camt053"
+        assert data["count"] == 3
+
+        income, expense, reversal = data["transactions"]
+        assert income["transaction_type"] == "einnahme"
+        assert income["amount"] == 25.0
+        assert income["date"] == "2026-02-01"
+        assert income["sender_receiver"] == "Erika Mustermann"
+        assert income["category"] == "mitgliedsbeitrag"
+        assert expense["transaction_type"] == "ausgabe"
+        assert expense["category"] == "raummiete"
+        # A returned direct debit is booked as a debit; RvslInd must not flip it again
+        assert reversal["transaction_type"] == "ausgabe"
+        assert reversal["sender_receiver"] == "Erika Mustermann"
+        print("✓ CAMT.053 statement imported")
+
+    def test_import_mt940(self):
+        """Test MT940 :61:/:86: records including ?xx subfields"""
+        file_url = upload("statement.sta", MT940)
+        response = requests.post(
+            f"{BASE_URL}/api/accounting/import-bank-statement",
+            json={"file_url": file_url, "organization": "demo-org"},
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["format"] == "mt940"
+        assert data["count"] == 3
+        assert data["error"] is None
+
+        donation, dues, fee = data["transactions"]
+        assert donation["description"] == "Spende Sommerfest"
+        assert donation["sender_receiver"] == "Max Muster"
+        assert donation["category"] == "spende"
+        # Whole amounts end in a bare comma ("C50,")
+        assert dues["amount"] == 50.0
+        assert dues["transaction_type"] == "einnahme"
+        assert fee["amount"] == 4.9
+        assert fee["transaction_type"] == "ausgabe"
+        assert fee["category"] == "verwaltung"
+        print("✓ MT940 statement imported")
+
+    def test_unknown_format(self):
+        """Test non-statement files are rejected"""
+        file_url = upload("notes.txt", "just some notes")
+        response = requests.post(
+            f"{BASE_URL}/api/accounting/import-bank-statement",
+            json={"file_url": file_url, "organization": "demo-org"},
+        )
+        assert response.status_code == 400
+        print("✓ Unknown format rejected")
+
+    def test_category_model_status(self):
+        """Test the classifier status reports training state and thresholds"""
+        response = requests.get(
+            f"{BASE_URL}/api/accounting/category-model",
+            params={"organization": "demo-org"},
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["organization"] == "demo-org"
+        assert isinstance(data["ready"], bool)
+        assert 0 < data["min_confidence"] <= 1
+        if data["ready"]:
+            assert data["samples"] >= data["min_samples"]
+        print(f"✓ Category model status: ready={data['ready']}, samples={data['samples']}")
@@ -0,0 +1,242 @@
+"""
+Test the email outbox for KommunalCRM
+Tests:
+- POST /api/email/send-invitation with queue=true - Enqueue a bulk mail and return a job id
+- GET /api/email/jobs/{job_id} - Delivery progress per recipient
+- Inline base64 attachments stored once per content
+- POST /api/email/campaigns - Personalized bulk mail rendered per contact, honouring opt-outs
+"""
+import base64
+import hashlib
+import time
+
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+def wait_for_job(job_id, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        response = requests.get(f"{BASE_URL}/api/email/jobs/{job_id}", params={"include_items": True})
+        assert response.status_code == 200
+        job = response.json()
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(0.5)
+    pytest.fail(f"Email job {job_id} did not finish within {timeout}s")
+
+
+class TestEmailOutbox:
+    """Tests for queued bulk email delivery"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """Login as demo user"""
+        login_resp = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": "demo@kommunalcrm.de",
+            "password": "demo123"
+        })
+        self.headers = {"Authorization": f"Bearer {login_resp.json().get('token')}"}
+
+    def test_bulk_mail_is_queued(self):
+        """Test the endpoint returns a job id immediately and every recipient gets a final state"""
+        recipients = [f"test-outbox-{i}@example.com" for i in range(3)]
+        response = requests.post(
+            f"{BASE_URL}/api/email/send-invitation",
+            json={"to": recipients + [recipients[0]], "subject": "TEST_Outbox", "body": "Test", "queue": True},
+            headers=self.headers,
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["queued"] == True and data["job_id"]
+
+        job = wait_for_job(data["job_id"])
+        assert job["total"] == 3
+        assert job["sent"] + job["failed"] == 3
+        assert job["progress"] == 1.0
+        assert sorted(item["to"] for item in job["items"]) == recipients
+        assert all(item["status"] in ("sent", "failed") for item in job["items"])
+        print(f"✓ Bulk mail queued and delivered ({job['sent']} sent, {job['failed']} failed)")
+
+    def test_attachment_by_upload_reference(self):
+        """Test an uploaded file can be attached by its URL instead of inline base64"""
+        upload = requests.post(
+            f"{BASE_URL}/api/files/upload",
+            files={"file": ("TEST_Einladung.pdf", b"%PDF-1.4 test", "application/pdf")},
+        ).json()
+        response = requests.post(
+            f"{BASE_URL}/api/email/send-invitation",
+            json={
+                "to": ["test-outbox-attachment@example.com"],
+                "subject": "TEST_Outbox_Attachment",
+                "body": "Test",
+                "attachment_url": upload["file_url"],
+                "queue": True,
+            },
+            headers=self.headers,
+        )
+        assert response.status_code == 200
+        job = wait_for_job(response.json()["job_id"])
+        assert job["attachment"]["filename"] == "TEST_Einladung.pdf"
+        print("✓ Attachment referenced by upload URL")
+
+    def test_inline_attachment_stored_once(self):
+        """Test repeated sends of the same inline attachment reuse one stored upload"""
+        content = b"%PDF-1.4 inline attachment"
+        for _ in range(2):
+            response = requests.post(
+                f"{BASE_URL}/api/email/send-invitation",
+                json={
+                    "to": ["test-outbox-attachment@example.com"],
+                    "subject": "TEST_Outbox_Attachment",
+                    "body": "Test",
+                    "attachment_base64": base64.b64encode(content).decode(),
+                    "attachment_filename": "TEST_Inline.pdf",
+                    "queue": True,
+                },
+                headers=self.headers,
+            )
+            assert response.status_code == 200
+            wait_for_job(response.json()["job_id"])
+
+        key = f"{hashlib.sha256(content).hexdigest()[:32]}_TEST_Inline.pdf"
+        response = requests.get(f"{BASE_URL}/api/files/presign-download", params={"file_url": f"/api/uploads/{key}"})
+        assert response.status_code == 200
+        print("✓ Inline attachment stored under its content hash")
+
+    def test_unknown_attachment(self):
+        """Test a missing upload is rejected before anything is queued"""
+        response = requests.post(
+            f"{BASE_URL}/api/email/send-invitation",
+            json={
+                "to": ["test-outbox-attachment@example.com"],
+                "subject": "TEST_Outbox_Attachment",
+                "body": "Test",
+                "attachment_url": "/api/uploads/missing-attachment.pdf",
+                "queue": True,
+            },
+            headers=self.headers,
+        )
+        assert response.status_code == 404
+        print("✓ Missing attachment returns 404")
+
+    def test_unknown_job(self):
+        """Test unknown job ids return 404"""
+        response = requests.get(f"{BASE_URL}/api/email/jobs/000000000000000000000000")
+        assert response.status_code == 404
+        print("✓ Unknown email job returns 404")
+
+
+class TestEmailCampaign:
+    """Tests for personalized mail-merge campaigns"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """Login as demo user and create contacts"""
+        login_resp = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": "demo@kommunalcrm.de",
+            "password": "demo123"
+        })
+        self.headers = {"Authorization": f"Bearer {login_resp.json().get('token')}"}
+        self.contacts = [
+            requests.post(f"{BASE_URL}/api/contacts", json={
+                "first_name": first_name,
+                "last_name": "TEST_Merge",
+                "email": email,
+                "organization": "demo-org",
+            }).json()
+            for first_name, email in [("Anna", "test-merge-anna@example.com"), ("Ben", "test-merge-ben@example.com"), ("Carl", None)]
+        ]
+        yield
+        for contact in self.contacts:
+            requests.delete(f"{BASE_URL}/api/contacts/{contact['id']}")
+
+    def test_campaign_personalizes_each_message(self):
+        """Test every contact gets its own subject and contacts without email are skipped"""
+        response = requests.post(
+            f"{BASE_URL}/api/email/campaigns",
+            json={
+                "subject": "Hallo {vorname}",
+                "body": "Sehr geehrte/r {name},\noffene Abgabe: {offene_abgabe}",
+                "contact_ids": [contact["id"] for contact in self.contacts],
+            },
+            headers=self.headers,
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["total"] == 2 and data["skipped"] == 1
+
+        job = wait_for_job(data["job_id"])
+        assert sorted(item["subject"] for item in job["items"]) == ["Hallo Anna", "Hallo Ben"]
+        print(f"✓ Campaign rendered in {data['duration_ms']} ms")
+
+    def test_campaign_skips_opted_out_contacts(self):
+        """Test a contact who opted out of email gets no outbox entry"""
+        requests.put(f"{BASE_URL}/api/contacts/{self.contacts[1]['id']}", json={"email_opt_out": True})
+        response = requests.post(
+            f"{BASE_URL}/api/email/campaigns",
+            json={
+                "subject": "Hallo {vorname}",
+                "body": "Test",
+                "contact_ids": [contact["id"] for contact in self.contacts],
+            },
+            headers=self.headers,
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["total"] == 1 and data["skipped"] == 2
+
+        job = wait_for_job(data["job_id"])
+        assert [item["to"] for item in job["items"]] == ["test-merge-anna@example.com"]
+        print("✓ Opted-out contact left out of the campaign")
+
+
+class TestRecipientResolver:
+    """Audience expressions resolved to deduplicated addresses"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """Create contacts, two sharing one address, and a member group with all of them"""
+        self.contacts = [
+            requests.post(f"{BASE_URL}/api/contacts", json={
+                "first_name": "TEST",
+                "last_name": "Audience",
+                "email": email,
+                "organization": "demo-org",
+            }).json()
+            for email in ["test-audience-a@example.com", "TEST-AUDIENCE-A@example.com", "test-audience-b@example.com"]
+        ]
+        self.group = requests.post(f"{BASE_URL}/api/member_groups", json={
+            "name": "TEST_Audience",
+            "organization": "demo-org",
+            "member_ids": [contact["id"] for contact in self.contacts],
+        }).json()
+        yield
+        for contact in self.contacts:
+            requests.delete(f"{BASE_URL}/api/contacts/{contact['id']}")
+        requests.delete(f"{BASE_URL}/api/member_groups/{self.group['id']}")
+
+    def resolve(self):
+        response = requests.post(f"{BASE_URL}/api/recipients/resolve", json={
+            "organization": "demo-org",
+            "users": False,
+            "groups": [self.group["id"]],
+        })
+        assert response.status_code == 200
+        return response.json()
+
+    def test_group_members_deduplicated(self):
+        """Test group members are resolved case-insensitively"""
+        data = self.resolve()
+        assert sorted(email.lower() for email in data["recipients"]) == ["test-audience-a@example.com", "test-audience-b@example.com"]
+        print(f"✓ Group resolved to {data['count']} recipients")
+
+    def test_contact_change_invalidates_cache(self):
+        """Test an opt-out is visible on the next resolution"""
+        assert self.resolve()["count"] == 2
+        requests.put(f"{BASE_URL}/api/contacts/{self.contacts[2]['id']}", json={"email_opt_out": True})
+        assert [email.lower() for email in self.resolve()["recipients"]] == ["test-audience-a@example.com"]
+        print("✓ Opt-out invalidated cached audience")
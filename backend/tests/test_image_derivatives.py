@@ -0,0 +1,94 @@
+"""
+Test image derivative endpoint for KommunalCRM
+Tests:
+- POST /api/files/upload - Upload a logo
+- GET /api/files/derivative - Resized/re-encoded variants served from the disk cache
+"""
+import io
+import struct
+import zlib
+
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+def make_png(width, height):
+    """Build a minimal solid-color RGB PNG without extra dependencies"""
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    raw = b"".join(b"\x00" + b"\xcc\x22\x22" * width for _ in range(height))
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw))
+        + chunk(b"IEND", b"")
+    )
+
+
+@pytest.fixture(scope="module")
+def uploaded_logo():
+    """Upload a 400x200 PNG and return its file_url"""
+    response = requests.post(
+        f"{BASE_URL}/api/files/upload",
+        files={"file": ("derivative-test.png", io.BytesIO(make_png(400, 200)), "image/png")},
+    )
+    assert response.status_code == 200, f"Upload failed: {response.text}"
+    return response.json()["file_url"]
+
+
+class TestImageDerivatives:
+    """Tests for /api/files/derivative"""
+
+    def test_thumbnail_webp(self, uploaded_logo):
+        """Test a 48px WebP thumbnail is smaller than the original"""
+        response = requests.get(
+            f"{BASE_URL}/api/files/derivative",
+            params={"file_url": uploaded_logo, "width": 48, "format": "webp"},
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "image/webp"
+        assert "immutable" in response.headers.get("cache-control", "")
+        assert response.content[:4] == b"RIFF"
+        print(f"✓ WebP thumbnail served ({len(response.content)} bytes)")
+
+    def test_resized_png_keeps_aspect_ratio(self, uploaded_logo):
+        """Test the PNG variant is bounded by the requested box"""
+        response = requests.get(
+            f"{BASE_URL}/api/files/derivative",
+            params={"file_url": uploaded_logo, "width": 100, "height": 100, "format": "png"},
+        )
+        assert response.status_code == 200
+        width, height = struct.unpack(">II", response.content[16:24])
+        assert (width, height) == (100, 50)
+        print("✓ PNG derivative resized to 100x50")
+
+    def test_repeated_request_is_identical(self, uploaded_logo):
+        """Test the second request is served from the cache with the same bytes"""
+        params = {"file_url": uploaded_logo, "width": 64, "format": "jpeg", "quality": 70}
+        first = requests.get(f"{BASE_URL}/api/files/derivative", params=params)
+        second = requests.get(f"{BASE_URL}/api/files/derivative", params=params)
+        assert first.status_code == 200 and second.status_code == 200
+        assert first.content == second.content
+        print("✓ Cached derivative returned")
+
+    def test_unsupported_format(self, uploaded_logo):
+        """Test unsupported output formats are rejected"""
+        response = requests.get(
+            f"{BASE_URL}/api/files/derivative",
+            params={"file_url": uploaded_logo, "format": "gif"},
+        )
+        assert response.status_code == 400
+        print("✓ Unsupported format rejected")
+
+    def test_invalid_file_url(self):
+        """Test non-upload URLs are rejected"""
+        response = requests.get(
+            f"{BASE_URL}/api/files/derivative",
+            params={"file_url": "https://example.com/logo.png", "width": 48},
+        )
+        assert response.status_code == 400
+        print("✓ Invalid file_url rejected")
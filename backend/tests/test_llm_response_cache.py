@@ -0,0 +1,103 @@
+"""
+Test the LLM response cache for KommunalCRM
+Tests:
+- Identical concurrent requests share one upstream call
+- Cached responses are served until the TTL expires
+- Errors reach every waiting caller and are not cached
+- A cancelled first caller does not cancel the call for the others
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+try:
+    import server
+except RuntimeError:
+    pytest.skip("MONGO_URL and DB_NAME must be set", allow_module_level=True)
+
+
+class CountingCall:
+    def __init__(self, value="Antwort", error=None, delay=0.05):
+        self.value = value
+        self.error = error
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.value
+
+
+class TestLlmResponseCache:
+    """Tests for the single-flight completion cache"""
+
+    def test_concurrent_requests_coalesced(self):
+        """Test five identical requests in flight cause one upstream call"""
+        cache = server.LlmResponseCache(max_entries=10, ttl=60)
+        call = CountingCall()
+
+        async def run():
+            return await asyncio.gather(*(cache.get_or_call("key", call) for _ in range(5)))
+
+        assert asyncio.run(run()) == ["Antwort"] * 5
+        assert call.calls == 1
+        stats = cache.stats()
+        assert stats["misses"] == 1 and stats["coalesced"] == 4 and stats["inflight"] == 0
+        print("✓ 5 concurrent requests shared 1 upstream call")
+
+    def test_cached_until_ttl(self, monkeypatch):
+        """Test a finished response is served from the cache and refetched after the TTL"""
+        cache = server.LlmResponseCache(max_entries=10, ttl=60)
+        call = CountingCall()
+        asyncio.run(cache.get_or_call("key", call))
+        assert asyncio.run(cache.get_or_call("key", call)) == "Antwort"
+        assert call.calls == 1 and cache.stats()["hits"] == 1
+
+        monotonic = server.time.monotonic
+        monkeypatch.setattr(server.time, "monotonic", lambda: monotonic() + 61)
+        asyncio.run(cache.get_or_call("key", call))
+        assert call.calls == 2
+        print("✓ Cached response expired after its TTL")
+
+    def test_error_shared_and_not_cached(self):
+        """Test a failed call raises for every waiting caller and the next request retries"""
+        cache = server.LlmResponseCache(max_entries=10, ttl=60)
+        call = CountingCall(error=ValueError("upstream"))
+
+        async def run():
+            return await asyncio.gather(*(cache.get_or_call("key", call) for _ in range(3)), return_exceptions=True)
+
+        results = asyncio.run(run())
+        assert all(isinstance(r, ValueError) for r in results)
+        assert call.calls == 1
+
+        call.error = None
+        assert asyncio.run(cache.get_or_call("key", call)) == "Antwort"
+        assert call.calls == 2
+        print("✓ Error shared by waiting callers and not cached")
+
+    def test_cancelled_leader_keeps_call_running(self):
+        """Test cancelling the first caller still delivers the response to the callers that joined it"""
+        cache = server.LlmResponseCache(max_entries=10, ttl=60)
+        call = CountingCall(delay=0.2)
+
+        async def run():
+            leader = asyncio.ensure_future(cache.get_or_call("key", call))
+            await asyncio.sleep(0.01)
+            follower = asyncio.ensure_future(cache.get_or_call("key", call))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await leader
+            return await follower
+
+        assert asyncio.run(run()) == "Antwort"
+        assert call.calls == 1
+        assert cache.get("key") == "Antwort"
+        print("✓ Follower got the response after the first caller was cancelled")
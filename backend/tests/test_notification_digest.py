@@ -0,0 +1,68 @@
+"""
+Test the notification digest for KommunalCRM
+Tests:
+- PUT /api/support_tickets/{id} - Status notifications held for the contact's digest
+- GET /api/notifications/digest - Held notifications per recipient
+- POST /api/notifications/digest/flush - One message per recipient for everything held
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+class TestNotificationDigest:
+    """Tests for batching non-urgent notifications per recipient"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """Make the demo user app owner if nobody is, flush anything left over and create tickets"""
+        settings = requests.get(f"{BASE_URL}/api/app_settings").json()
+        self.created_settings = None
+        if not settings or not settings[0].get("app_owner_email"):
+            self.created_settings = requests.post(f"{BASE_URL}/api/app_settings", json={
+                "app_owner_email": "demo@kommunalcrm.de",
+            }).json()
+        requests.post(f"{BASE_URL}/api/notifications/digest/flush", params={"organization": "demo-org"})
+        self.tickets = [
+            requests.post(f"{BASE_URL}/api/support_tickets", json={
+                "organization_name": "demo-org",
+                "contact_email": email,
+                "subject": "TEST_Digest",
+                "description": "Digest test",
+                "priority": priority,
+                "status": "offen",
+            }).json()
+            for email, priority in [("test-digest@example.com", "niedrig"), ("test-digest-urgent@example.com", "dringend")]
+        ]
+        yield
+        for ticket in self.tickets:
+            requests.delete(f"{BASE_URL}/api/support_tickets/{ticket['id']}")
+        requests.post(f"{BASE_URL}/api/notifications/digest/flush", params={"organization": "demo-org"})
+        if self.created_settings:
+            requests.delete(f"{BASE_URL}/api/app_settings/{self.created_settings['id']}")
+
+    def pending(self):
+        response = requests.get(f"{BASE_URL}/api/notifications/digest", params={"organization": "demo-org"})
+        assert response.status_code == 200
+        return {entry["recipient"]: entry["count"] for entry in response.json()["recipients"]}
+
+    def test_status_changes_collected_and_flushed_once(self):
+        """Test two status changes wait for one digest and urgent tickets bypass it"""
+        if not self.created_settings:
+            pytest.skip("App owner is configured elsewhere; digest goes through another organization")
+        for ticket in self.tickets:
+            for status in ["in_bearbeitung", "geloest"]:
+                requests.put(f"{BASE_URL}/api/support_tickets/{ticket['id']}", json={"status": status})
+
+        pending = self.pending()
+        assert pending.get("test-digest@example.com") == 2
+        assert "test-digest-urgent@example.com" not in pending
+
+        response = requests.post(f"{BASE_URL}/api/notifications/digest/flush", params={"organization": "demo-org"})
+        assert response.status_code == 200
+        # The contact's digest plus the app owner's note about the non-urgent ticket
+        assert response.json()["messages"] == 2
+        assert self.pending() == {}
+        print("✓ Two notifications flushed as one digest")
@@ -0,0 +1,77 @@
+"""
+Test batch receipt scanning for KommunalCRM
+Tests:
+- POST /api/ai/scan-receipts/batch - Start a background scan job for many receipts
+- GET /api/ai/scan-jobs/{job_id} - Job progress and per-receipt results
+"""
+import time
+
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+def wait_for_job(job_id, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        response = requests.get(f"{BASE_URL}/api/ai/scan-jobs/{job_id}")
+        assert response.status_code == 200
+        job = response.json()
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(0.5)
+    pytest.fail(f"Job {job_id} did not finish within {timeout}s")
+
+
+class TestReceiptBatch:
+    """Tests for batch receipt scanning jobs"""
+
+    def test_missing_files_reported_per_item(self):
+        """Test unreadable receipts fail individually with an error message"""
+        response = requests.post(
+            f"{BASE_URL}/api/ai/scan-receipts/batch",
+            json={
+                "file_urls": ["/api/uploads/missing-receipt-1.png", "/api/uploads/missing-receipt-2.pdf"],
+                "organization": "demo-org",
+            },
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["total"] == 2
+
+        job = wait_for_job(data["job_id"])
+        assert job["status"] == "failed"
+        assert job["processed"] == 2 and job["failed"] == 2 and job["succeeded"] == 0
+        assert job["progress"] == 1.0
+        assert all(item["status"] == "failed" and item["error"] for item in job["items"])
+        print("✓ Partial failures reported per receipt")
+
+    def test_progress_without_items(self):
+        """Test the lightweight progress view omits per-receipt results"""
+        response = requests.post(
+            f"{BASE_URL}/api/ai/scan-receipts/batch",
+            json={"file_urls": ["/api/uploads/missing-receipt-3.png"], "organization": "demo-org"},
+        )
+        job_id = response.json()["job_id"]
+        wait_for_job(job_id)
+        response = requests.get(f"{BASE_URL}/api/ai/scan-jobs/{job_id}", params={"include_items": False})
+        assert response.status_code == 200
+        assert "items" not in response.json()
+        print("✓ Progress view without items")
+
+    def test_empty_batch_rejected(self):
+        """Test a batch without receipts is rejected"""
+        response = requests.post(
+            f"{BASE_URL}/api/ai/scan-receipts/batch",
+            json={"file_urls": [], "organization": "demo-org"},
+        )
+        assert response.status_code == 400
+        print("✓ Empty batch rejected")
+
+    def test_unknown_job(self):
+        """Test unknown job ids return 404"""
+        response = requests.get(f"{BASE_URL}/api/ai/scan-jobs/000000000000000000000000")
+        assert response.status_code == 404
+        print("✓ Unknown job returns 404")
@@ -0,0 +1,51 @@
+"""
+Test reminder retries against the notification digest for KommunalCRM (in-process, mongomock)
+Tests:
+- A reminder whose immediate sends all fail is retried without holding its digest recipients twice
+"""
+import asyncio
+import smtplib
+import sys
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+try:
+    import server
+except RuntimeError:
+    pytest.skip("MONGO_URL and DB_NAME must be set", allow_module_level=True)
+
+
+class TestReminderDigestRetry:
+    """Tests for held reminder recipients across failed sends"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, monkeypatch):
+        monkeypatch.setattr(server, "db", mongomock.MongoClient().db)
+        monkeypatch.setattr(server, "NOTIFICATION_DIGEST_SECONDS", 3600)
+        monkeypatch.setattr(server, "resolve_recipients", lambda audience: ["held@example.com", "direct@example.com"])
+        monkeypatch.setattr(server, "get_org_smtp_settings", lambda organization: {"host": "mail.test"})
+        server.db.users.insert_one({"email": "direct@example.com", "notification_digest": False})
+
+        async def failing_sends(settings, recipients, subject, body, attachment=None):
+            return [], {recipient: smtplib.SMTPServerDisconnected("dropped") for recipient in recipients}
+
+        monkeypatch.setattr(server, "send_smtp_emails_individually", failing_sends)
+
+    def test_failed_send_retried_without_duplicate_digest_entries(self):
+        """Test three failed attempts leave one held entry for the digest recipient"""
+        meeting = {
+            "title": "TEST_Reminder",
+            "date": (datetime.now(timezone.utc) + timedelta(days=2)).isoformat(),
+        }
+        for _ in range(3):
+            with pytest.raises(smtplib.SMTPServerDisconnected):
+                asyncio.run(server.send_meeting_reminder("demo-org", meeting, "meeting", reminder_key="meetings:1|key"))
+
+        entries = list(server.db.notification_digest.find({"recipient": "held@example.com"}))
+        assert len(entries) == 1 and entries[0]["status"] == "pending"
+        assert server.db.notification_digest.count_documents({"recipient": "direct@example.com"}) == 0
+        print("✓ Held reminder recipient queued once across retries")
@@ -0,0 +1,126 @@
+"""
+Test the meeting reminder scheduler for KommunalCRM
+Tests:
+- POST /api/meetings with reminder_offsets_minutes - Reminder queued and sent at its due time
+- DELETE /api/meetings/{id} - Queued reminders dropped
+- GET /api/reminders/status - Pending reminders, next due time and scheduler leadership
+- POST /api/reminders/send-now - Failed recipients handed to the email outbox for retries
+"""
+import time
+from datetime import datetime, timezone, timedelta
+
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+def meeting_start(seconds):
+    return (datetime.now(timezone.utc) + timedelta(seconds=seconds)).isoformat()
+
+
+class TestReminderScheduler:
+    """Tests for reminders planned on meeting writes"""
+
+    def create_meeting(self, start_in_seconds, offsets):
+        response = requests.post(f"{BASE_URL}/api/meetings", json={
+            "title": "TEST_Reminder",
+            "date": meeting_start(start_in_seconds),
+            "organization": "demo-org",
+            "reminder_offsets_minutes": offsets,
+        })
+        assert response.status_code == 200
+        return response.json()
+
+    def test_reminder_sent_when_due(self):
+        """Test a reminder one minute before start goes out without waiting for a scan"""
+        meeting = self.create_meeting(62, [1])
+        try:
+            deadline = time.time() + 15
+            while time.time() < deadline:
+                doc = requests.get(f"{BASE_URL}/api/meetings/{meeting['id']}").json()
+                if doc.get("reminders_sent"):
+                    break
+                time.sleep(0.5)
+            assert doc.get("reminders_sent") == [f"{meeting['date']}|1"]
+            print("✓ Reminder sent at its due time")
+        finally:
+            requests.delete(f"{BASE_URL}/api/meetings/{meeting['id']}")
+
+    def test_delete_drops_queued_reminders(self):
+        """Test deleting a meeting removes its reminders from the queue"""
+        before = requests.get(f"{BASE_URL}/api/reminders/status").json()["pending"]
+        meeting = self.create_meeting(7 * 86400, [1440, 60])
+        assert requests.get(f"{BASE_URL}/api/reminders/status").json()["pending"] == before + 2
+
+        requests.delete(f"{BASE_URL}/api/meetings/{meeting['id']}")
+        assert requests.get(f"{BASE_URL}/api/reminders/status").json()["pending"] == before
+        print("✓ Deleted meeting left the reminder queue")
+
+    def test_single_process_is_leader(self):
+        """Test the only process holds the scheduler lease"""
+        status = requests.get(f"{BASE_URL}/api/reminders/status").json()
+        assert status["leader"] is True and status["owner"]
+        print(f"✓ Scheduler led by {status['owner']}")
+
+    def test_invalid_offsets_rejected(self):
+        """Test reminder offsets must be a list of non-negative whole minutes"""
+        for offsets in [60, "60", ["15", "x"], [-5]]:
+            response = requests.post(f"{BASE_URL}/api/meetings", json={
+                "title": "TEST_Reminder",
+                "date": meeting_start(86400),
+                "organization": "demo-org",
+                "reminder_offsets_minutes": offsets,
+            })
+            assert response.status_code == 400, offsets
+        print("✓ Invalid reminder offsets rejected")
+
+
+class TestReminderRecipients:
+    """Tests for per-recipient reminder delivery"""
+
+    def test_failed_recipient_retried(self):
+        """Test a recipient whose send fails is retried through the outbox while the others are not"""
+        contacts = [
+            requests.post(f"{BASE_URL}/api/contacts", json={
+                "first_name": "TEST",
+                "last_name": "Reminder",
+                "email": email,
+                "organization": "demo-org",
+            }).json()
+            for email in ["test-reminder-ok@example.com", f"test-reminder-flaky-{int(time.time())}@example.com"]
+        ]
+        group = requests.post(f"{BASE_URL}/api/member_groups", json={
+            "name": "TEST_Reminder",
+            "organization": "demo-org",
+            "member_ids": [contact["id"] for contact in contacts],
+        }).json()
+        meeting = requests.post(f"{BASE_URL}/api/meetings", json={
+            "title": "TEST_Reminder",
+            "date": meeting_start(86400),
+            "organization": "demo-org",
+            "reminder_audience": {"users": False, "groups": [group["id"]]},
+        }).json()
+        try:
+            response = requests.post(f"{BASE_URL}/api/reminders/send-now", json={
+                "meeting_id": meeting["id"],
+                "meeting_type": "meeting",
+            })
+            assert response.status_code == 200
+            data = response.json()
+            assert data["recipients"] == 1
+            assert data["retrying"] == [contacts[1]["email"]]
+
+            deadline = time.time() + 30
+            while time.time() < deadline:
+                job = requests.get(f"{BASE_URL}/api/email/jobs/{data['retry_job_id']}").json()
+                if job["status"] not in ("queued", "running"):
+                    break
+                time.sleep(0.5)
+            assert job["status"] == "completed" and job["sent"] == 1
+            print("✓ Failed reminder recipient delivered on retry")
+        finally:
+            requests.delete(f"{BASE_URL}/api/meetings/{meeting['id']}")
+            requests.delete(f"{BASE_URL}/api/member_groups/{group['id']}")
+            for contact in contacts:
+                requests.delete(f"{BASE_URL}/api/contacts/{contact['id']}")
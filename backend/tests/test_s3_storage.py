@@ -0,0 +1,85 @@
+"""
+Test S3 upload storage for KommunalCRM against a moto stand-in
+Tests:
+- S3Storage stores, finds, reads and mirrors objects in the bucket
+- POST /api/files/upload - Stored in the bucket from a worker thread, not on the event loop
+- GET /api/files/presign-download - Presigned bucket URL for an uploaded file
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+try:
+    import server
+except RuntimeError:
+    pytest.skip("MONGO_URL and DB_NAME must be set", allow_module_level=True)
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def s3_storage(monkeypatch, tmp_path):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setattr(server, "CACHE_DIR", str(tmp_path))
+    with moto.mock_aws():
+        storage = server.S3Storage(bucket="kommunalcrm-test", region="eu-central-1")
+        storage.client.create_bucket(
+            Bucket="kommunalcrm-test", CreateBucketConfiguration={"LocationConstraint": "eu-central-1"}
+        )
+        monkeypatch.setattr(server, "storage", storage)
+        yield storage
+
+
+class TestS3Storage:
+    """Tests for the S3 storage backend"""
+
+    def test_object_roundtrip(self, s3_storage, monkeypatch, tmp_path):
+        """Test a saved object is found, read back and mirrored to a local path"""
+        s3_storage.save("abc_test.txt", b"s3 roundtrip", "text/plain")
+        head = s3_storage.client.head_object(Bucket="kommunalcrm-test", Key="uploads/abc_test.txt")
+        assert head["ContentType"] == "text/plain"
+
+        # A second instance with an empty mirror has to go to the bucket
+        monkeypatch.setattr(server, "CACHE_DIR", str(tmp_path / "other"))
+        fresh = server.S3Storage(bucket="kommunalcrm-test", region="eu-central-1")
+        assert fresh.exists("abc_test.txt")
+        assert not fresh.exists("missing.txt")
+        assert fresh.read("abc_test.txt") == b"s3 roundtrip"
+        with open(fresh.local_path("abc_test.txt"), "rb") as file:
+            assert file.read() == b"s3 roundtrip"
+        assert fresh.local_path("missing.txt") is None
+        print("✓ Object stored, read and mirrored")
+
+    def test_upload_endpoint_off_event_loop(self, s3_storage, monkeypatch):
+        """Test the upload handler stores the file from a worker thread and presigns its download"""
+        save = s3_storage.save
+        threads = []
+
+        def recording_save(*args, **kwargs):
+            try:
+                asyncio.get_running_loop()
+                threads.append("event loop")
+            except RuntimeError:
+                threads.append("worker")
+            return save(*args, **kwargs)
+
+        monkeypatch.setattr(s3_storage, "save", recording_save)
+        client = TestClient(server.app)
+        response = client.post("/api/files/upload", files={"file": ("bericht.txt", b"upload body", "text/plain")})
+        assert response.status_code == 200
+        assert threads == ["worker"]
+
+        key = response.json()["file_url"].split("/api/uploads/")[1]
+        body = s3_storage.client.get_object(Bucket="kommunalcrm-test", Key=f"uploads/{key}")["Body"].read()
+        assert body == b"upload body"
+
+        response = client.get("/api/files/presign-download", params={"file_url": f"/api/uploads/{key}"})
+        assert response.status_code == 200
+        assert "kommunalcrm-test" in response.json()["url"] and "Signature" in response.json()["url"]
+        assert client.get("/api/files/presign-download", params={"file_url": "/api/uploads/missing.txt"}).status_code == 404
+        print("✓ Upload stored in S3 off the event loop")
@@ -0,0 +1,128 @@
+"""
+Test batched SendGrid delivery for KommunalCRM against a local HTTP stand-in
+Tests:
+- send_email_via_sendgrid packs recipients into personalizations, one request per batch
+- One SendGrid client is reused for every batch
+- A rejected address is isolated instead of failing its whole batch
+- A 400 about the payload itself fails the batch with a single request
+"""
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("sendgrid")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+try:
+    import server
+except RuntimeError:
+    pytest.skip("MONGO_URL and DB_NAME must be set", allow_module_level=True)
+
+
+class SendGridStandIn(BaseHTTPRequestHandler):
+    requests = []
+    fail_recipient = None
+    fail_payload = False
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        recipients = [p["to"][0]["email"] for p in payload["personalizations"]]
+        errors = []
+        if SendGridStandIn.fail_payload:
+            errors.append({"message": "The from address does not match a verified Sender Identity", "field": "from"})
+        elif SendGridStandIn.fail_recipient in recipients:
+            index = recipients.index(SendGridStandIn.fail_recipient)
+            errors.append({"message": "Invalid email address", "field": f"personalizations.{index}.to.0.email"})
+        status = 400 if errors else 202
+        SendGridStandIn.requests.append({
+            "path": self.path,
+            "authorization": self.headers.get("Authorization"),
+            "recipients": recipients,
+            "status": status,
+        })
+        response = json.dumps({"errors": errors}).encode() if errors else b""
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stand_in(monkeypatch):
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), SendGridStandIn)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    SendGridStandIn.requests = []
+    SendGridStandIn.fail_recipient = None
+    SendGridStandIn.fail_payload = False
+    monkeypatch.setenv("SENDGRID_API_KEY", "SG.test-key")
+    monkeypatch.setattr(server, "SENDGRID_API_HOST", f"http://127.0.0.1:{httpd.server_port}")
+    monkeypatch.setattr(server, "SENDGRID_BATCH_SIZE", 2)
+    monkeypatch.setattr(server, "sendgrid_clients", {})
+    yield SendGridStandIn
+    httpd.shutdown()
+
+
+class TestSendGridBatching:
+    """Tests for personalization batches sent to a local SendGrid stand-in"""
+
+    def test_recipients_packed_into_batches(self, stand_in):
+        """Test five recipients become three requests with one personalization each"""
+        recipients = [f"member{i}@example.com" for i in range(5)]
+        server.send_email_via_sendgrid(recipients, "TEST_Batch", "Hallo", from_name="Fraktion")
+
+        assert len(stand_in.requests) == 3
+        assert all(r["path"] == "/v3/mail/send" for r in stand_in.requests)
+        assert all(r["authorization"] == "Bearer SG.test-key" for r in stand_in.requests)
+        assert sorted(len(r["recipients"]) for r in stand_in.requests) == [1, 2, 2]
+        assert sorted(e for r in stand_in.requests for e in r["recipients"]) == recipients
+        assert len(server.sendgrid_clients) == 1
+        print("✓ 5 recipients sent in 3 SendGrid requests")
+
+    def test_rejected_address_isolated(self, stand_in, monkeypatch):
+        """Test a 400 splits its batch so only the rejected address fails and nothing is sent twice"""
+        monkeypatch.setattr(server, "SENDGRID_BATCH_SIZE", 4)
+        stand_in.fail_recipient = "member2@example.com"
+        recipients = [f"member{i}@example.com" for i in range(5)]
+        failed = server.send_email_via_sendgrid(recipients, "TEST_Batch", "Hallo")
+
+        assert list(failed) == ["member2@example.com"]
+        delivered = [e for r in stand_in.requests if r["status"] == 202 for e in r["recipients"]]
+        assert sorted(delivered) == [r for r in recipients if r != "member2@example.com"]
+        print(f"✓ Rejected address isolated in {len(stand_in.requests)} SendGrid requests")
+
+    def test_all_rejected_raises(self, stand_in):
+        """Test the call still raises when no recipient could be reached"""
+        stand_in.fail_recipient = "member0@example.com"
+        with pytest.raises(Exception):
+            server.send_email_via_sendgrid(["member0@example.com"], "TEST_Batch", "Hallo")
+        print("✓ Fully rejected send raises")
+
+    def test_payload_error_not_bisected(self, stand_in, monkeypatch):
+        """Test a 400 about the sender fails the whole batch after one request"""
+        monkeypatch.setattr(server, "SENDGRID_BATCH_SIZE", 8)
+        stand_in.fail_payload = True
+        recipients = [f"member{i}@example.com" for i in range(8)]
+        failed = server.send_sendgrid_batches(recipients, "TEST_Batch", "Hallo")
+
+        assert sorted(failed) == recipients
+        assert len(stand_in.requests) == 1
+        print("✓ Payload error failed the batch with one request")
+
+    def test_bisection_depth_capped(self, stand_in, monkeypatch):
+        """Test bisection stops at SENDGRID_BISECT_MAX_DEPTH and fails the remaining group"""
+        monkeypatch.setattr(server, "SENDGRID_BATCH_SIZE", 8)
+        monkeypatch.setattr(server, "SENDGRID_BISECT_MAX_DEPTH", 1)
+        stand_in.fail_recipient = "member1@example.com"
+        recipients = [f"member{i}@example.com" for i in range(8)]
+        failed = server.send_sendgrid_batches(recipients, "TEST_Batch", "Hallo")
+
+        assert sorted(failed) == recipients[:4]
+        assert len(stand_in.requests) == 3
+        print("✓ Bisection stopped at the configured depth")
@@ -0,0 +1,99 @@
+"""
+Test the pooled SMTP sessions for KommunalCRM against in-process stand-ins
+Tests:
+- Idle sessions are kept alive with NOOP and reused
+- A session the server dropped while idle is closed by the keepalive and replaced on the next send
+- Sessions unused past the idle timeout are closed
+"""
+import smtplib
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+try:
+    import server
+except RuntimeError:
+    pytest.skip("MONGO_URL and DB_NAME must be set", allow_module_level=True)
+
+SETTINGS = {"host": "mail.test", "port": 587, "username": "user", "password": "secret"}
+
+
+class FakeSession:
+    def __init__(self):
+        self.dropped = False
+        self.noops = 0
+        self.sent = []
+        self.closed = False
+
+    def noop(self):
+        self.noops += 1
+        if self.dropped:
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        return 250, b"OK"
+
+    def sendmail(self, from_addr, to_list, message):
+        if self.dropped:
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        self.sent.append(to_list)
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    sessions = []
+
+    def connect(settings):
+        sessions.append(FakeSession())
+        return sessions[-1]
+
+    monkeypatch.setattr(server.SmtpConnectionPool, "connect", staticmethod(connect))
+    pool = server.SmtpConnectionPool(max_per_key=2, idle_timeout=60, noop_after=0)
+    pool.sessions = sessions
+    yield pool
+    pool.close_all()
+
+
+class TestSmtpConnectionPool:
+    """Tests for SMTP session keepalive and reuse"""
+
+    def test_keepalive_keeps_session_for_reuse(self, pool):
+        """Test a healthy idle session answers the NOOP and serves the next message"""
+        pool.sendmail(SETTINGS, "from@example.com", ["a@example.com"], "Hallo")
+        pool.keepalive()
+        pool.sendmail(SETTINGS, "from@example.com", ["b@example.com"], "Hallo")
+
+        assert len(pool.sessions) == 1
+        assert pool.sessions[0].sent == [["a@example.com"], ["b@example.com"]]
+        stats = pool.stats()
+        assert stats["keepalives"] == 1 and stats["reuses"] == 1 and stats["idle"] == 1
+        print("✓ Idle session kept alive and reused")
+
+    def test_dropped_session_replaced(self, pool):
+        """Test a session the server closed is dropped by the keepalive, not by the next send"""
+        pool.sendmail(SETTINGS, "from@example.com", ["a@example.com"], "Hallo")
+        pool.sessions[0].dropped = True
+        pool.keepalive()
+        assert pool.sessions[0].closed
+        assert pool.stats()["open"] == 0 and pool.stats()["dropped"] == 1
+
+        pool.sendmail(SETTINGS, "from@example.com", ["b@example.com"], "Hallo")
+        assert len(pool.sessions) == 2 and pool.sessions[1].sent == [["b@example.com"]]
+        assert pool.stats()["reconnects"] == 0
+        print("✓ Dropped session replaced without a failed send")
+
+    def test_expired_session_closed(self, pool):
+        """Test a session unused past the idle timeout is closed instead of probed"""
+        pool.sendmail(SETTINGS, "from@example.com", ["a@example.com"], "Hallo")
+        pool.idle_timeout = 0
+        pool.keepalive()
+
+        assert pool.sessions[0].closed and pool.sessions[0].noops == 0
+        assert pool.stats()["open"] == 0 and pool.stats()["idle"] == 0
+        print("✓ Expired idle session closed")
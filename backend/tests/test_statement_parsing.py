@@ -0,0 +1,62 @@
+"""
+Test bank statement table parsing for KommunalCRM
+Tests:
+- parse_german_amount reads thousands separators, decimal commas and debit/credit markers
+- Dates without a year are placed on or before the statement date
+- parse_statement_tables reads a December statement imported in January
+"""
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+try:
+    import server
+except RuntimeError:
+    pytest.skip("MONGO_URL and DB_NAME must be set", allow_module_level=True)
+
+
+class TestStatementParsing:
+    """Tests for deterministic statement parsing helpers"""
+
+    def test_german_amounts(self):
+        """Test thousands separators are not read as decimal points"""
+        assert server.parse_german_amount("1.234") == 1234.0
+        assert server.parse_german_amount("1.234.567") == 1234567.0
+        assert server.parse_german_amount("1.234,56 €") == 1234.56
+        assert server.parse_german_amount("12.50") == 12.5
+        assert server.parse_german_amount("0.123") == 0.123
+        assert server.parse_german_amount("250,00 S") == -250.0
+        assert server.parse_german_amount("-1.000") == -1000.0
+        assert server.parse_german_amount("50,") == 50.0
+        print("✓ German amounts parsed")
+
+    def test_dates_without_year(self):
+        """Test a day and month take the latest year not after the reference date"""
+        reference = datetime(2025, 1, 3)
+        assert server.parse_german_date("15.12.", reference) == "2024-12-15"
+        assert server.parse_german_date("02.01.", reference) == "2025-01-02"
+        assert server.parse_german_date("15.12.2023", reference) == "2023-12-15"
+        assert server.parse_german_date("15.12.") is None
+        print("✓ Year inferred from the statement date")
+
+    def test_december_statement_imported_in_january(self):
+        """Test the statement period, not the import date, decides the booking year"""
+        text = "Kontoauszug Nr. 12/2024\nZeitraum 01.12.2024 - 31.12.2024\nKontostand am 31.12.2024: 3.120,00"
+        reference = server.statement_reference_date(text)
+        assert reference == datetime(2024, 12, 31)
+
+        tables = [[
+            ["Buchungstag", "Verwendungszweck", "Betrag"],
+            ["30.12.", "Mitgliedsbeitrag Dezember", "1.200"],
+            ["", "Max Mustermann", ""],
+            ["31.12.", "Kontoführung", "-4,90"],
+        ]]
+        transactions = server.parse_statement_tables(tables, reference=reference)
+        assert [t["date"] for t in transactions] == ["2024-12-30", "2024-12-31"]
+        assert transactions[0]["amount"] == 1200.0 and transactions[0]["transaction_type"] == "einnahme"
+        assert transactions[0]["description"] == "Mitgliedsbeitrag Dezember Max Mustermann"
+        assert transactions[1]["amount"] == 4.9 and transactions[1]["transaction_type"] == "ausgabe"
+        print("✓ December bookings kept in the statement year")
@@ -0,0 +1,80 @@
+"""
+Test upload storage endpoints for KommunalCRM
+Tests:
+- POST /api/files/presign-upload - Direct upload target (S3/MinIO) or API fallback (local disk)
+- GET /api/files/presign-download - Download URL for an uploaded file
+- GET /api/uploads/{file} - Uploaded file is served back
+
+Point the backend at a MinIO container to exercise the S3 path:
+STORAGE_BACKEND=s3 S3_BUCKET=uploads S3_ENDPOINT_URL=http://localhost:9000
+"""
+import io
+
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+def absolute(url):
+    return url if url.startswith("http") else f"{BASE_URL}{url}"
+
+
+class TestStorage:
+    """Tests for upload storage and presigned transfers"""
+
+    def test_upload_roundtrip(self):
+        """Test an uploaded file can be downloaded again"""
+        content = b"storage roundtrip"
+        response = requests.post(
+            f"{BASE_URL}/api/files/upload",
+            files={"file": ("storage-test.txt", io.BytesIO(content), "text/plain")},
+        )
+        assert response.status_code == 200
+        file_url = response.json()["file_url"]
+
+        download = requests.get(absolute(file_url))
+        assert download.status_code == 200
+        assert download.content == content
+        print("✓ Upload roundtrip works")
+
+    def test_presign_upload(self):
+        """Test presigned upload target or fallback to the API upload"""
+        response = requests.post(
+            f"{BASE_URL}/api/files/presign-upload",
+            json={"file_name": "direct-test.txt", "content_type": "text/plain"},
+        )
+        assert response.status_code == 200
+        data = response.json()
+        if not data["direct"]:
+            assert data["upload_url"] == "/api/files/upload"
+            pytest.skip("Local storage backend - direct uploads not available")
+
+        content = b"direct upload"
+        put = requests.put(data["upload_url"], data=content, headers=data["headers"])
+        assert put.status_code in (200, 204)
+
+        download = requests.get(f"{BASE_URL}/api/files/presign-download", params={"file_url": data["file_url"]})
+        assert download.status_code == 200
+        fetched = requests.get(absolute(download.json()["url"]))
+        assert fetched.content == content
+        print("✓ Direct upload and download work")
+
+    def test_presign_download_missing_file(self):
+        """Test presigned download for a missing file"""
+        response = requests.get(
+            f"{BASE_URL}/api/files/presign-download",
+            params={"file_url": "/api/uploads/does-not-exist.txt"},
+        )
+        assert response.status_code == 404
+        print("✓ Missing file returns 404")
+
+    def test_path_traversal_rejected(self):
+        """Test file_url cannot escape the upload storage"""
+        response = requests.get(
+            f"{BASE_URL}/api/files/presign-download",
+            params={"file_url": "/api/uploads/../server.py"},
+        )
+        assert response.status_code == 400
+        print("✓ Path traversal rejected")
@@ -62,7 +62,88 @@ const request = async (endpoint, options = {}) => {
   return response.json();
 };
 
+// Server-Sent Events request: calls onDelta for each text chunk and resolves with the final payload
+const streamRequest = async (endpoint, body, onDelta) => {
+  const response = await fetch(`${API_URL}${endpoint}`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      Accept: 'text/event-stream',
+      ...(authToken && { 'Authorization': `Bearer ${authToken}` }),
+    },
+    body: JSON.stringify(body),
+  });
+
+  if (!response.ok) {
+    const error = await response.json().catch(() => ({ detail: 'Request failed' }));
+    throw new Error(error.detail || 'Request failed');
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const message = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      let event = 'message';
+      let data = '';
+      for (const line of message.split('\n')) {
+        if (line.startsWith('event: ')) event = line.slice(7);
+        else if (line.startsWith('data: ')) data += line.slice(6);
+      }
+      if (!data) continue;
+      const payload = JSON.parse(data);
+      if (event === 'error') throw new Error(payload.detail || 'Request failed');
+      if (event === 'done') return payload;
+      if (onDelta) onDelta(payload.delta);
+    }
+  }
+  throw new Error('Stream ended unexpectedly');
+};
+
+// Files above this size are sent straight to object storage when the backend supports it
+const DIRECT_UPLOAD_THRESHOLD = 5 * 1024 * 1024;
+
+const uploadFileDirect = async (file) => {
+  const target = await request('/api/files/presign-upload', {
+    method: 'POST',
+    body: JSON.stringify({ file_name: file.name, content_type: file.type || null }),
+  });
+  if (!target.direct) {
+    return null;
+  }
+
+  const response = await fetch(target.upload_url, {
+    method: target.method,
+    headers: target.headers,
+    body: file,
+  });
+
+  if (!response.ok) {
+    throw new Error('Upload failed');
+  }
+
+  return {
+    file_url: target.file_url,
+    file_name: file.name,
+    content_type: file.type,
+    size: file.size,
+  };
+};
+
 const uploadFile = async (file) => {
+  if (file.size > DIRECT_UPLOAD_THRESHOLD) {
+    const direct = await uploadFileDirect(file);
+    if (direct) {
+      return direct;
+    }
+  }
+
   const url = `${API_URL}/api/files/upload`;
   const formData = new FormData();
   formData.append('file', file);
@@ -268,6 +349,10 @@ const ai = {
     });
   },
 
+  async streamProtocol(prompt, onDelta, context = null) {
+    return streamRequest('/api/ai/generate-protocol/stream', { prompt, context }, onDelta);
+  },
+
   async generateInvitation(prompt, context = null) {
     return request('/api/ai/generate-invitation', {
       method: 'POST',
@@ -275,13 +360,17 @@ const ai = {
     });
   },
 
-  async generateText(prompt, taskType = 'general', systemMessage = null) {
+  async generateText(prompt, taskType = 'general', systemMessage = null, useCache = true) {
     return request('/api/ai/generate-text', {
       method: 'POST',
-      body: JSON.stringify({ prompt, task_type: taskType, system_message: systemMessage }),
+      body: JSON.stringify({ prompt, task_type: taskType, system_message: systemMessage, use_cache: useCache }),
     });
   },
 
+  async streamText(prompt, onDelta, taskType = 'general', systemMessage = null) {
+    return streamRequest('/api/ai/generate-text/stream', { prompt, task_type: taskType, system_message: systemMessage }, onDelta);
+  },
+
   async generateNotice(prompt, levyData = null, organizationData = null) {
     return request('/api/ai/generate-notice', {
       method: 'POST',
@@ -289,17 +378,53 @@ const ai = {
     });
   },
 
-  async scanReceipt(fileUrl, organization) {
+  async streamNotice(prompt, onDelta, levyData = null, organizationData = null) {
+    return streamRequest('/api/ai/generate-notice/stream', { prompt, levy_data: levyData, organization_data: organizationData }, onDelta);
+  },
+
+  async generateMeetingProtocol(meetingId) {
+    return request('/api/ai/fraction-meetings/generate-protocol', {
+      method: 'POST',
+      body: JSON.stringify({ meeting_id: meetingId }),
+    });
+  },
+
+  async generateMeetingInvitation(meetingId) {
+    return request('/api/ai/fraction-meetings/generate-invitation', {
+      method: 'POST',
+      body: JSON.stringify({ meeting_id: meetingId }),
+    });
+  },
+
+  async generateLevyNotice(levyId, tone = null) {
+    return request('/api/ai/mandate-levies/generate-notice', {
+      method: 'POST',
+      body: JSON.stringify({ levy_id: levyId, tone }),
+    });
+  },
+
+  async scanReceipt(fileUrl, organization, refresh = false) {
     return request('/api/ai/scan-receipt', {
       method: 'POST',
-      body: JSON.stringify({ file_url: fileUrl, organization }),
+      body: JSON.stringify({ file_url: fileUrl, organization, refresh }),
     });
   },
 
-  async scanBankStatement(fileUrl, organization) {
+  async scanReceiptsBatch(fileUrls, organization, refresh = false) {
+    return request('/api/ai/scan-receipts/batch', {
+      method: 'POST',
+      body: JSON.stringify({ file_urls: fileUrls, organization, refresh }),
+    });
+  },
+
+  async getScanJob(jobId, includeItems = true) {
+    return request(`/api/ai/scan-jobs/${encodeURIComponent(jobId)}?include_items=${includeItems}`);
+  },
+
+  async scanBankStatement(fileUrl, organization, refresh = false) {
     return request('/api/ai/scan-bank-statement', {
       method: 'POST',
-      body: JSON.stringify({ file_url: fileUrl, organization }),
+      body: JSON.stringify({ file_url: fileUrl, organization, refresh }),
     });
   },
 };
@@ -313,11 +438,60 @@ const email = {
         to,
         subject,
         body,
+        attachment_url: attachment?.fileUrl || null,
+        document_id: attachment?.documentId || null,
         attachment_base64: attachment?.base64 || null,
         attachment_filename: attachment?.filename || null,
       }),
     });
   },
+
+  async sendCampaign({ subject, body, contactIds = null, groupId = null, attachment = null }) {
+    return request('/api/email/campaigns', {
+      method: 'POST',
+      body: JSON.stringify({
+        subject,
+        body,
+        contact_ids: contactIds,
+        group_id: groupId,
+        attachment_url: attachment?.fileUrl || null,
+        document_id: attachment?.documentId || null,
+        attachment_base64: attachment?.base64 || null,
+        attachment_filename: attachment?.filename || null,
+      }),
+    });
+  },
+
+  async getJob(jobId, includeItems = false) {
+    return request(`/api/email/jobs/${encodeURIComponent(jobId)}?include_items=${includeItems}`);
+  },
+
+  async resolveRecipients(audience) {
+    return request('/api/recipients/resolve', {
+      method: 'POST',
+      body: JSON.stringify(audience),
+    });
+  },
+};
+
+const accounting = {
+  async getDefaultLevyNoticeTemplate() {
+    return request('/api/mandate-levies/notice-template/default');
+  },
+
+  async renderLevyNotices(organization, { levyIds = null, periodMonth = null, templateId = null } = {}) {
+    return request('/api/mandate-levies/notices', {
+      method: 'POST',
+      body: JSON.stringify({ organization, levy_ids: levyIds, period_month: periodMonth, template_id: templateId }),
+    });
+  },
+
+  async importBankStatement(fileUrl, organization) {
+    return request('/api/accounting/import-bank-statement', {
+      method: 'POST',
+      body: JSON.stringify({ file_url: fileUrl, organization }),
+    });
+  },
 };
 
 const search = {
@@ -366,8 +540,28 @@ const datev = {
   },
 };
 
+const derivativeUrl = (fileUrl, { width, height, format = 'webp', quality } = {}) => {
+  if (!fileUrl || !fileUrl.includes('/api/uploads/')) {
+    return fileUrl;
+  }
+  const path = fileUrl.slice(fileUrl.indexOf('/api/uploads/'));
+  const params = new URLSearchParams({ file_url: path, format });
+  if (width) params.set('width', width.toString());
+  if (height) params.set('height', height.toString());
+  if (quality) params.set('quality', quality.toString());
+  return `${API_URL}/api/files/derivative?${params.toString()}`;
+};
+
+const getDownloadUrl = async (fileUrl) => {
+  const params = new URLSearchParams({ file_url: fileUrl });
+  const result = await request(`/api/files/presign-download?${params.toString()}`);
+  return result.url.startsWith('/api/') ? `${API_URL}${result.url}` : result.url;
+};
+
 const files = {
   upload: uploadFile,
+  derivativeUrl,
+  getDownloadUrl,
 };
 
 // Main export - compatible with base44 SDK interface
@@ -375,6 +569,7 @@ export const base44 = {
   auth,
   entities,
   ai,
+  accounting,
   email,
   search,
   reminders,
@@ -10,6 +10,9 @@ import {
 } from "lucide-react";
 import { useMutation, useQueryClient } from "@tanstack/react-query";
 
+// CAMT.053 XML and MT940 exports are parsed on the server without the AI scan
+const STRUCTURED_STATEMENT_PATTERN = /\.(xml|sta|mt940|940)$/i;
+
 const INCOME_CATEGORIES = [
   { value: "mitgliedsbeitrag", label: "Mitgliedsbeitrag" },
   { value: "spende", label: "Spende" },
@@ -91,7 +94,10 @@ export default function BankStatementImport({ open, onClose, organization, conta
 
     try {
       const { file_url } = await base44.files.upload(file);
-      const response = await base44.ai.scanBankStatement(file_url, organization);
+      const isStructured = STRUCTURED_STATEMENT_PATTERN.test(file.name);
+      const response = isStructured
+        ? await base44.accounting.importBankStatement(file_url, organization)
+        : await base44.ai.scanBankStatement(file_url, organization);
       const txs = (response.transactions || []).map((t) => {
         const matchedExpense = findMatchingExpense(t, existingExpenses);
         return { ...t, matched_expense: matchedExpense || null };
@@ -195,7 +201,7 @@ export default function BankStatementImport({ open, onClose, organization, conta
         {step === "upload" && (
           <div className="space-y-4">
             <p className="text-sm text-slate-500">
-              Laden Sie einen Kontoauszug als PDF oder Bild hoch. Die KI erkennt alle Buchungen automatisch und ordnet sie Mitgliedsbeiträgen, Spenden, Mandatsabgaben usw. zu.
+              Laden Sie einen Kontoauszug als PDF, Bild oder CAMT.053/MT940-Datei hoch. Die KI erkennt alle Buchungen automatisch und ordnet sie Mitgliedsbeiträgen, Spenden, Mandatsabgaben usw. zu.
             </p>
             {contacts.length > 0 && (
               <p className="text-xs text-slate-400" data-testid="bank-statement-contact-hint">
@@ -211,7 +217,7 @@ export default function BankStatementImport({ open, onClose, organization, conta
               <p className="text-sm font-medium text-slate-600">Kontoauszug auswählen</p>
               <p className="text-xs text-slate-400 mt-1">PDF, JPG oder PNG</p>
             </div>
-            <input ref={fileInputRef} type="file" accept="image/*,.pdf" className="hidden" onChange={handleFileChange} data-testid="bank-statement-upload-input" />
+            <input ref={fileInputRef} type="file" accept="image/*,.pdf,.xml,.sta,.mt940,.940" className="hidden" onChange={handleFileChange} data-testid="bank-statement-upload-input" />
           </div>
         )}
 
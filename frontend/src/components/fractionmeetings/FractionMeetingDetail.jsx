@@ -66,19 +66,7 @@ export default function FractionMeetingDetail({ meeting, onBack, onUpdate, onDel
   const generateProtocol = async () => {
     setGenerating(true);
     try {
-      const agendaText = agendaItems.map((item, i) => `TOP ${i + 1}: ${item.title}`).join('\n');
-      const response = await base44.ai.generateText(
-        `Erstelle ein professionelles Sitzungsprotokoll für eine Fraktionssitzung:
-
-Titel: ${meeting.title}
-Datum: ${meeting.date ? format(new Date(meeting.date), "dd.MM.yyyy", { locale: de }) : ""}
-Ort: ${meeting.location || ""}
-Tagesordnung:
-${agendaText}
-
-Erstelle ein strukturiertes Protokoll mit allen TOPs. Verwende Platzhalter [Name] für noch ausstehende Details. Jeder TOP hat Überschrift, Diskussion und ggf. Abstimmungsergebnis. Füge am Ende Unterschriftenzeilen für Sitzungsleitung und Protokollführer ein.`,
-        "meeting"
-      );
+      const response = await base44.ai.generateMeetingProtocol(meeting.id);
       if (response?.content) {
         setProtocol(response.content);
       }
@@ -91,7 +91,7 @@ export default function FractionMeetingTemplateForm({ template, onClose, organiz
               data-testid="meeting-template-logo-url"
             />
             {formData.logo_url && (
-              <img src={formData.logo_url} alt="Preview" className="mt-2 h-16 object-contain" />
+              <img src={base44.files.derivativeUrl(formData.logo_url, { height: 128 })} alt="Preview" className="mt-2 h-16 object-contain" />
             )}
           </div>
 
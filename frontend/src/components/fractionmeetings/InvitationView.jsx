@@ -108,7 +108,8 @@ WICHTIG:
 - Formuliere Abstimmungsergebnisse klar (einstimmig/mehrheitlich)
 - Halte den Ton formal und präzise`;
 
-      const response = await base44.ai.generateText(prompt, "meeting");
+      // "Neu generieren" must produce a fresh draft, not the cached one
+      const response = await base44.ai.generateText(prompt, "meeting", null, false);
 
       if (response?.content) {
         setProtocol(response.content);
@@ -12,6 +12,14 @@ import { de } from "date-fns/locale";
 import { useQuery } from "@tanstack/react-query";
 import { base44 } from "@/api/apiClient";
 
+const LOGO_HEIGHT_PX = 64;
+
+const getLogoSrc = (template) =>
+  template?.logo_base64 ||
+  base44.files.derivativeUrl(template?.logo_url, { height: LOGO_HEIGHT_PX * 3, format: "png" }) ||
+  template?.logo ||
+  "";
+
 export default function InvoicePrintView({ open, onOpenChange, invoice }) {
   const [isExporting, setIsExporting] = useState(false);
 
@@ -20,8 +28,18 @@ export default function InvoicePrintView({ open, onOpenChange, invoice }) {
     queryFn: () => base44.auth.me(),
   });
 
+  const organization = invoice?.organization || user?.organization;
+  const { data: templates = [] } = useQuery({
+    queryKey: ["printTemplates", organization],
+    queryFn: () => base44.entities.PrintTemplate.filter({ organization }),
+    enabled: !!organization,
+    select: (all) => all.filter((t) => t.document_type !== "levy_notice"),
+  });
+
   if (!invoice) return null;
 
+  const logoSrc = getLogoSrc(templates.find((t) => t.is_default) || templates[0]);
+
   const handlePrint = () => {
     window.print();
   };
@@ -58,6 +76,7 @@ export default function InvoicePrintView({ open, onOpenChange, invoice }) {
         <body>
           <div class="header">
             <div>
+              ${logoSrc ? `<img src="${logoSrc}" alt="Logo" style="height: ${LOGO_HEIGHT_PX}px; margin-bottom: 10px;" />` : ""}
               <h1 style="margin: 0; font-size: 24px;">${user?.fraction_name || "Fraktion"}</h1>
               ${user?.fraction_address ? `<p style="margin: 5px 0 0 0;">${user.fraction_address}</p>` : ""}
             </div>
@@ -180,6 +199,15 @@ export default function InvoicePrintView({ open, onOpenChange, invoice }) {
           <div id="invoice-content" className="bg-white p-12 print:p-0">
             <div className="flex justify-between items-start mb-8">
               <div>
+                {logoSrc && (
+                  <img
+                    src={logoSrc}
+                    alt="Logo"
+                    className="mb-2 object-contain"
+                    style={{ height: LOGO_HEIGHT_PX }}
+                    data-testid="invoice-print-logo"
+                  />
+                )}
                 <h1 className="text-2xl font-bold mb-1">{user?.fraction_name || "Fraktion"}</h1>
                 {user?.fraction_address && (
                   <p className="text-sm text-slate-600 whitespace-pre-line">{user.fraction_address}</p>
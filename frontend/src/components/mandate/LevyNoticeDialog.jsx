@@ -25,41 +25,8 @@ export default function LevyNoticeDialog({ levy, onClose, onSent }) {
   const generateNotice = async (orgData) => {
     setGenerating(true);
     try {
-      const senderName = orgData?.display_name || orgData?.name || levy.organization || "[Organisation]";
-      const senderAddress = [orgData?.address, orgData?.city].filter(Boolean).join(", ") || "[Adresse]";
-
-      const prompt = `Erstelle einen formellen Gebührenbescheid (auf Deutsch) für einen Mandatsträger.
-
-Absender (oben links im Briefkopf):
-${senderName}
-${senderAddress}
-
-Empfänger:
-- Name: ${levy.contact_name}
-- Mandat: ${levy.mandate_type} bei ${levy.mandate_body || "–"}
-
-Abrechnungsdaten:
-- Abrechnungsmonat: ${levy.period_month}
-- Brutto-Aufwandsentschädigung: ${(levy.gross_income || 0).toFixed(2)} €
-- Abgabesatz: ${levy.levy_rate}%
-- Berechnete Abgabe: ${(levy.final_levy || 0).toFixed(2)} €
-- Freibetrag/Abzüge: ${(levy.deductions || 0).toFixed(2)} €
-- Zu zahlende Abgabe: ${(levy.final_levy || 0).toFixed(2)} €
-
-Der Bescheid soll als formeller Brief aufgebaut sein mit vollständigem Briefkopf (Absender oben links, Ort und Datum oben rechts, Empfänger darunter). Professionell und förmlich. Zahlungsziel: 14 Tage nach Erhalt. Bankverbindung: ${orgData?.iban || "[BANKVERBINDUNG EINFÜGEN]"}`;
-
-      const response = await fetch("/api/ai/generate-notice", {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ prompt, levy_data: levy, organization_data: orgData }),
-      });
-      
-      const data = await response.json();
-      if (data.success) {
-        setNoticeText(data.content);
-      } else {
-        throw new Error(data.detail || "Fehler bei der Generierung");
-      }
+      const data = await base44.ai.generateLevyNotice(levy.id);
+      setNoticeText(data.content);
     } catch (error) {
       console.error("Notice generation error:", error);
       // Fallback to template
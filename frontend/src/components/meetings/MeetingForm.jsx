@@ -56,7 +56,16 @@ export default function MeetingForm({ isOpen, open, onClose, meeting, defaultDat
   const generateProtocol = async () => {
     if (!form.agenda) return;
     setGenerating(true);
-    const response = await base44.ai.generateProtocol(`Du bist Protokollant einer kommunalpolitischen Sitzung in Deutschland.
+    const previousMinutes = form.minutes;
+    // Existing minutes stay visible until the first delta replaces them
+    let started = false;
+    const appendMinutes = (delta) => {
+      const first = !started;
+      started = true;
+      setForm((f) => ({ ...f, minutes: (first ? "" : f.minutes || "") + delta }));
+    };
+    try {
+      const response = await base44.ai.streamProtocol(`Du bist Protokollant einer kommunalpolitischen Sitzung in Deutschland.
       
 Sitzung: ${form.title}
 Datum: ${form.date ? new Date(form.date).toLocaleDateString('de-DE') : 'n/a'}
@@ -71,9 +80,15 @@ Erstelle ein professionelles Sitzungsprotokoll im üblichen Format:
 - Beschlüsse und Abstimmungsergebnisse (beispielhaft)
 - Ende der Sitzung
 
-Verwende formale Sprache, ca. 400-600 Wörter.`);
-    setForm((f) => ({ ...f, minutes: response.content || "" }));
-    setGenerating(false);
+Verwende formale Sprache, ca. 400-600 Wörter.`, appendMinutes);
+      setForm((f) => ({ ...f, minutes: response.content || "" }));
+    } catch (error) {
+      console.error(error);
+      setForm((f) => ({ ...f, minutes: previousMinutes }));
+      alert("Protokoll konnte nicht erstellt werden");
+    } finally {
+      setGenerating(false);
+    }
   };
 
   const sendReminder = async () => {
@@ -103,19 +103,15 @@ Gib die Antwort als JSON zurück mit den Feldern "subject" und "body".`;
     const recipients = contacts.filter(c => selectedIds.includes(c.id) && c.email);
     if (!recipients.length || !subject || !body) return;
     setSending(true);
-    let success = 0, failed = 0;
-    for (const c of recipients) {
-      const personalBody = body
-        .replace(/\{vorname\}/gi, c.first_name || "")
-        .replace(/\{nachname\}/gi, c.last_name || "")
-        .replace(/\{name\}/gi, `${c.first_name || ""} ${c.last_name || ""}`.trim());
-      try {
-        await base44.email.sendBulk([c.email], subject, personalBody);
-        success++;
-      } catch { failed++; }
+    try {
+      // Placeholders are filled per recipient on the server; delivery runs in the background
+      const data = await base44.email.sendCampaign({ subject, body, contactIds: recipients.map(c => c.id) });
+      setResult({ success: data.total, failed: data.skipped });
+    } catch (error) {
+      console.error("E-Mail sending error:", error);
+      setResult({ success: 0, failed: recipients.length });
     }
     setSending(false);
-    setResult({ success, failed });
   };
 
   const resetAndClose = () => {
@@ -135,8 +131,8 @@ Gib die Antwort als JSON zurück mit den Feldern "subject" und "body".`;
         {result ? (
           <div className="text-center py-8 space-y-3">
             <CheckCircle2 className="w-12 h-12 text-emerald-500 mx-auto" />
-            <p className="text-lg font-semibold text-slate-800">E-Mails versendet</p>
-            <p className="text-sm text-slate-500">{result.success} erfolgreich, {result.failed} fehlgeschlagen</p>
+            <p className="text-lg font-semibold text-slate-800">Versand gestartet</p>
+            <p className="text-sm text-slate-500">{result.success} E-Mails eingeplant, {result.failed} nicht zugestellt</p>
             <Button onClick={resetAndClose} data-testid="bulk-mail-result-close-button">Schließen</Button>
           </div>
         ) : (
@@ -219,7 +215,7 @@ Gib die Antwort als JSON zurück mit den Feldern "subject" und "body".`;
             </div>
             <div className="space-y-1.5">
               <Label className="text-xs font-medium text-slate-500">
-                Nachricht * <span className="font-normal text-slate-400">(Platzhalter: {"{vorname}"}, {"{nachname}"}, {"{name}"})</span>
+                Nachricht * <span className="font-normal text-slate-400">(Platzhalter: {"{vorname}"}, {"{nachname}"}, {"{name}"}, {"{gruppe}"}, {"{offene_abgabe}"})</span>
               </Label>
               <Textarea value={body} onChange={e => setBody(e.target.value)} rows={6} placeholder="Sehr geehrte/r {name},&#10;&#10;..." data-testid="bulk-mail-body-textarea" />
             </div>
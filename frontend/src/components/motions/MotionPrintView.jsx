@@ -21,7 +21,11 @@ const LOGO_DIMENSIONS = {
   heightPx: 70,
 };
 
-const getLogoSrc = (template) => template?.logo_base64 || template?.logo_url || template?.logo || "";
+const getLogoSrc = (template) =>
+  template?.logo_base64 ||
+  base44.files.derivativeUrl(template?.logo_url, { height: LOGO_DIMENSIONS.heightPx * 3, format: "png" }) ||
+  template?.logo ||
+  "";
 
 const mapMotionTypeToDocType = (type) => {
   if (type === "anfrage") return "fraktionsanfrage";
@@ -42,6 +46,7 @@ export default function MotionPrintView({ motion, open, onClose }) {
     queryKey: ["printTemplates", motion?.organization],
     queryFn: () => base44.entities.PrintTemplate.filter({ organization: motion?.organization }),
     enabled: !!motion?.organization,
+    select: (all) => all.filter((t) => t.document_type !== "levy_notice"),
   });
 
   if (!motion) return null;
@@ -12,6 +12,12 @@ import ElementProperties from "@/components/templateeditor/ElementProperties";
 
 let idCounter = Date.now() + 1000;
 
+// Levy notices are text templates (Jinja syntax) rendered by the backend, not canvas layouts
+const DOCUMENT_TYPES = [
+  { value: "layout", label: "Drucklayout" },
+  { value: "levy_notice", label: "Abgabebescheid" },
+];
+
 export default function TemplateEditor() {
   const queryClient = useQueryClient();
   const [selectedId, setSelectedId] = useState(null);
@@ -20,6 +26,8 @@ export default function TemplateEditor() {
   const [selectedTemplateId, setSelectedTemplateId] = useState("new");
   const [zoom, setZoom] = useState(75);
   const [customCss, setCustomCss] = useState("");
+  const [documentType, setDocumentType] = useState("layout");
+  const [bodyTemplate, setBodyTemplate] = useState("");
 
   const { data: user } = useQuery({
     queryKey: ["currentUser"],
@@ -40,7 +48,9 @@ export default function TemplateEditor() {
       const data = {
         name: templateName,
         organization: user?.organization,
+        document_type: documentType,
         custom_css: JSON.stringify({ elements, css: customCss }),
+        body_template: documentType === "levy_notice" ? bodyTemplate : null,
       };
       if (selectedTemplateId && selectedTemplateId !== 'new') {
         return base44.entities.PrintTemplate.update(selectedTemplateId, data);
@@ -67,10 +77,11 @@ export default function TemplateEditor() {
 
   const setDefaultMutation = useMutation({
     mutationFn: async (templateId) => {
+      // Each document type has its own default
       await Promise.all(
-        templates.map(t =>
-          base44.entities.PrintTemplate.update(t.id, { is_default: t.id === templateId })
-        )
+        templates
+          .filter(t => (t.document_type || "layout") === documentType)
+          .map(t => base44.entities.PrintTemplate.update(t.id, { is_default: t.id === templateId }))
       );
     },
     onSuccess: () => {
@@ -84,12 +95,16 @@ export default function TemplateEditor() {
       setTemplateName('Neue Vorlage');
       setSelectedId(null);
       setSelectedTemplateId('new');
+      setDocumentType('layout');
+      setBodyTemplate('');
       return;
     }
     const t = templates.find(t => t.id === id);
     if (!t) return;
     setSelectedTemplateId(id);
     setTemplateName(t.name);
+    setDocumentType(t.document_type || 'layout');
+    setBodyTemplate(t.body_template || '');
     try {
       const parsed = JSON.parse(t.custom_css || '[]');
       if (Array.isArray(parsed)) {
@@ -106,6 +121,14 @@ export default function TemplateEditor() {
     setSelectedId(null);
   };
 
+  const changeDocumentType = async (type) => {
+    setDocumentType(type);
+    if (type === 'levy_notice' && !bodyTemplate) {
+      const { body_template } = await base44.accounting.getDefaultLevyNoticeTemplate();
+      setBodyTemplate(body_template);
+    }
+  };
+
   const addElement = (el) => {
     setElements(prev => [...prev, el]);
     setSelectedId(el.id);
@@ -164,6 +187,20 @@ export default function TemplateEditor() {
           data-testid="template-name-input"
         />
 
+        {/* Document type */}
+        <Select value={documentType} onValueChange={changeDocumentType}>
+          <SelectTrigger className="w-40 h-8 text-sm" data-testid="template-document-type-trigger">
+            <SelectValue />
+          </SelectTrigger>
+          <SelectContent>
+            {DOCUMENT_TYPES.map(type => (
+              <SelectItem key={type.value} value={type.value} data-testid={`template-document-type-${type.value}`}>
+                {type.label}
+              </SelectItem>
+            ))}
+          </SelectContent>
+        </Select>
+
         <div className="flex-1" />
 
         {/* Zoom */}
@@ -199,6 +236,23 @@ export default function TemplateEditor() {
       </div>
 
       {/* Main area */}
+      {documentType === 'levy_notice' ? (
+        <div className="flex-1 overflow-y-auto p-6">
+          <div className="max-w-3xl mx-auto bg-white rounded-md shadow-sm p-4 space-y-2">
+            <p className="text-xs font-semibold text-slate-600">Bescheid-Text</p>
+            <Textarea
+              value={bodyTemplate}
+              onChange={e => setBodyTemplate(e.target.value)}
+              rows={28}
+              className="font-mono text-xs"
+              data-testid="template-body-textarea"
+            />
+            <p className="text-[10px] text-slate-400">
+              {"Platzhalter: {{ sender.name }}, {{ recipient.name }}, {{ recipient.mandate_type }}, {{ levy.period_month }}, {{ levy.final_levy | euro }}, {{ due_date | date_de }}, {{ today | date_de }}"}
+            </p>
+          </div>
+        </div>
+      ) : (
       <div className="flex flex-1 overflow-hidden">
         {/* Left: Toolbox */}
         <div className="w-40 bg-white border-r flex-shrink-0 overflow-y-auto">
@@ -245,6 +299,7 @@ export default function TemplateEditor() {
           </div>
         </div>
       </div>
+      )}
     </div>
   );
 }
\ No newline at end of file